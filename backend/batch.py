@@ -0,0 +1,38 @@
+import asyncio
+from collections import deque
+
+
+async def run_grouped(items: list, group, concurrency: int, run):
+    """
+    Yield run(item) for every item, in completion order.
+
+    Items are grouped by group(item) and every group is worked off by at most
+    concurrency workers, so a slow group never holds back the others and no more
+    tasks exist than workers. run has to return a result for failed items as well. The
+    workers are cancelled when the caller stops early.
+    """
+
+    pending = {}
+    for item in items:
+        pending.setdefault(group(item), deque()).append(item)
+
+    results = asyncio.Queue()
+
+    async def worker(queue: deque):
+        while queue:
+            results.put_nowait(await run(queue.popleft()))
+
+    workers = [
+        asyncio.create_task(worker(queue))
+        for queue in pending.values()
+        for _ in range(min(concurrency, len(queue)))
+    ]
+
+    try:
+        for _ in range(len(items)):
+            yield await results.get()
+
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
@@ -0,0 +1,97 @@
+import json
+import time
+import hashlib
+
+
+COMPLETION_CACHE_KEY = "completion_cache:{digest}"
+COMPLETION_CACHE_LRU_KEY = "completion_cache_lru"
+
+
+def completion_digest(model: str, messages: list[dict], options: dict) -> str:
+    """Content address of a completion request, independent of key order and extra fields."""
+
+    normalized = json.dumps(
+        {
+            "model": model,
+            "messages": [
+                {"role": message["role"], "content": message["content"]}
+                for message in messages
+            ],
+            "options": options,
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """
+    Completed responses stored in Redis under their request digest.
+
+    Entries expire after ttl seconds and the least recently used entries are evicted
+    once more than max_entries are stored. Recency is tracked in a sorted set scored by
+    the last access time. Hits are replayed in pieces of replay_chunk_size characters
+    to keep the streaming behaviour of a live response, 0 replays them in one piece.
+    """
+
+    def __init__(
+        self,
+        redis,
+        ttl: int = 86400,
+        max_entries: int = 1000,
+        replay_chunk_size: int = 16,
+    ):
+        self.redis = redis
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.replay_chunk_size = replay_chunk_size
+
+    async def get(self, digest: str) -> str | None:
+
+        key = COMPLETION_CACHE_KEY.format(digest=digest)
+
+        content = await self.redis.get(key)
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            if content is None:
+                pipe.zrem(COMPLETION_CACHE_LRU_KEY, digest)
+            else:
+                pipe.zadd(COMPLETION_CACHE_LRU_KEY, {digest: time.time()})
+                pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+        return content
+
+    async def set(self, digest: str, content: str):
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            _, _, size = await (
+                pipe.set(COMPLETION_CACHE_KEY.format(digest=digest), content, ex=self.ttl)
+                .zadd(COMPLETION_CACHE_LRU_KEY, {digest: time.time()})
+                .zcard(COMPLETION_CACHE_LRU_KEY)
+                .execute()
+            )
+
+        if size > self.max_entries:
+            await self._evict(size - self.max_entries)
+
+    async def _evict(self, count: int):
+
+        evicted = await self.redis.zpopmin(COMPLETION_CACHE_LRU_KEY, count)
+
+        if evicted:
+            await self.redis.delete(
+                *[COMPLETION_CACHE_KEY.format(digest=digest) for digest, _ in evicted]
+            )
+
+    def replay(self, content: str):
+
+        if self.replay_chunk_size <= 0:
+            yield content
+            return
+
+        for i in range(0, len(content), self.replay_chunk_size):
+            yield content[i:i + self.replay_chunk_size]
@@ -0,0 +1,100 @@
+import asyncio
+
+
+class _Flight:
+
+    def __init__(self):
+        self.chunks = []
+        self.subscribers = set()
+        self.done = False
+        self.error = None
+        self.task = None
+
+
+_END = object()
+
+
+class StreamCoalescer:
+    """
+    Shares one upstream stream between identical requests that are in flight at once.
+
+    The first request for a key becomes the leader and starts the stream produced by
+    its factory in a task of its own. Every chunk is kept for late joiners and pushed
+    to an unbounded queue per subscriber, so a slow reader only grows its own backlog
+    and never holds back the stream or the other subscribers. A subscriber that goes
+    away just drops its queue, and the upstream stream is cancelled once nobody is
+    listening anymore.
+    """
+
+    def __init__(self):
+        self._flights: dict[str, _Flight] = {}
+
+    def is_leader(self, key: str) -> bool:
+        """Whether a request for key would start a new upstream stream."""
+        return key not in self._flights
+
+    def stream(self, key: str, factory):
+        """
+        Async iterator over the chunks of the stream for key, starting it from factory()
+        if needed. The stream is joined right away, so that the next request for key is
+        a follower even before this one is iterated.
+        """
+
+        flight = self._flights.get(key)
+
+        if flight is None:
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._run(key, flight, factory))
+
+        return self._subscribe(key, flight)
+
+    async def _subscribe(self, key: str, flight: _Flight):
+
+        queue = asyncio.Queue()
+        for chunk in flight.chunks:
+            queue.put_nowait(chunk)
+        if flight.done:
+            queue.put_nowait(_END)
+
+        flight.subscribers.add(queue)
+
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is _END:
+                    break
+                yield chunk
+
+            if flight.error is not None:
+                raise flight.error
+
+        finally:
+            flight.subscribers.discard(queue)
+
+            if not flight.subscribers and not flight.done:
+                # The task may be cancelled before it ever ran its own clean up
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+
+    async def _run(self, key: str, flight: _Flight, factory):
+
+        try:
+            async for chunk in factory():
+                flight.chunks.append(chunk)
+                for queue in flight.subscribers:
+                    queue.put_nowait(chunk)
+
+        except Exception as error:
+            flight.error = error
+
+        finally:
+            flight.done = True
+
+            # New requests for the key start a fresh stream from here on
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+            for queue in flight.subscribers:
+                queue.put_nowait(_END)
@@ -0,0 +1,51 @@
+"""
+One-off migration that de-duplicates session histories inflated by the old `/chat`
+write path, which re-pushed the whole history on every turn.
+
+    REDIS_HOST=redis://localhost:6379 python compact_history.py [--dry-run]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+
+import aioredis
+
+from history import CHAT_HISTORY_KEY, compact_inflated_history, deflate_history
+
+
+async def compact_sessions(redis_url: str, session: str = "*", dry_run: bool = False):
+
+    redis = aioredis.from_url(redis_url, encoding="utf-8", decode_responses=True)
+
+    try:
+        async for key in redis.scan_iter(match=CHAT_HISTORY_KEY.format(session=session)):
+
+            if dry_run:
+                messages = [json.loads(msg) for msg in await redis.lrange(key, 0, -1)]
+                before, after = len(messages), len(deflate_history(messages))
+            else:
+                before, after = await compact_inflated_history(redis, key)
+
+            print(f"{key}: {before} -> {after} messages")
+    finally:
+        await redis.close()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--session", default="*", help="Session name or glob pattern")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    asyncio.run(
+        compact_sessions(
+            os.environ["REDIS_HOST"], session=args.session, dry_run=args.dry_run
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
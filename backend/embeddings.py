@@ -0,0 +1,49 @@
+import base64
+import numpy as np
+
+
+EMBEDDING_KEY = "embedding:{model}:{digest}"
+
+
+class RedisEmbeddingCache:
+    """
+    Embedding vectors stored in Redis by model and prompt digest.
+
+    Vectors are kept as base64 encoded float32 bytes, as the shared Redis connection
+    decodes responses to str. Entries expire after ttl seconds, None keeps them forever.
+    """
+
+    def __init__(self, redis, ttl: int = None):
+        self.redis = redis
+        self.ttl = ttl
+
+    async def get_many(self, model: str, digests: list[str]) -> list[np.ndarray | None]:
+
+        if not digests:
+            return []
+
+        values = await self.redis.mget(
+            [EMBEDDING_KEY.format(model=model, digest=digest) for digest in digests]
+        )
+
+        return [None if value is None else decode_vectors(value) for value in values]
+
+    async def set_many(self, model: str, vectors: dict[str, np.ndarray]):
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for digest, vector in vectors.items():
+                pipe.set(
+                    EMBEDDING_KEY.format(model=model, digest=digest),
+                    encode_vectors(vector),
+                    ex=self.ttl,
+                )
+            await pipe.execute()
+
+
+def encode_vectors(vectors: np.ndarray) -> str:
+    data = np.ascontiguousarray(vectors, dtype=np.float32).tobytes()
+    return base64.b64encode(data).decode()
+
+
+def decode_vectors(data: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32)
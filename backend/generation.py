@@ -0,0 +1,238 @@
+import asyncio
+import uuid
+
+
+GENERATION_STREAM_KEY = "generation:{id}"
+
+# Entry IDs are {offset}-{kind}: the start marker sorts before the chunk at offset 0
+_START_ID = "0-1"
+_ENTRY_SEQUENCE = 2
+_READ_COUNT = 512
+
+_END = object()
+
+
+class GenerationGone(Exception):
+    """The generation is unknown, expired, or the requested offset was trimmed."""
+
+
+class GenerationFailed(Exception):
+    """The generation ended with an error."""
+
+
+class _Generation:
+
+    def __init__(self):
+        self.chunks = []
+        self.subscribers = set()
+        self.done = False
+        self.error = None
+        self.task = None
+
+
+def _entry_id(offset: int) -> str:
+    return f"{offset}-{_ENTRY_SEQUENCE}"
+
+
+def _entry_offset(entry_id: str) -> int:
+    return int(entry_id.split("-", 1)[0])
+
+
+class GenerationStreams:
+    """
+    Generations written to Redis Streams while they are produced, so that a client
+    that lost its connection resumes the answer instead of generating it again.
+
+    Every generation runs in a task of its own, detached from the request that started
+    it, and appends its chunks to the stream generation:{id}. A chunk's entry ID is
+    {offset}-2, offset being the position of its first byte in the UTF-8 encoded
+    answer, so a reader finds the entry holding any offset with a single XREVRANGE.
+    The stream starts with a marker entry and ends with an entry whose `end` field is
+    `done` or `error`. Running streams expire after running_ttl seconds and finished
+    ones after ttl, at most about max_chunks entries are kept.
+
+    Readers in the process that runs a generation are served from memory, the others
+    from the stream, following it live with blocking XREADs.
+    """
+
+    def __init__(
+        self,
+        redis,
+        ttl: int = 600,
+        running_ttl: int = 3600,
+        max_chunks: int = 100000,
+        block_ms: int = 5000,
+    ):
+        self.redis = redis
+        self.ttl = ttl
+        self.running_ttl = running_ttl
+        self.max_chunks = max_chunks
+        self.block_ms = block_ms
+        self._generations: dict[str, _Generation] = {}
+
+    async def start(self, produce, on_finish=None) -> str:
+        """
+        Run the async iterator returned by produce() in a task and return the ID of
+        its stream. on_finish, if given, is awaited with the text produced and the
+        error the generation ended with, if any, once the stream is finished.
+        """
+
+        generation_id = uuid.uuid4().hex
+        key = GENERATION_STREAM_KEY.format(id=generation_id)
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            await (
+                pipe.xadd(key, {"start": "1"}, id=_START_ID)
+                .expire(key, self.running_ttl)
+                .execute()
+            )
+
+        generation = _Generation()
+        self._generations[generation_id] = generation
+        generation.task = asyncio.create_task(
+            self._run(generation_id, generation, produce, on_finish)
+        )
+
+        return generation_id
+
+    async def aclose(self):
+        """Cancel the running generations, their streams end with an error."""
+
+        tasks = [generation.task for generation in self._generations.values()]
+
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, generation_id: str, generation: _Generation, produce, on_finish):
+
+        key = GENERATION_STREAM_KEY.format(id=generation_id)
+        offset = 0
+        stream = produce()
+
+        try:
+            async for chunk in stream:
+
+                if not chunk:
+                    continue
+
+                generation.chunks.append(chunk)
+                for queue in generation.subscribers:
+                    queue.put_nowait(chunk)
+
+                await self.redis.xadd(
+                    key,
+                    {"chunk": chunk},
+                    id=_entry_id(offset),
+                    maxlen=self.max_chunks,
+                    approximate=True,
+                )
+                offset += len(chunk.encode("utf-8"))
+
+        except (Exception, asyncio.CancelledError) as error:
+            generation.error = error
+
+        finally:
+            await stream.aclose()
+
+            generation.done = True
+            del self._generations[generation_id]
+
+            for queue in generation.subscribers:
+                queue.put_nowait(_END)
+
+            end = {"end": "done"}
+            if generation.error is not None:
+                end = {"end": "error", "error": repr(generation.error)}
+
+            async with self.redis.pipeline(transaction=False) as pipe:
+                await pipe.xadd(key, end, id=_entry_id(offset)).expire(key, self.ttl).execute()
+
+        if on_finish is not None:
+            await on_finish("".join(generation.chunks), generation.error)
+
+        if isinstance(generation.error, asyncio.CancelledError):
+            raise generation.error
+
+    def read(self, generation_id: str, offset: int = 0):
+        """
+        Async iterator over the UTF-8 encoded answer of a generation from byte offset
+        on, following it until it ends. Raises GenerationGone when it cannot be read
+        from offset and GenerationFailed once everything was read from a generation
+        that failed.
+        """
+
+        generation = self._generations.get(generation_id)
+
+        if generation is not None:
+            return self._read_memory(generation, offset)
+
+        return self._read_stream(GENERATION_STREAM_KEY.format(id=generation_id), offset)
+
+    async def _read_memory(self, generation: _Generation, offset: int):
+
+        queue = asyncio.Queue()
+        for chunk in generation.chunks:
+            queue.put_nowait(chunk)
+        if generation.done:
+            queue.put_nowait(_END)
+
+        generation.subscribers.add(queue)
+
+        try:
+            position = 0
+
+            while True:
+                chunk = await queue.get()
+                if chunk is _END:
+                    break
+
+                data = chunk.encode("utf-8")
+                if position + len(data) > offset:
+                    yield data[max(offset - position, 0):]
+                position += len(data)
+
+            if generation.error is not None:
+                raise GenerationFailed(repr(generation.error))
+
+        finally:
+            generation.subscribers.discard(queue)
+
+    async def _read_stream(self, key: str, offset: int):
+
+        entries = await self.redis.xrevrange(key, max=_entry_id(offset), min="-", count=1)
+
+        if not entries:
+            if await self.redis.exists(key):
+                raise GenerationGone(f"offset {offset} was trimmed from the stream")
+            raise GenerationGone("unknown or expired generation")
+
+        last_id = None
+
+        while True:
+
+            for entry_id, fields in entries:
+
+                last_id = entry_id
+
+                if "end" in fields:
+                    if _entry_offset(entry_id) < offset:
+                        raise GenerationGone(f"offset {offset} is past the end of the answer")
+                    if fields["end"] == "error":
+                        raise GenerationFailed(fields.get("error", ""))
+                    return
+
+                if "chunk" in fields:
+                    position = _entry_offset(entry_id)
+                    data = fields["chunk"].encode("utf-8")
+                    if position + len(data) > offset:
+                        yield data[max(offset - position, 0):]
+
+            response = await self.redis.xread(
+                {key: last_id}, count=_READ_COUNT, block=self.block_ms
+            )
+            entries = response[0][1] if response else []
+
+            if not entries and not await self.redis.exists(key):
+                raise GenerationGone("the generation expired while it was read")
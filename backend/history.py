@@ -0,0 +1,324 @@
+import json
+import hashlib
+from aioredis.exceptions import WatchError, LockError
+
+
+CHAT_HISTORY_KEY = "chat_history:{session}"
+CHAT_HISTORY_TOKENS_KEY = "chat_history_tokens:{session}"
+CHAT_HISTORY_ARCHIVE_KEY = "chat_history_archive:{session}"
+CHAT_HISTORY_LOCK_KEY = "chat_history_lock:{session}"
+
+# Every key that belongs to a session, removed together with the session
+SESSION_KEYS = [
+    CHAT_HISTORY_KEY,
+    CHAT_HISTORY_TOKENS_KEY,
+    CHAT_HISTORY_ARCHIVE_KEY,
+    CHAT_HISTORY_LOCK_KEY,
+]
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+# Replaces history[1..cut] with a summary message and moves the replaced messages to
+# the archive. Turns appended while the summary was generated are left untouched, and
+# nothing happens if the session was re-created in the meantime.
+_SUMMARIZE_SCRIPT = """
+local cut = tonumber(ARGV[3])
+if redis.call('LINDEX', KEYS[1], 0) ~= ARGV[1]
+    or redis.call('LINDEX', KEYS[1], cut) ~= ARGV[2] then
+    return 0
+end
+local archived = redis.call('LRANGE', KEYS[1], 1, cut)
+for i = 1, #archived, 1000 do
+    redis.call('RPUSH', KEYS[2], unpack(archived, i, math.min(i + 999, #archived)))
+end
+redis.call('LSET', KEYS[1], cut, ARGV[4])
+redis.call('LTRIM', KEYS[1], cut, -1)
+redis.call('LPUSH', KEYS[1], ARGV[1])
+return 1
+"""
+
+
+# Creates the history with the system prompt if the session does not exist yet, and
+# returns the whole history when asked to
+_ENSURE_SESSION_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('RPUSH', KEYS[1], ARGV[1])
+end
+if ARGV[2] == '1' then
+    return redis.call('LRANGE', KEYS[1], 0, -1)
+end
+return {}
+"""
+
+
+async def ensure_session(
+    redis, key: str, system_prompt: str, load: bool = False
+) -> list[dict]:
+    """
+    Create the session history with system_prompt unless it exists, atomically and in a
+    single round-trip. With load the whole history is returned as well.
+    """
+
+    raws = await redis.eval(
+        _ENSURE_SESSION_SCRIPT,
+        1,
+        key,
+        json.dumps({"role": "system", "content": system_prompt}),
+        "1" if load else "0",
+    )
+
+    return [json.loads(raw) for raw in raws]
+
+
+async def load_history(redis, key: str) -> list[dict]:
+    """Load the full message history stored under key."""
+
+    return [json.loads(msg) for msg in await redis.lrange(key, 0, -1)]
+
+
+async def load_history_window(
+    redis,
+    session: str,
+    model: str,
+    count_tokens,
+    max_tokens: int,
+    reserved_tokens: int = 0,
+    page_size: int = 32,
+) -> list[dict]:
+    """
+    Load the system prompt plus the most recent messages that fit in max_tokens.
+
+    The history is read from the tail with `LRANGE -k -1` a page at a time, so only the
+    part of the session that can end up in the prompt is transferred. reserved_tokens
+    is the budget already taken by the messages of the current request. Token counts
+    are cached per stored message and model in CHAT_HISTORY_TOKENS_KEY.
+    """
+
+    key = CHAT_HISTORY_KEY.format(session=session)
+
+    async with redis.pipeline(transaction=False) as pipe:
+        system_raw, length, raws = await (
+            pipe.lindex(key, 0).llen(key).lrange(key, -page_size, -1).execute()
+        )
+
+    if system_raw is None:
+        return []
+
+    token_cache = _TokenCache(redis, session, model, count_tokens)
+
+    system_tokens, = await token_cache.counts([system_raw])
+    budget = max_tokens - reserved_tokens - system_tokens
+
+    window = []
+    start = length - len(raws)
+
+    while True:
+
+        # The system prompt at index 0 is always kept and counted separately
+        if start == 0:
+            raws = raws[1:]
+            start = 1
+
+        full = False
+        for raw, tokens in reversed(list(zip(raws, await token_cache.counts(raws)))):
+            if tokens > budget:
+                full = True
+                break
+            budget -= tokens
+            window.append(raw)
+
+        if full or start <= 1:
+            break
+
+        end, start = start, max(start - page_size, 0)
+        raws = await redis.lrange(key, start, end - 1)
+
+    window = [json.loads(raw) for raw in reversed(window)]
+
+    # Do not start the window in the middle of a turn
+    while window and window[0]["role"] == "assistant":
+        window.pop(0)
+
+    return [json.loads(system_raw)] + window
+
+
+class _TokenCache:
+
+    def __init__(self, redis, session: str, model: str, count_tokens):
+        self.redis = redis
+        self.key = CHAT_HISTORY_TOKENS_KEY.format(session=session)
+        self.model = model
+        self.count_tokens = count_tokens
+
+    def _field(self, raw: str) -> str:
+        return f"{self.model}:{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+    async def counts(self, raws: list[str]) -> list[int]:
+
+        if not raws:
+            return []
+
+        fields = [self._field(raw) for raw in raws]
+        counts = await self.redis.hmget(self.key, fields)
+
+        missing = {}
+        for i, count in enumerate(counts):
+            if count is None:
+                counts[i] = self.count_tokens(json.loads(raws[i]))
+                missing[fields[i]] = counts[i]
+            else:
+                counts[i] = int(count)
+
+        if missing:
+            await self.redis.hset(self.key, mapping=missing)
+
+        return counts
+
+
+async def append_history(redis, key: str, messages: list[dict]) -> int:
+    """
+    Append messages to the end of the history in a single MULTI/EXEC round-trip.
+    Returns the length of the history after the append.
+    """
+
+    if not messages:
+        return await redis.llen(key)
+
+    async with redis.pipeline(transaction=True) as pipe:
+        length, = await pipe.rpush(
+            key, *[json.dumps(message) for message in messages]
+        ).execute()
+
+    return length
+
+
+async def summarize_history(
+    redis,
+    session: str,
+    summarize,
+    max_messages: int,
+    keep_messages: int,
+    lock_timeout: int = 300,
+) -> bool:
+    """
+    Summarize the oldest turns of a session once it holds more than max_messages.
+
+    Everything but the system prompt and the newest keep_messages messages is replaced
+    by a single summary message produced by summarize, an async callable taking the
+    messages to summarize and returning the summary text. The replaced messages are
+    moved to CHAT_HISTORY_ARCHIVE_KEY. A per-session lock makes concurrent turns skip
+    the summary instead of racing. Returns True if the history was summarized.
+    """
+
+    key = CHAT_HISTORY_KEY.format(session=session)
+
+    lock = redis.lock(CHAT_HISTORY_LOCK_KEY.format(session=session), timeout=lock_timeout)
+
+    if not await lock.acquire(blocking=False):
+        return False
+
+    try:
+        raws = await redis.lrange(key, 0, -1)
+
+        if len(raws) <= max_messages:
+            return False
+
+        messages = [json.loads(raw) for raw in raws]
+
+        # Index of the last summarized message, the kept tail starts with a user turn
+        cut = len(messages) - keep_messages - 1
+        while cut < len(messages) - 1 and messages[cut + 1]["role"] != "user":
+            cut += 1
+
+        if cut < 2:
+            return False
+
+        summary = await summarize(messages[1:cut + 1])
+
+        summary_raw = json.dumps(
+            {"role": "system", "content": SUMMARY_PREFIX + summary}
+        )
+
+        return bool(
+            await redis.eval(
+                _SUMMARIZE_SCRIPT,
+                2,
+                key,
+                CHAT_HISTORY_ARCHIVE_KEY.format(session=session),
+                raws[0],
+                raws[cut],
+                cut,
+                summary_raw,
+            )
+        )
+
+    finally:
+        try:
+            await lock.release()
+        except LockError:
+            # The lock expired while summarizing
+            pass
+
+
+def deflate_history(messages: list[dict]) -> list[dict]:
+    """
+    Undo the history inflation caused by re-pushing the whole history on every turn.
+
+    An inflated history has the shape `H + H + new`, where `H` is the (itself inflated)
+    history of the previous turn, so the longest duplicated prefix is peeled off
+    recursively. Histories that were written append-only are returned unchanged.
+    """
+
+    tail = []
+
+    while True:
+        half = _duplicated_prefix_length(messages)
+        if half == 0:
+            break
+        tail = messages[2 * half:] + tail
+        messages = messages[:half]
+
+    return messages + tail
+
+
+def _duplicated_prefix_length(messages: list[dict]) -> int:
+
+    # Only a re-pushed history repeats the leading system prompt
+    if len(messages) < 2 or messages[0].get("role") != "system":
+        return 0
+
+    for half in range(len(messages) // 2, 0, -1):
+        if messages[:half] == messages[half:2 * half]:
+            return half
+
+    return 0
+
+
+async def compact_inflated_history(redis, key: str) -> tuple[int, int]:
+    """
+    Rewrite the history under key without the duplicated prefixes.
+    Returns the length before and after the rewrite.
+    """
+
+    async with redis.pipeline(transaction=True) as pipe:
+        while True:
+            try:
+                await pipe.watch(key)
+                messages = [json.loads(msg) for msg in await pipe.lrange(key, 0, -1)]
+                deflated = deflate_history(messages)
+
+                if len(deflated) == len(messages):
+                    await pipe.unwatch()
+                    return len(messages), len(messages)
+
+                pipe.multi()
+                pipe.delete(key)
+                pipe.rpush(key, *[json.dumps(message) for message in deflated])
+                await pipe.execute()
+
+                return len(messages), len(deflated)
+
+            except WatchError:
+                # A turn was appended while compacting, start over
+                continue
+
@@ -1,17 +1,41 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Query, Request
+from typing import Literal, Optional
 import aioredis
 from contextlib import asynccontextmanager
 from pydantic import BaseModel, Field
 import json
-from fastapi.responses import StreamingResponse
-from fastapi import BackgroundTasks
+from fastapi.responses import Response, StreamingResponse
 import os
+import time
 import litellm 
 import asyncio
+import uuid
+from history import (
+    CHAT_HISTORY_KEY,
+    SESSION_KEYS,
+    ensure_session,
+    load_history,
+    load_history_window,
+    append_history,
+    summarize_history,
+)
+from cache import CompletionCache, completion_digest
+from coalesce import StreamCoalescer
+from scheduler import Scheduler, QueueFull, parse_model_limits
+from router import OllamaRouter, ollama_model_name
+from embeddings import RedisEmbeddingCache, encode_vectors
+from generation import GenerationStreams, GenerationGone, GenerationFailed
+from batch import run_grouped
+import metrics
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+SUMMARY_SYSTEM_PROMPT = (
+    "Summarize the following conversation between a user and an assistant. "
+    "Keep facts, decisions, code and open questions that later turns may refer to. "
+    "Answer with the summary only."
+)
 
 
-CHAT_HISTORY_KEY = "chat_history:{session}"
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
 
@@ -21,7 +45,54 @@ async def lifespan(app: FastAPI):
         decode_responses=True
     )
 
+    app.state.completion_cache = CompletionCache(
+        app.state.redis,
+        ttl=int(os.environ.get("COMPLETION_CACHE_TTL", 86400)),
+        max_entries=int(os.environ.get("COMPLETION_CACHE_MAX_ENTRIES", 1000)),
+        replay_chunk_size=int(os.environ.get("COMPLETION_CACHE_REPLAY_CHUNK_SIZE", 16)),
+    )
+
+    app.state.coalescer = StreamCoalescer()
+
+    app.state.generations = GenerationStreams(
+        app.state.redis,
+        ttl=int(os.environ.get("GENERATION_STREAM_TTL", 600)),
+        running_ttl=int(os.environ.get("GENERATION_STREAM_RUNNING_TTL", 3600)),
+        max_chunks=int(os.environ.get("GENERATION_STREAM_MAX_CHUNKS", 100000)),
+    )
+    # Recordings of cached answers, which outlive their request like generations do
+    app.state.detached = set()
+
+    app.state.batch_max_concurrency = int(os.environ.get("BATCH_MAX_CONCURRENCY", 4))
+
+    app.state.scheduler = Scheduler(
+        max_inflight=int(os.environ.get("SCHEDULER_MAX_INFLIGHT", 4)),
+        max_queued=int(os.environ.get("SCHEDULER_MAX_QUEUED", 64)),
+        max_queued_per_session=int(os.environ.get("SCHEDULER_MAX_QUEUED_PER_SESSION", 4)),
+        model_max_inflight=parse_model_limits(
+            os.environ.get("SCHEDULER_MODEL_MAX_INFLIGHT", "")
+        ),
+    )
+
+    app.state.embedding_cache = RedisEmbeddingCache(
+        app.state.redis,
+        ttl=int(os.environ.get("EMBEDDING_CACHE_TTL", 0)) or None,
+    )
+
+    ollama_base_urls = os.environ.get(
+        "OLLAMA_API_BASE_URLS", os.environ.get("OLLAMA_API_BASE_URL", "")
+    )
+    app.state.router = OllamaRouter(
+        [url.strip() for url in ollama_base_urls.split(",") if url.strip()],
+        probe_interval=float(os.environ.get("OLLAMA_PROBE_INTERVAL", 30)),
+        retry_on=(litellm.exceptions.APIConnectionError, ConnectionError),
+    )
+    router_probes = asyncio.create_task(app.state.router.run_probes())
+
     yield
+    router_probes.cancel()
+    await app.state.generations.aclose()
+    await app.state.router.aclose()
     await app.state.redis.close()
 
 app = FastAPI(lifespan=lifespan)
@@ -35,12 +106,13 @@ class SessionData(BaseModel):
 @app.post("/session/delete")
 async def delete_session(request_body: SessionData):
 
-    if request_body.name == "*":
-        match_pattern = CHAT_HISTORY_KEY.format(session="*") 
-        async for key in app.state.redis.scan_iter(match=match_pattern):
-            await app.state.redis.delete(key)
-    else:
-        await app.state.redis.delete(CHAT_HISTORY_KEY.format(session=request_body.name))
+    for session_key in SESSION_KEYS:
+        if request_body.name == "*":
+            match_pattern = session_key.format(session="*")
+            async for key in app.state.redis.scan_iter(match=match_pattern):
+                await app.state.redis.delete(key)
+        else:
+            await app.state.redis.delete(session_key.format(session=request_body.name))
 
 
 @app.post("/session/create")
@@ -71,75 +143,437 @@ class ChatRequestData(BaseModel):
     class Options(BaseModel):
         seed: int = 101
         temperature: float = 0
+        max_context_tokens: Optional[int] = None
+        compact_after: Optional[int] = None
+        summary_model: Optional[str] = None
+        # bypass: no cache, read: serve hits and store misses, write: always regenerate
+        # and store. Defaults to read for deterministic (temperature 0) requests.
+        cache: Optional[Literal["bypass", "read", "write"]] = None
 
     class Message(BaseModel):
         role: str
         content: str
 
     session: str = "empty"
+    # Creates the session with this system prompt if it does not exist yet
+    system_prompt: Optional[str] = None
     record: bool = True
     model: str
     messages: list[Message]
     options: Options = Options()
 
+def resolve_cache_mode(options: ChatRequestData.Options) -> str:
+    """The cache mode of a request, read for deterministic requests unless it is set."""
+
+    if options.cache is not None:
+        return options.cache
+
+    return "read" if options.temperature == 0 else "bypass"
+
+
+async def stream_completion(model: str, messages: list[dict], **kwargs):
+    """Yield the content of a streamed completion, Ollama models are routed over the replicas."""
+
+    async def open_stream(api_base: str = None):
+        if api_base is not None:
+            kwargs["api_base"] = api_base
+        return await litellm.acompletion(
+            model=model, messages=messages, stream=True, **kwargs
+        )
+
+    if "ollama" in model:
+        chunks = app.state.router.stream(model, open_stream)
+    else:
+        chunks = await open_stream()
+
+    async for chunk in chunks:
+        try:
+            content = chunk["choices"][0]["delta"].content
+            if content is None:
+                continue
+            yield content
+        except StopIteration:
+            pass
+
+
+async def summarize_messages(model: str, session: str, messages: list[dict]) -> str:
+
+    transcript = "\n\n".join(
+        f"{message['role']}: {message['content']}" for message in messages
+    )
+
+    async with app.state.scheduler.slot(model, session):
+        summary = [
+            content
+            async for content in stream_completion(
+                model,
+                [
+                    {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                    {"role": "user", "content": transcript},
+                ],
+                temperature=0,
+            )
+        ]
+
+    return "".join(summary)
+
+
+def detach(coroutine):
+    """Run coroutine in a task of its own, which is kept until it is done."""
+
+    task = asyncio.create_task(coroutine)
+    app.state.detached.add(task)
+    task.add_done_callback(app.state.detached.discard)
+
+
+async def read_generation(generation_id: str, offset: int = 0, model: str = None):
+    """Yield a generation to a client, counting the clients that go away before its end."""
+
+    reader = app.state.generations.read(generation_id, offset)
+
+    try:
+        async for data in reader:
+            yield data
+
+    except (asyncio.CancelledError, GeneratorExit):
+        if model is not None:
+            metrics.CLIENT_DISCONNECTS.labels(metrics.model_label(model)).inc()
+        raise
+
+    finally:
+        await reader.aclose()
+
+
 @app.post("/chat")
-async def chat(request_body: ChatRequestData, background_tasks: BackgroundTasks):
+async def chat(request_body: ChatRequestData, request: Request):
 
     chat_history_key = CHAT_HISTORY_KEY.format(session=request_body.session)
 
     use_redis = request_body.session != "empty"
 
-    messagages = [dict(message) for message in request_body.messages]
+    new_messages = [dict(message) for message in request_body.messages]
+
+    messagages = new_messages
+
+    history_start = time.perf_counter()
+
+    history = None
+    if use_redis and request_body.system_prompt is not None:
+        history = await ensure_session(
+            app.state.redis,
+            chat_history_key,
+            request_body.system_prompt,
+            load=request_body.options.max_context_tokens is None,
+        )
+
+    if use_redis and request_body.options.max_context_tokens is not None:
+        def count_tokens(message):
+            return litellm.token_counter(model=request_body.model, messages=[message])
+
+        messagages = await load_history_window(
+            app.state.redis,
+            session=request_body.session,
+            model=request_body.model,
+            count_tokens=count_tokens,
+            max_tokens=request_body.options.max_context_tokens,
+            reserved_tokens=litellm.token_counter(
+                model=request_body.model, messages=new_messages
+            ),
+        ) + new_messages
+    elif history is not None:
+        messagages = history + new_messages
+    elif use_redis:
+        messagages = await load_history(app.state.redis, chat_history_key) + new_messages
 
     if use_redis:
+        metrics.HISTORY_LOAD_SECONDS.labels(
+            "window" if request_body.options.max_context_tokens is not None else "full"
+        ).observe(time.perf_counter() - history_start)
+        metrics.observe_history(messagages[: len(messagages) - len(new_messages)])
+
+    cache_mode = resolve_cache_mode(request_body.options)
+
+    digest = completion_digest(
+        request_body.model,
+        messagages,
+        {
+            "seed": request_body.options.seed,
+            "temperature": request_body.options.temperature,
+        },
+    )
 
-        previous_messagages = [
-            json.loads(msg) for msg in await app.state.redis.lrange(chat_history_key, 0, -1)
-        ]
+    cached_content = None
+    if cache_mode == "read":
+        cached_content = await app.state.completion_cache.get(digest)
+
+    async def cached_value_generator():
+        for content in app.state.completion_cache.replay(cached_content):
+            yield content.encode("utf-8")
+
+    # Stateless requests are queued fairly per client instead of per session
+    queue_session = request_body.session if use_redis else request.client.host
+
+    async def completion_stream():
+        completion = ""
+        async with app.state.scheduler.slot(
+            request_body.model, queue_session, reservation
+        ):
+            with metrics.StreamTimer(request_body.model) as timer:
+                async for content in stream_completion(
+                    request_body.model,
+                    messagages,
+                    temperature=request_body.options.temperature,
+                    # seed=request_body.options.seed,
+                ):
+                    timer.token()
+                    completion += content
+                    yield content
+
+        # Only responses that streamed to completion are cached
+        if cache_mode != "bypass" and completion:
+            await app.state.completion_cache.set(digest, completion)
+
+    record = use_redis and request_body.record
+
+    async def record_turn(content: str, error: Exception = None):
+        # Only the new turn is appended, the stored history is never re-written. What
+        # was generated before an error or a lost connection is recorded as well.
+        turn = list(new_messages)
+        if content:
+            turn.append({"role": "assistant", "content": content})
+        length = await append_history(app.state.redis, chat_history_key, turn)
+
+        compact_after = request_body.options.compact_after
+        if compact_after is not None and length > compact_after:
+            summary_model = request_body.options.summary_model or request_body.model
+            await summarize_history(
+                app.state.redis,
+                session=request_body.session,
+                summarize=lambda messages: summarize_messages(
+                    summary_model, request_body.session, messages
+                ),
+                max_messages=compact_after,
+                keep_messages=compact_after // 2,
+            )
+
+    if cached_content is not None:
+        if record:
+            detach(record_turn(cached_content))
+
+        return StreamingResponse(
+            cached_value_generator(),
+            media_type="text/plain",
+            headers={"X-Cache": "HIT"},
+        )
 
-        previous_messagages.extend(messagages)
-        messagages = previous_messagages
+    # Identical requests that are not recorded share a single upstream stream
+    coalesce = not record
+
+    leader = not coalesce or app.state.coalescer.is_leader(digest)
+
+    headers = {"X-Cache": "BYPASS" if cache_mode == "bypass" else "MISS"}
+    if coalesce:
+        headers["X-Coalesced"] = "leader" if leader else "follower"
+
+    # Followers of a coalesced stream do not take a slot of their own
+    reservation = None
+    if leader:
+        try:
+            reservation = app.state.scheduler.admit(request_body.model, queue_session)
+        except QueueFull as error:
+            metrics.REJECTED_REQUESTS.labels(metrics.model_label(request_body.model)).inc()
+            raise HTTPException(
+                status_code=429, detail=str(error), headers={"Retry-After": "1"}
+            )
+        headers["X-Queue-Position"] = str(reservation.position)
+
+    if coalesce:
+        # Joined before the first await, concurrent identical requests follow this one
+        chunks = app.state.coalescer.stream(digest, completion_stream)
+
+    def produce():
+        if coalesce:
+            return chunks
+        return completion_stream()
+
+    async def finish(content: str, error: Exception = None):
+        if reservation is not None:
+            # Frees the reservation of a completion that never got to take its slot
+            app.state.scheduler.cancel(reservation)
+        if record:
+            await record_turn(content, error)
+
+    # The generation runs on without the client, which can resume it from the stream
+    try:
+        generation_id = await app.state.generations.start(produce, on_finish=finish)
+    except BaseException:
+        if reservation is not None:
+            app.state.scheduler.cancel(reservation)
+        raise
+    headers["X-Stream-Id"] = generation_id
+
+    return StreamingResponse(
+        read_generation(generation_id, model=request_body.model),
+        media_type="text/plain",
+        headers=headers,
+    )
 
-        if request_body.record:
-            for message in messagages:
-                await app.state.redis.rpush(chat_history_key, json.dumps(message))
-        # Grab all of msg history
 
-    assistant_response = {"role": "assistant", "content": ""}
+@app.get("/chat/resume")
+async def resume_chat(
+    generation_id: str = Query(alias="id"), offset: int = Query(0, ge=0)
+):
+    """Continue the answer of a /chat request from a byte offset, see X-Stream-Id."""
+
+    reader = app.state.generations.read(generation_id, offset)
+
+    # Fail with a status code while it is still possible, before the first byte
+    try:
+        first = await reader.__anext__()
+    except StopAsyncIteration:
+        first = b""
+    except GenerationGone as error:
+        raise HTTPException(status_code=404, detail=str(error))
+    except GenerationFailed as error:
+        raise HTTPException(status_code=502, detail=str(error))
+
+    async def resumed():
+        try:
+            yield first
+            async for data in reader:
+                yield data
+        finally:
+            await reader.aclose()
+
+    return StreamingResponse(
+        resumed(), media_type="text/plain", headers={"X-Stream-Id": generation_id}
+    )
 
-    completion_kwargs = {}
-    if "ollama" in request_body.model:
-        completion_kwargs["api_base"] = os.environ["OLLAMA_API_BASE_URL"]
 
-    async def returned_value_generator(assistant_response):
-        response = await litellm.acompletion(
-            model=request_body.model, 
-            messages=messagages,
-            temperature=request_body.options.temperature,
-            # seed=request_body.options.seed,
-            stream=True,
-            **completion_kwargs
-        )
-        async for chunk in response:
-            try:
-                content = chunk["choices"][0]["delta"].content
-                if content is None:
-                    continue
-                assistant_response["content"] += content
-                yield content.encode("utf-8")
-            except StopIteration:
-                pass
+class BatchItemData(BaseModel):
+
+    id: Optional[str] = None
+    model: str
+    messages: list[ChatRequestData.Message]
+    options: ChatRequestData.Options = ChatRequestData.Options()
+
 
-    # Generate and stream the response
-    response = StreamingResponse(
-        returned_value_generator(assistant_response), media_type="text/plain"
+async def complete_batch_item(item: BatchItemData, queue_session: str) -> dict:
+
+    messages = [dict(message) for message in item.messages]
+    cache_mode = resolve_cache_mode(item.options)
+
+    digest = completion_digest(
+        item.model,
+        messages,
+        {"seed": item.options.seed, "temperature": item.options.temperature},
     )
 
-    if request_body.record:
-        async def push_to_redis_after_response():
-            if use_redis and assistant_response:
-                await app.state.redis.rpush(chat_history_key, json.dumps(assistant_response))
+    if cache_mode == "read":
+        cached_content = await app.state.completion_cache.get(digest)
+        if cached_content is not None:
+            return {"id": item.id, "content": cached_content, "cached": True}
+
+    completion = []
+    async with app.state.scheduler.slot(item.model, queue_session):
+        with metrics.StreamTimer(item.model) as timer:
+            async for content in stream_completion(
+                item.model, messages, temperature=item.options.temperature
+            ):
+                timer.token()
+                completion.append(content)
+
+    completion = "".join(completion)
 
-        background_tasks.add_task(push_to_redis_after_response)
+    if cache_mode != "bypass" and completion:
+        await app.state.completion_cache.set(digest, completion)
+
+    return {"id": item.id, "content": completion, "cached": False}
+
+
+@app.post("/chat/batch")
+async def chat_batch(request: Request, concurrency: int = Query(None, ge=1)):
+    """
+    Run stateless chat requests given as JSON lines, each with an `id` (defaults to
+    its line number), `model`, `messages` and `options`. Results are streamed back as
+    JSON lines in completion order, `{"id", "content", "cached"}` or `{"id", "error"}`.
+    At most `concurrency` (and BATCH_MAX_CONCURRENCY) requests per model run at once.
+    """
+
+    concurrency = min(
+        concurrency or app.state.batch_max_concurrency, app.state.batch_max_concurrency
+    )
+    # The batch shares the model queues round-robin with the interactive sessions
+    queue_session = f"batch:{uuid.uuid4().hex}"
+
+    items = []
+    for number, line in enumerate((await request.body()).splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+            if not isinstance(data, dict):
+                raise ValueError("a batch line has to be a JSON object")
+            # Ids are matched as strings, a numeric id is the same id
+            item = BatchItemData(**{**data, "id": str(data.get("id", number))})
+        except ValueError as error:
+            item = {"id": str(number), "error": str(error)}
+        items.append(item)
+
+    async def run(item) -> dict:
+        if isinstance(item, dict):
+            return item
+        try:
+            return await complete_batch_item(item, queue_session)
+        except Exception as error:
+            return {"id": item.id, "error": repr(error)}
+
+    async def results():
+        async for result in run_grouped(
+            items,
+            group=lambda item: getattr(item, "model", None),
+            concurrency=concurrency,
+            run=run,
+        ):
+            yield (json.dumps(result) + "\n").encode("utf-8")
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+class EmbeddingRequestData(BaseModel):
+
+    model: str
+    texts: list[str]
+    concurrency: int = 8
+
+
+@app.post("/embeddings")
+async def embeddings(request_body: EmbeddingRequestData):
+    """
+    Embed many texts with an Ollama model, vectors are cached by content.
+    The float32 matrix is returned base64 encoded in row-major order.
+    """
+
+    replicas = app.state.router.rank(request_body.model)
+    if not replicas:
+        raise HTTPException(status_code=503, detail="No Ollama replica configured")
+    replica = replicas[0]
+
+    vectors = await replica.wrapper.generate_embeddings_batch(
+        ollama_model_name(request_body.model),
+        request_body.texts,
+        concurrency=request_body.concurrency,
+        cache=app.state.embedding_cache,
+    )
 
-    return response
\ No newline at end of file
+    return {
+        "model": request_body.model,
+        "shape": list(vectors.shape),
+        "dtype": "float32",
+        "data": encode_vectors(vectors),
+    }
@@ -0,0 +1,139 @@
+import time
+import asyncio
+from prometheus_client import Counter, Gauge, Histogram
+
+
+# Models are named by the clients, only this many get a label of their own
+MAX_MODEL_LABELS = 32
+OTHER_MODEL = "other"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+MESSAGE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+TOKEN_BUCKETS = (64, 256, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072, 262144)
+
+HISTORY_LOAD_SECONDS = Histogram(
+    "llm_shell_history_load_seconds",
+    "Time to load the chat history from Redis.",
+    ["mode"],
+    buckets=LATENCY_BUCKETS,
+)
+HISTORY_MESSAGES = Histogram(
+    "llm_shell_history_messages",
+    "Messages of the chat history sent with a request.",
+    buckets=MESSAGE_BUCKETS,
+)
+HISTORY_TOKENS = Histogram(
+    "llm_shell_history_tokens",
+    "Estimated tokens of the chat history sent with a request, four characters per token.",
+    buckets=TOKEN_BUCKETS,
+)
+TIME_TO_FIRST_TOKEN_SECONDS = Histogram(
+    "llm_shell_time_to_first_token_seconds",
+    "Time from opening the completion stream to its first token.",
+    ["model"],
+    buckets=LATENCY_BUCKETS,
+)
+TOKENS_PER_SECOND = Histogram(
+    "llm_shell_tokens_per_second",
+    "Streamed chunks per second after the first one, one chunk is about one token.",
+    ["model"],
+    buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500),
+)
+STREAM_DURATION_SECONDS = Histogram(
+    "llm_shell_stream_duration_seconds",
+    "Duration of completion streams, by how they ended.",
+    ["model", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+INFLIGHT_STREAMS = Gauge(
+    "llm_shell_inflight_streams",
+    "Completion streams currently running.",
+    ["model"],
+)
+STREAM_ERRORS = Counter(
+    "llm_shell_stream_errors_total",
+    "Completion streams that failed.",
+    ["model"],
+)
+CLIENT_DISCONNECTS = Counter(
+    "llm_shell_client_disconnects_total",
+    "Responses whose client went away before the end, the generation carries on.",
+    ["model"],
+)
+REJECTED_REQUESTS = Counter(
+    "llm_shell_rejected_requests_total",
+    "Requests rejected because the queue of the model was full.",
+    ["model"],
+)
+
+_model_labels = set()
+
+
+def model_label(model: str) -> str:
+    """model itself for the first MAX_MODEL_LABELS models seen, OTHER_MODEL after that."""
+
+    if model in _model_labels:
+        return model
+
+    if len(_model_labels) < MAX_MODEL_LABELS:
+        _model_labels.add(model)
+        return model
+
+    return OTHER_MODEL
+
+
+def observe_history(messages: list[dict]):
+    HISTORY_MESSAGES.observe(len(messages))
+    HISTORY_TOKENS.observe(sum(len(message["content"]) for message in messages) // 4)
+
+
+class StreamTimer:
+    """
+    Instruments a completion stream: counts it in flight while the block runs, records
+    the time to the first token, the token rate and the duration, and counts errors.
+    Call token() for every streamed chunk.
+    """
+
+    def __init__(self, model: str):
+        self.model = model_label(model)
+        self.tokens = 0
+        self.start = None
+        self.first_token = None
+
+    def __enter__(self):
+        INFLIGHT_STREAMS.labels(self.model).inc()
+        self.start = time.perf_counter()
+        return self
+
+    def token(self):
+
+        self.tokens += 1
+
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+            TIME_TO_FIRST_TOKEN_SECONDS.labels(self.model).observe(
+                self.first_token - self.start
+            )
+
+    def __exit__(self, exc_type, exc, traceback):
+
+        end = time.perf_counter()
+
+        INFLIGHT_STREAMS.labels(self.model).dec()
+
+        if exc_type is None:
+            outcome = "completed"
+        elif issubclass(exc_type, (asyncio.CancelledError, GeneratorExit)):
+            outcome = "cancelled"
+        else:
+            outcome = "error"
+            STREAM_ERRORS.labels(self.model).inc()
+
+        STREAM_DURATION_SECONDS.labels(self.model, outcome).observe(end - self.start)
+
+        if self.tokens > 1 and end > self.first_token:
+            TOKENS_PER_SECOND.labels(self.model).observe(
+                (self.tokens - 1) / (end - self.first_token)
+            )
+
+        return False
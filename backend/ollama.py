@@ -1,93 +1,291 @@
-import requests
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, List, Any, AsyncIterator, Iterator
 import json
+import asyncio
+import hashlib
+import threading
 import httpx
+import numpy as np
 
 
+DEFAULT_TIMEOUT = httpx.Timeout(10.0, read=300.0)
+DEFAULT_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=16)
 
-class OllamaWrapper:
-    def __init__(self, base_url: str):
-        self.base_url = base_url
 
-    def _post_request(
+class AsyncOllamaWrapper:
+    """
+    Async client for the Ollama REST API.
+
+    Requests go through a pooled httpx.AsyncClient with keep-alive, which can be shared
+    between wrappers for different base urls. Streaming endpoints are async generators
+    that yield every NDJSON line as soon as it arrives.
+    """
+
+    def __init__(
         self,
-        endpoint: str,
-        payload: Dict[str, Any],
-        stream: bool = False,
+        base_url: str,
+        client: httpx.AsyncClient = None,
+        timeout: httpx.Timeout = DEFAULT_TIMEOUT,
     ):
-        url = f"{self.base_url}/{endpoint}"
+        self.base_url = base_url.rstrip("/")
+        self._owns_client = client is None
+        self.client = (
+            client
+            if client is not None
+            else httpx.AsyncClient(timeout=timeout, limits=DEFAULT_LIMITS)
+        )
+
+    async def aclose(self):
+        if self._owns_client:
+            await self.client.aclose()
 
-        response = requests.post(url, json=payload, stream=True)
-       
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def _get_request(self, endpoint: str) -> Dict[str, Any]:
+        response = await self.client.get(f"{self.base_url}/{endpoint}")
+        response.raise_for_status()
+        return response.json()
+
+    async def _post_request(self, endpoint: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        response = await self.client.post(
+            f"{self.base_url}/{endpoint}", json={**payload, "stream": False}
+        )
         response.raise_for_status()
+        return response.json()
 
-        if stream:
-            for line in response.iter_lines():
-                decoded_line = line.decode('utf-8')
-                yield json.loads(decoded_line)
-        else:
-            yield response.json()
+    async def _stream_request(
+        self, endpoint: str, payload: Dict[str, Any]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        async with self.client.stream(
+            "POST", f"{self.base_url}/{endpoint}", json={**payload, "stream": True}
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line:
+                    yield json.loads(line)
 
     def generate_completion(
         self, model: str, prompt: str, images: Optional[List[str]] = None, **kwargs
-    ):
+    ) -> AsyncIterator[Dict[str, Any]]:
         """Generate a response for a given prompt with a provided model."""
+        return self._stream_request(
+            "api/generate", {"model": model, "prompt": prompt, "images": images, **kwargs}
+        )
+
+    def generate_chat_completion(
+        self, model: str, messages: List[Dict[str, Any]], **kwargs
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Generate the next message in a chat with a provided model."""
+        return self._stream_request(
+            "api/chat", {"model": model, "messages": messages, **kwargs}
+        )
+
+    async def create_model(
+        self, name: str, modelfile: Optional[str] = None, **kwargs
+    ) -> Dict[str, Any]:
+        """Create a model from a Modelfile."""
+        return await self._post_request(
+            "api/create", {"name": name, "modelfile": modelfile, **kwargs}
+        )
+
+    async def show_model_information(self, name: str) -> Dict[str, Any]:
+        """Show information about a model."""
+        return await self._post_request("api/show", {"name": name})
+
+    async def copy_model(self, source: str, destination: str) -> Dict[str, Any]:
+        """Copy a model."""
+        return await self._post_request(
+            "api/copy", {"source": source, "destination": destination}
+        )
+
+    async def delete_model(self, name: str) -> Dict[str, Any]:
+        """Delete a model and its data."""
+        response = await self.client.request(
+            "DELETE", f"{self.base_url}/api/delete", json={"name": name}
+        )
+        response.raise_for_status()
+        return {}
+
+    async def pull_model(self, name: str, **kwargs) -> Dict[str, Any]:
+        """Download a model from the ollama library."""
+        return await self._post_request("api/pull", {"name": name, **kwargs})
+
+    async def push_model(self, name: str, **kwargs) -> Dict[str, Any]:
+        """Upload a model to a model library."""
+        return await self._post_request("api/push", {"name": name, **kwargs})
+
+    async def generate_embeddings(self, model: str, prompt: str, **kwargs) -> Dict[str, Any]:
+        """Generate embeddings from a model."""
+        return await self._post_request(
+            "api/embeddings", {"model": model, "prompt": prompt, **kwargs}
+        )
 
-        return self._post_request(
-            "api/generate",
-            {"model": model, "prompt": prompt, "images": images, **kwargs},
-            stream=True,
+    async def generate_embeddings_batch(
+        self,
+        model: str,
+        prompts: List[str],
+        concurrency: int = 8,
+        cache=None,
+        **kwargs,
+    ) -> np.ndarray:
+        """
+        Generate embeddings for many prompts.
+
+        Returns a contiguous float32 matrix with one row per prompt. Identical prompts
+        are embedded once and at most concurrency requests are in flight. With a cache
+        (see embeddings.RedisEmbeddingCache) vectors are looked up and stored by the
+        digest of the prompt, so unchanged texts are never re-embedded.
+        """
+
+        digests = [hashlib.sha256(prompt.encode("utf-8")).hexdigest() for prompt in prompts]
+        unique = dict(zip(digests, prompts))
+
+        vectors = {}
+        if cache is not None:
+            cached = await cache.get_many(model, list(unique))
+            vectors = {
+                digest: vector
+                for digest, vector in zip(unique, cached)
+                if vector is not None
+            }
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def embed(digest: str):
+            async with semaphore:
+                response = await self.generate_embeddings(model, unique[digest], **kwargs)
+            return digest, np.asarray(response["embedding"], dtype=np.float32)
+
+        missing = dict(
+            await asyncio.gather(*[embed(digest) for digest in unique if digest not in vectors])
+        )
+
+        if cache is not None and missing:
+            await cache.set_many(model, missing)
+
+        vectors.update(missing)
+
+        if not digests:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        return np.ascontiguousarray(np.stack([vectors[digest] for digest in digests]))
+
+    async def models(self) -> Dict[str, Any]:
+        """List models that are available locally."""
+        return await self._get_request("api/tags")
+
+    async def running_models(self) -> Dict[str, Any]:
+        """List models that are currently loaded into memory."""
+        return await self._get_request("api/ps")
+
+
+class _LoopThread:
+    """Event loop on a daemon thread that runs the coroutines of the sync facades."""
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+
+    @classmethod
+    def get(cls) -> "_LoopThread":
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def iterate(self, generator: AsyncIterator) -> Iterator:
+        try:
+            while True:
+                try:
+                    yield self.run(generator.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            self.run(generator.aclose())
+
+
+class OllamaWrapper:
+    """Synchronous facade over AsyncOllamaWrapper, sharing its connection pool and streaming."""
+
+    def __init__(self, base_url: str, timeout: httpx.Timeout = DEFAULT_TIMEOUT):
+        self._loop = _LoopThread.get()
+        self._wrapper = AsyncOllamaWrapper(base_url, timeout=timeout)
+        self.base_url = self._wrapper.base_url
+
+    def close(self):
+        self._loop.run(self._wrapper.aclose())
+
+    def generate_completion(
+        self, model: str, prompt: str, images: Optional[List[str]] = None, **kwargs
+    ) -> Iterator[Dict[str, Any]]:
+        """Generate a response for a given prompt with a provided model."""
+        return self._loop.iterate(
+            self._wrapper.generate_completion(model, prompt, images, **kwargs)
         )
 
     def generate_chat_completion(
         self, model: str, messages: List[Dict[str, Any]], **kwargs
-    ):
+    ) -> Iterator[Dict[str, Any]]:
         """Generate the next message in a chat with a provided model."""
-        return self._post_request(
-            "api/chat", {"model": model, "messages": messages, **kwargs},
-            stream=True
+        return self._loop.iterate(
+            self._wrapper.generate_chat_completion(model, messages, **kwargs)
         )
 
     def create_model(
         self, name: str, modelfile: Optional[str] = None, **kwargs
     ) -> Dict[str, Any]:
         """Create a model from a Modelfile."""
-        return self._post_request(
-            "api/create", {"name": name, "modelfile": modelfile, **kwargs},
-            stream=False
-        )
+        return self._loop.run(self._wrapper.create_model(name, modelfile, **kwargs))
 
     def show_model_information(self, name: str) -> Dict[str, Any]:
         """Show information about a model."""
-        return self._post_request("api/show", {"name": name}, stream=False)
+        return self._loop.run(self._wrapper.show_model_information(name))
 
     def copy_model(self, source: str, destination: str) -> Dict[str, Any]:
         """Copy a model."""
-        return self._post_request(
-            "api/copy", {"source": source, "destination": destination}, stream=False
-        )
+        return self._loop.run(self._wrapper.copy_model(source, destination))
 
     def delete_model(self, name: str) -> Dict[str, Any]:
         """Delete a model and its data."""
-        return self._post_request("api/delete", {"name": name}, stream=False)
+        return self._loop.run(self._wrapper.delete_model(name))
 
     def pull_model(self, name: str, **kwargs) -> Dict[str, Any]:
         """Download a model from the ollama library."""
-        return self._post_request("api/pull", {"name": name, **kwargs}, stream=False)
+        return self._loop.run(self._wrapper.pull_model(name, **kwargs))
 
     def push_model(self, name: str, **kwargs) -> Dict[str, Any]:
         """Upload a model to a model library."""
-        return self._post_request("api/push", {"name": name, **kwargs}, stream=False)
+        return self._loop.run(self._wrapper.push_model(name, **kwargs))
 
     def generate_embeddings(self, model: str, prompt: str, **kwargs) -> Dict[str, Any]:
         """Generate embeddings from a model."""
-        return self._post_request(
-            "api/embeddings", {"model": model, "prompt": prompt, **kwargs}, stream=False
+        return self._loop.run(self._wrapper.generate_embeddings(model, prompt, **kwargs))
+
+    def generate_embeddings_batch(
+        self, model: str, prompts: List[str], concurrency: int = 8, cache=None, **kwargs
+    ) -> np.ndarray:
+        """Generate embeddings for many prompts, returned as a float32 matrix."""
+        return self._loop.run(
+            self._wrapper.generate_embeddings_batch(
+                model, prompts, concurrency=concurrency, cache=cache, **kwargs
+            )
         )
 
     @property
     def models(self) -> Dict[str, Any]:
         """List models that are available locally."""
-        return self._post_request(
-            "/api/tags", stream=False
-        )
+        return self._loop.run(self._wrapper.models())
+
+    @property
+    def running_models(self) -> Dict[str, Any]:
+        """List models that are currently loaded into memory."""
+        return self._loop.run(self._wrapper.running_models())
@@ -0,0 +1,131 @@
+import asyncio
+import httpx
+from ollama import AsyncOllamaWrapper, DEFAULT_TIMEOUT, DEFAULT_LIMITS
+
+
+def ollama_model_name(model: str) -> str:
+    """Map a litellm model name such as `ollama/mixtral:instruct` to the Ollama name."""
+
+    name = model.split("/", 1)[1] if "/" in model else model
+
+    return name if ":" in name else f"{name}:latest"
+
+
+class _Replica:
+
+    def __init__(self, base_url: str, client: httpx.AsyncClient):
+        self.base_url = base_url
+        self.wrapper = AsyncOllamaWrapper(base_url, client=client)
+        self.healthy = True
+        self.outstanding = 0
+        # Models pulled to the replica, and the subset loaded in memory
+        self.available = set()
+        self.loaded = set()
+
+    def rank(self, name: str):
+        return (
+            not self.healthy,
+            name not in self.loaded,
+            name not in self.available,
+            self.outstanding,
+        )
+
+
+class OllamaRouter:
+    """
+    Routes completions over a set of Ollama replicas.
+
+    Replicas that already have the model loaded are preferred, then replicas that have
+    it pulled, and ties are broken by the least number of outstanding streams. The
+    loaded and pulled models are refreshed by periodic `/api/tags` and `/api/ps` probes.
+    A replica that fails to connect is marked unhealthy until the next successful probe
+    and the stream fails over to the next replica.
+    """
+
+    def __init__(
+        self,
+        base_urls: list[str],
+        probe_interval: float = 30,
+        retry_on: tuple = (ConnectionError,),
+    ):
+        # One connection pool shared by the probes of all replicas
+        self.client = httpx.AsyncClient(timeout=DEFAULT_TIMEOUT, limits=DEFAULT_LIMITS)
+        self.replicas = [_Replica(base_url, self.client) for base_url in base_urls]
+        self.probe_interval = probe_interval
+        self.retry_on = retry_on
+
+    async def _probe_replica(self, replica: _Replica):
+
+        try:
+            tags = await replica.wrapper.models()
+        except (httpx.HTTPError, ValueError):
+            replica.healthy = False
+            return
+
+        replica.healthy = True
+        replica.available = {model["name"] for model in tags.get("models", [])}
+
+        try:
+            running = await replica.wrapper.running_models()
+        except (httpx.HTTPError, ValueError):
+            # Older Ollama versions have no /api/ps, keep what routing has observed
+            replica.loaded &= replica.available
+            return
+
+        replica.loaded = {model["name"] for model in running.get("models", [])}
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def probe(self):
+        await asyncio.gather(*[self._probe_replica(replica) for replica in self.replicas])
+
+    async def run_probes(self):
+        while True:
+            await self.probe()
+            await asyncio.sleep(self.probe_interval)
+
+    def rank(self, model: str) -> list[_Replica]:
+        name = ollama_model_name(model)
+        return sorted(self.replicas, key=lambda replica: replica.rank(name))
+
+    async def stream(self, model: str, open_stream):
+        """
+        Yield the chunks of the stream returned by `await open_stream(base_url)`.
+
+        Replicas are tried in rank order until one produces its first chunk, connection
+        errors raised before that fail over to the next replica.
+        """
+
+        name = ollama_model_name(model)
+        error = None
+
+        for replica in self.rank(model):
+
+            replica.outstanding += 1
+
+            try:
+                try:
+                    chunks = (await open_stream(replica.base_url)).__aiter__()
+                    first = await chunks.__anext__()
+                except StopAsyncIteration:
+                    return
+                except self.retry_on as retry_error:
+                    replica.healthy = False
+                    error = retry_error
+                    continue
+
+                # Ollama keeps the model loaded after serving it
+                replica.available.add(name)
+                replica.loaded.add(name)
+
+                yield first
+                async for chunk in chunks:
+                    yield chunk
+
+                return
+
+            finally:
+                replica.outstanding -= 1
+
+        raise error if error is not None else ConnectionError("No Ollama replica configured")
@@ -0,0 +1,177 @@
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+
+class QueueFull(Exception):
+    pass
+
+
+class _ModelQueue:
+
+    def __init__(self, max_inflight: int):
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.queued = 0
+        # Waiters per session, served round-robin across sessions
+        self.waiting: OrderedDict[str, deque[asyncio.Future]] = OrderedDict()
+
+    def has_capacity(self) -> bool:
+        return self.inflight < self.max_inflight and self.queued == 0
+
+
+class Reservation:
+    """A request's place in a model queue, its future is done once it has a slot."""
+
+    def __init__(self, model: str, session: str, future: asyncio.Future, position: int):
+        self.model = model
+        self.session = session
+        self.future = future
+        # 0 when the request runs right away
+        self.position = position
+        self.used = False
+
+
+class Scheduler:
+    """
+    Limits the number of completions in flight per model.
+
+    Requests over the limit wait in a queue per session, and the sessions are served
+    round-robin so one client can not starve the others. A model holds at most
+    max_queued waiting requests and a session at most max_queued_per_session of them,
+    `admit` reserves a place or rejects the request before any work is done.
+    """
+
+    def __init__(
+        self,
+        max_inflight: int = 4,
+        max_queued: int = 64,
+        max_queued_per_session: int = 4,
+        model_max_inflight: dict[str, int] = None,
+    ):
+        self.max_inflight = max_inflight
+        self.max_queued = max_queued
+        self.max_queued_per_session = max_queued_per_session
+        self.model_max_inflight = model_max_inflight or {}
+
+        self._queues: dict[str, _ModelQueue] = {}
+
+    def _queue(self, model: str) -> _ModelQueue:
+
+        if model not in self._queues:
+            self._queues[model] = _ModelQueue(
+                self.model_max_inflight.get(model, self.max_inflight)
+            )
+
+        return self._queues[model]
+
+    def admit(self, model: str, session: str) -> Reservation:
+        """
+        Reserve a place in the queue of model, raises QueueFull when there is none.
+        The reservation is held from here on, so that a burst of requests is counted
+        before any of them starts. Pass it to `slot`, or to `cancel` when the request
+        is abandoned before that.
+        """
+
+        queue = self._queue(model)
+
+        if not queue.has_capacity():
+
+            if queue.queued >= self.max_queued:
+                raise QueueFull(f"{queue.queued} requests already queued for {model}")
+
+            if len(queue.waiting.get(session, ())) >= self.max_queued_per_session:
+                raise QueueFull(f"Too many requests queued for session {session}")
+
+        return self._reserve(queue, model, session)
+
+    def cancel(self, reservation: Reservation):
+        """Give up a reservation that was not passed to `slot`, a no-op otherwise."""
+
+        if not reservation.used:
+            reservation.used = True
+            self._abandon(self._queue(reservation.model), reservation)
+
+    @asynccontextmanager
+    async def slot(self, model: str, session: str, reservation: Reservation = None):
+        """Wait for, hold and release an in-flight slot for model."""
+
+        queue = self._queue(model)
+
+        if reservation is None or reservation.used:
+            # A cancelled reservation is gone, the request queues up again
+            reservation = self._reserve(queue, model, session)
+
+        reservation.used = True
+
+        try:
+            await reservation.future
+        except asyncio.CancelledError:
+            self._abandon(queue, reservation)
+            raise
+
+        try:
+            yield
+        finally:
+            self._release(queue)
+
+    def _reserve(self, queue: _ModelQueue, model: str, session: str) -> Reservation:
+
+        future = asyncio.get_running_loop().create_future()
+
+        if queue.has_capacity():
+            queue.inflight += 1
+            future.set_result(None)
+            return Reservation(model, session, future, 0)
+
+        queue.waiting.setdefault(session, deque()).append(future)
+        queue.queued += 1
+
+        return Reservation(model, session, future, queue.queued)
+
+    def _abandon(self, queue: _ModelQueue, reservation: Reservation):
+
+        if reservation.future.done() and not reservation.future.cancelled():
+            # The slot was granted before the request went away
+            self._release(queue)
+            return
+
+        reservation.future.cancel()
+
+        waiters = queue.waiting[reservation.session]
+        waiters.remove(reservation.future)
+        queue.queued -= 1
+        if not waiters:
+            del queue.waiting[reservation.session]
+
+    def _release(self, queue: _ModelQueue):
+
+        queue.inflight -= 1
+
+        while queue.waiting and queue.inflight < queue.max_inflight:
+
+            session, waiters = next(iter(queue.waiting.items()))
+
+            future = waiters.popleft()
+            queue.queued -= 1
+
+            if waiters:
+                queue.waiting.move_to_end(session)
+            else:
+                del queue.waiting[session]
+
+            queue.inflight += 1
+            future.set_result(None)
+
+
+def parse_model_limits(value: str) -> dict[str, int]:
+    """Parse `model=limit,model=limit` into a dict."""
+
+    limits = {}
+
+    for item in value.split(","):
+        if item.strip():
+            model, limit = item.rsplit("=", 1)
+            limits[model.strip()] = int(limit)
+
+    return limits
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The backend modules import each other by their plain names, as uvicorn runs them
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
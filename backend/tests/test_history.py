@@ -0,0 +1,170 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fakeredis import aioredis as fakeredis
+
+import main
+from history import (
+    CHAT_HISTORY_KEY,
+    append_history,
+    compact_inflated_history,
+    deflate_history,
+    load_history,
+)
+
+SYSTEM = {"role": "system", "content": "You are a friendly assistant"}
+KEY = CHAT_HISTORY_KEY.format(session="test")
+
+
+def turn(i: int) -> list[dict]:
+    return [
+        {"role": "user", "content": f"question {i}"},
+        {"role": "assistant", "content": f"answer {i}"},
+    ]
+
+
+def linear_history(turns: int) -> list[dict]:
+    return [SYSTEM] + [message for i in range(turns) for message in turn(i)]
+
+
+def inflated_history(turns: int) -> list[dict]:
+    """What the old write path stored: the loaded history re-pushed with every turn."""
+
+    stored = [SYSTEM]
+    for i in range(turns):
+        stored = stored + stored + turn(i)
+
+    return stored
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def stub_acompletion(model: str, messages: list[dict], stream: bool, **kwargs):
+    """Streams "answer i" to "question i", like litellm does."""
+
+    answer = messages[-1]["content"].replace("question", "answer")
+
+    async def chunks():
+        for i, word in enumerate(answer.split(" ")):
+            content = word if i == 0 else " " + word
+            yield {"choices": [{"delta": SimpleNamespace(content=content)}]}
+
+    return chunks()
+
+
+def wait_for_recording(generations) -> asyncio.Event:
+    """An event set once the next generation has run its on_finish, which records the turn."""
+
+    start = generations.start
+    recorded = asyncio.Event()
+
+    async def recording_start(produce, on_finish=None):
+        async def finish(content: str, error: Exception = None):
+            await on_finish(content, error)
+            recorded.set()
+
+        generations.start = start
+        return await start(produce, on_finish=finish)
+
+    generations.start = recording_start
+
+    return recorded
+
+
+async def _chat_turns(turns: int, monkeypatch) -> tuple[list[int], list[dict]]:
+
+    redis = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setenv("REDIS_HOST", "redis://fake")
+    monkeypatch.setattr(main.aioredis, "from_url", lambda *args, **kwargs: redis)
+    monkeypatch.setattr(main.litellm, "acompletion", stub_acompletion)
+
+    lengths = []
+
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+
+            for i in range(turns):
+                recorded = wait_for_recording(main.app.state.generations)
+
+                response = await client.post(
+                    "/chat",
+                    json={
+                        "session": "test",
+                        "system_prompt": SYSTEM["content"],
+                        "model": "stub",
+                        "messages": [turn(i)[0]],
+                    },
+                )
+                assert response.status_code == 200
+                assert response.text == f"answer {i}"
+
+                await asyncio.wait_for(recorded.wait(), timeout=5)
+                lengths.append(await redis.llen(KEY))
+
+        history = await load_history(redis, KEY)
+
+    return lengths, history
+
+
+@pytest.mark.parametrize("turns", [1, 5, 50])
+def test_history_grows_linearly(turns, monkeypatch):
+
+    lengths, history = run(_chat_turns(turns, monkeypatch))
+
+    assert lengths == [1 + 2 * (i + 1) for i in range(turns)]
+    assert history == linear_history(turns)
+
+
+@pytest.mark.parametrize("turns", [1, 2, 6])
+def test_deflate_inflated_history(turns):
+    assert len(inflated_history(turns)) > len(linear_history(turns))
+    assert deflate_history(inflated_history(turns)) == linear_history(turns)
+
+
+@pytest.mark.parametrize("turns, appended", [(1, 1), (3, 2), (5, 4)])
+def test_deflate_keeps_turns_appended_after_the_inflation(turns, appended):
+
+    later = [message for i in range(turns, turns + appended) for message in turn(i)]
+
+    assert (
+        deflate_history(inflated_history(turns) + later)
+        == linear_history(turns + appended)
+    )
+
+
+@pytest.mark.parametrize("turns", [0, 1, 7])
+def test_deflate_leaves_linear_history_unchanged(turns):
+    assert deflate_history(linear_history(turns)) == linear_history(turns)
+
+
+def test_deflate_keeps_repeated_questions():
+
+    history = [SYSTEM] + turn(0) + turn(0)
+
+    assert deflate_history(history) == history
+
+
+async def _compact(stored: list[dict]):
+
+    redis = fakeredis.FakeRedis(decode_responses=True)
+    await redis.rpush(KEY, *[json.dumps(message) for message in stored])
+
+    lengths = await compact_inflated_history(redis, KEY)
+
+    return lengths, await load_history(redis, KEY)
+
+
+def test_compact_inflated_history():
+
+    stored = inflated_history(4) + turn(4)
+
+    lengths, history = run(_compact(stored))
+
+    assert lengths == (len(stored), len(linear_history(5)))
+    assert history == linear_history(5)
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import socket
+
+import httpx
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from router import OllamaRouter
+
+MODEL = "ollama/mixtral:instruct"
+NAME = "mixtral:instruct"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def stub_ollama(available: list[str], loaded: list[str], answer: str) -> web.Application:
+    """An Ollama replica with the given models that streams answer from /api/chat."""
+
+    async def tags(request):
+        return web.json_response({"models": [{"name": name} for name in available]})
+
+    async def ps(request):
+        return web.json_response({"models": [{"name": name} for name in loaded]})
+
+    async def chat(request):
+        response = web.StreamResponse()
+        await response.prepare(request)
+        for word in answer.split():
+            await response.write(json.dumps({"message": {"content": word}}).encode() + b"\n")
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_get("/api/tags", tags)
+    app.router.add_get("/api/ps", ps)
+    app.router.add_post("/api/chat", chat)
+
+    return app
+
+
+async def start(app: web.Application, port: int = None) -> TestServer:
+    server = TestServer(app, host="127.0.0.1", port=port)
+    await server.start_server()
+    return server
+
+
+def base_url(server: TestServer) -> str:
+    return str(server.make_url("")).rstrip("/")
+
+
+async def open_chat(api_base: str):
+    """Stands in for litellm, connection errors surface before the first chunk."""
+
+    client = httpx.AsyncClient()
+    request = client.build_request("POST", f"{api_base}/api/chat", json={"model": NAME})
+    response = await client.send(request, stream=True)
+
+    async def chunks():
+        try:
+            async for line in response.aiter_lines():
+                yield json.loads(line)["message"]["content"]
+        finally:
+            await response.aclose()
+            await client.aclose()
+
+    return chunks()
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def _ranking():
+
+    other = await start(stub_ollama(["llama3:latest"], ["llama3:latest"], "other"))
+    pulled = await start(stub_ollama([NAME], [], "pulled"))
+    loaded = await start(stub_ollama([NAME], [NAME], "loaded"))
+    servers = [other, pulled, loaded]
+
+    router = OllamaRouter([base_url(server) for server in servers])
+    replicas = {replica.base_url: replica for replica in router.replicas}
+
+    try:
+        await router.probe()
+        by_model = [replica.base_url for replica in router.rank(MODEL)]
+
+        # With the model loaded on both, the one with fewer open streams wins
+        replicas[base_url(pulled)].loaded.add(NAME)
+        replicas[base_url(loaded)].outstanding = 2
+        by_streams = [replica.base_url for replica in router.rank(MODEL)]
+
+        return [base_url(server) for server in servers], by_model, by_streams
+
+    finally:
+        await router.aclose()
+        for server in servers:
+            await server.close()
+
+
+def test_rank_prefers_loaded_model_then_fewer_streams():
+
+    (other, pulled, loaded), by_model, by_streams = run(_ranking())
+
+    assert by_model == [loaded, pulled, other]
+    assert by_streams == [pulled, loaded, other]
+
+
+async def _failover():
+
+    live = await start(stub_ollama([NAME], [], "from the live replica"))
+    dead_url = f"http://127.0.0.1:{free_port()}"
+
+    # The dead replica claims the model is loaded, so it is tried first
+    router = OllamaRouter([dead_url, base_url(live)], retry_on=(httpx.ConnectError,))
+    router.replicas[0].loaded.add(NAME)
+
+    try:
+        chunks = [chunk async for chunk in router.stream(MODEL, open_chat)]
+        replicas = {replica.base_url: replica for replica in router.replicas}
+
+        return (
+            chunks,
+            replicas[dead_url].healthy,
+            NAME in replicas[base_url(live)].loaded,
+            [replica.outstanding for replica in router.replicas],
+        )
+
+    finally:
+        await router.aclose()
+        await live.close()
+
+
+def test_stream_fails_over_on_connection_error():
+
+    chunks, dead_healthy, live_loaded, outstanding = run(_failover())
+
+    assert chunks == ["from", "the", "live", "replica"]
+    assert dead_healthy is False
+    # Routing learns that the replica has the model loaded now
+    assert live_loaded is True
+    assert outstanding == [0, 0]
+
+
+async def _recovery():
+
+    port = free_port()
+    router = OllamaRouter([f"http://127.0.0.1:{port}"])
+    replica = router.replicas[0]
+
+    try:
+        await router.probe()
+        down = replica.healthy
+
+        server = await start(stub_ollama([NAME], [NAME], "back"), port=port)
+        try:
+            await router.probe()
+            up = replica.healthy
+        finally:
+            await server.close()
+
+        return down, up, replica.available, replica.loaded
+
+    finally:
+        await router.aclose()
+
+
+def test_probe_recovers_replica():
+
+    down, up, available, loaded = run(_recovery())
+
+    assert down is False
+    assert up is True
+    assert available == {NAME}
+    assert loaded == {NAME}
@@ -0,0 +1,202 @@
+"""
+Time to first token of a one-shot chat against a stub backend.
+
+The stub answers `/session/exist`, `/session/create` and a streamed `/chat` after
+--latency-ms, the round-trip time to a remote backend. Compares the old request pattern
+(a session-exists round-trip, then `/chat`, each with `requests.post` on a new
+connection) with the current one (a single `/chat` on a pooled `requests.Session`,
+which creates the session lazily). With --cli the whole `llm-shell chat -q` command is
+timed instead, from process start to the first streamed token on stdout, so it can be
+run on two checkouts to compare before and after.
+
+    python benchmarks/chat_ttft.py --runs 50 --latency-ms 20
+    python benchmarks/chat_ttft.py --cli --runs 10
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+import yaml
+
+FIRST_TOKEN = "first-token"
+
+
+class StubBackendHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    latency = 0.0
+    tokens = 16
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+
+        json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+
+        time.sleep(self.latency)
+
+        if self.path != "/chat":
+            body = b"1"
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        for i in range(self.tokens):
+            token = (FIRST_TOKEN if i == 0 else " token").encode()
+            self.wfile.write(f"{len(token):x}\r\n".encode() + token + b"\r\n")
+            self.wfile.flush()
+
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def start_stub_server(latency: float) -> str:
+    StubBackendHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubBackendHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+CHAT = {
+    "session": "benchmark",
+    "model": "stub",
+    "messages": [{"role": "user", "content": "hello"}],
+    "options": {},
+}
+
+
+def first_token(response) -> float:
+    for _ in response.iter_content(chunk_size=None):
+        return time.perf_counter()
+
+
+def old_pattern(base_url: str) -> float:
+
+    start = time.perf_counter()
+
+    requests.post(f"{base_url}/session/exist", json={"name": "benchmark"})
+    response = requests.post(f"{base_url}/chat", json=CHAT, stream=True)
+
+    ttft = first_token(response) - start
+    response.close()
+
+    return ttft
+
+
+def new_pattern(base_url: str, http: requests.Session) -> float:
+
+    start = time.perf_counter()
+
+    response = http.post(
+        f"{base_url}/chat",
+        json={**CHAT, "system_prompt": "You are a friendly AI assistant"},
+        stream=True,
+    )
+
+    ttft = first_token(response) - start
+    # Drain the stream so the connection goes back to the pool
+    for _ in response.iter_content(chunk_size=None):
+        pass
+
+    return ttft
+
+
+def cli_pattern(config_path: str) -> float:
+
+    start = time.perf_counter()
+
+    process = subprocess.Popen(
+        [
+            sys.executable, "-c", "from llm_shell.chat_cli import main; main()",
+            "chat", "--q", "hello", "--config_path", config_path,
+        ],
+        stdout=subprocess.PIPE,
+        cwd=os.path.join(os.path.dirname(__file__), "..", "llm_shell"),
+    )
+
+    output = b""
+    while FIRST_TOKEN.encode() not in output:
+        chunk = process.stdout.read1(4096)
+        if not chunk:
+            raise RuntimeError("llm-shell exited before the first token")
+        output += chunk
+
+    ttft = time.perf_counter() - start
+
+    process.communicate()
+
+    return ttft
+
+
+def report(name: str, timings: list[float]):
+    timings = sorted(timings)
+    print(
+        f"{name:<40} p50 {statistics.median(timings) * 1000:8.2f} ms  "
+        f"p95 {timings[int(0.95 * (len(timings) - 1))] * 1000:8.2f} ms"
+    )
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--cli", action="store_true")
+    args = parser.parse_args()
+
+    base_url = start_stub_server(args.latency_ms / 1000)
+
+    if args.cli:
+        with tempfile.NamedTemporaryFile("w", suffix=".yaml") as config:
+            yaml.safe_dump(
+                {
+                    "profiles": {
+                        "default": {
+                            "base_url": base_url,
+                            "default_behaviour": "",
+                            "session": "benchmark",
+                            "model": "stub",
+                        }
+                    }
+                },
+                config,
+            )
+            config.flush()
+            report("llm-shell chat -q", [cli_pattern(config.name) for _ in range(args.runs)])
+        return
+
+    report(
+        "exists check + /chat, new connections",
+        [old_pattern(base_url) for _ in range(args.runs)],
+    )
+
+    # Every one-shot CLI run starts with a cold pool
+    report(
+        "/chat only, first request of a Session",
+        [new_pattern(base_url, requests.Session()) for _ in range(args.runs)],
+    )
+
+    http = requests.Session()
+    report("/chat only, pooled Session", [new_pattern(base_url, http) for _ in range(args.runs)])
+
+
+if __name__ == "__main__":
+    main()
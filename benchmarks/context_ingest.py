@@ -0,0 +1,128 @@
+"""
+File ingestion for `@directory(...)` contexts over a synthetic tree.
+
+Builds a tree of small text files with a few large and binary files mixed in, then
+compares the old sequential read with string concatenation against the thread pool
+ingestion, cold and with a warm file cache. Reports wall time and peak Python memory.
+The old path is quadratic, so it only runs over the first --baseline-files files.
+
+    python benchmarks/context_ingest.py --files 10000 --baseline-files 1000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "llm_shell"))
+
+from llm_shell.file_cache import FileCache  # noqa: E402
+from llm_shell.ingest import ingest_files  # noqa: E402
+
+
+def build_tree(root: Path, files: int, seed: int = 0) -> list[str]:
+
+    rng = random.Random(seed)
+    paths = []
+
+    for i in range(files):
+
+        folder = root / f"pkg{i % 50}" / f"mod{i % 7}"
+        folder.mkdir(parents=True, exist_ok=True)
+
+        path = folder / f"file{i}.py"
+
+        if i % 500 == 0:
+            # Large generated file
+            path.write_text("x = 1  # generated\n" * 200_000)
+        elif i % 250 == 0:
+            path = path.with_suffix(".bin")
+            path.write_bytes(bytes(rng.getrandbits(8) for _ in range(4096)) + b"\0")
+        else:
+            lines = rng.randint(20, 200)
+            path.write_text(
+                "".join(f"def function_{i}_{j}(a, b):\n    return a + b\n" for j in range(lines))
+            )
+
+        paths.append(str(path))
+
+    return paths
+
+
+def old_load_files(paths: list[str]) -> str:
+
+    template = "Filename:\n{name}\nFile content:\n{content}"
+
+    context = ""
+
+    for file_path in paths:
+        try:
+            with open(file_path, "r") as file:
+                content = file.read()
+            context = context + template.format(name=file_path, content=content) + "\n"
+        except Exception:
+            pass
+
+    return context
+
+
+def new_load_files(paths: list[str], cache: FileCache = None) -> str:
+
+    template = "Filename:\n{name}\nFile content:\n{content}\n"
+
+    context = "".join(
+        template.format(name=result.path, content=result.text)
+        for result in ingest_files(paths, cache=cache)
+        if result.text is not None
+    )
+
+    if cache is not None:
+        cache.flush()
+
+    return context
+
+
+def measure(name: str, func, *args):
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    context = func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f"{name:<40} {elapsed:8.2f} s  peak {peak / 2**20:8.1f} MiB  "
+        f"context {len(context) / 2**20:8.1f} MiB"
+    )
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--files", type=int, default=10000)
+    parser.add_argument("--baseline-files", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+
+        root = Path(folder)
+        paths = build_tree(root / "tree", args.files)
+        cache = FileCache(path=root / "cache.sqlite")
+
+        baseline = paths[: args.baseline_files]
+        measure(f"sequential + concatenation ({len(baseline)})", old_load_files, baseline)
+        measure(f"thread pool, no cache ({len(baseline)})", new_load_files, baseline)
+        measure("thread pool, no cache", new_load_files, paths)
+        measure("thread pool, cold cache", new_load_files, paths, cache)
+        measure("thread pool, warm cache", new_load_files, paths, cache)
+
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
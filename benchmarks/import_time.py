@@ -0,0 +1,128 @@
+"""
+Cold start of the llm-shell CLI, up to the point where a plain question is sent.
+
+Every run is a fresh interpreter that runs `llm-shell chat -q ...` through
+chat_cli.main until the /chat request would be sent, once with a cold and once with a
+warm config cache. Reports the median times and fails when the warm start passes
+--threshold-ms, or when one of the LAZY_MODULES (yaml, aiohttp, bs4, numpy, ...) is
+imported at that point.
+
+    python benchmarks/import_time.py --runs 20 --threshold-ms 250
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+LLM_SHELL = os.path.join(os.path.dirname(__file__), "..", "llm_shell")
+
+# Imported by the features or commands that need them, never for a plain question.
+# fire, rich and requests are needed by every question and part of the measured time.
+LAZY_MODULES = ["yaml", "dacite", "aiohttp", "bs4", "numpy", "llm_shell.context_store"]
+
+# The request is replaced by recording the time, everything before it runs as usual
+STARTUP = """
+import json, sys, time
+start = time.perf_counter()
+import llm_shell.chat_cli as chat_cli
+imported = time.perf_counter()
+
+class Sent(Exception):
+    pass
+
+def send(self, endpoint, data, **kwargs):
+    raise Sent(time.perf_counter())
+
+chat_cli.ChatCLI._post_request = send
+sys.argv = ["llm-shell", "chat", "-q", "How are you?", "--config_path", {config_path!r}]
+
+try:
+    chat_cli.main()
+except Sent as sent:
+    ready = sent.args[0]
+
+print(json.dumps({{
+    "import": imported - start,
+    "startup": ready - start,
+    "modules": [name for name in {lazy_modules!r} if name in sys.modules],
+}}))
+"""
+
+CONFIG = """
+profiles:
+  default:
+    base_url: http://localhost:8000
+    default_behaviour: ""
+    session: benchmark
+    model: ollama/stub
+"""
+
+
+def run_startup(config_path: str, home: str) -> dict:
+
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            STARTUP.format(config_path=config_path, lazy_modules=LAZY_MODULES),
+        ],
+        cwd=LLM_SHELL,
+        env={**os.environ, "HOME": home, "PYTHONDONTWRITEBYTECODE": "1"},
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+
+    # The lines before are what the CLI printed
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--threshold-ms", type=float, default=250)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+
+        config_path = os.path.join(home, "config.yaml")
+        with open(config_path, "w") as file:
+            file.write(CONFIG)
+
+        cold, warm = [], []
+        for _ in range(args.runs):
+            # A touched config invalidates the cache, the next run starts warm
+            os.utime(config_path)
+            cold.append(run_startup(config_path, home))
+            warm.append(run_startup(config_path, home))
+
+    failed = False
+
+    for name, runs in (("cold config cache", cold), ("warm config cache", warm)):
+        import_ms = statistics.median(run["import"] for run in runs) * 1000
+        startup_ms = statistics.median(run["startup"] for run in runs) * 1000
+        print(
+            f"{name:<20} import {import_ms:7.1f} ms  "
+            f"until the request {startup_ms:7.1f} ms"
+        )
+
+    startup_ms = statistics.median(run["startup"] for run in warm) * 1000
+    if startup_ms > args.threshold_ms:
+        print(f"FAIL: warm start {startup_ms:.1f} ms is above {args.threshold_ms:.1f} ms")
+        failed = True
+
+    modules = sorted({name for run in warm for name in run["modules"]})
+    if modules:
+        print(f"FAIL: imported on startup: {', '.join(modules)}")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
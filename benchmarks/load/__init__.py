@@ -0,0 +1,14 @@
+"""
+Load tests of the backend against a local stand-in for the LLM provider.
+
+`python -m benchmarks.load` starts the fake provider (fake_llm.py), an in-memory Redis
+or uses a local one, and `backend/main.py` under uvicorn, then drives concurrent chat
+sessions with the load generator (loadgen.py) and writes the results as JSON.
+compare.py prints two result files side by side.
+
+    python -m benchmarks.load --sessions 32 --turns 10 --redis memory
+    python -m benchmarks.load --provider openai --ttft-ms 300 --failure-rate 0.05
+    python -m benchmarks.load.compare before.json after.json
+
+Needs the backend requirements, and fakeredis[lua] for --redis memory.
+"""
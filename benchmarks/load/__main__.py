@@ -0,0 +1,228 @@
+"""
+Load test of the backend against the fake LLM provider.
+
+Starts fake_llm.py, Redis (an in-memory fakeredis server with --redis memory, otherwise
+the given URL is used as is, and must not be shared with anything else) and
+`backend/main.py` under uvicorn, each in a process of its own, runs the load generator
+and writes its report, the provider counters and a few backend metrics to --output.
+Extra backend settings are passed with --backend-env, e.g.
+--backend-env SCHEDULER_MAX_INFLIGHT=8.
+
+    python -m benchmarks.load --sessions 32 --turns 10 --output before.json
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from . import loadgen
+
+REPOSITORY = os.path.join(os.path.dirname(__file__), "..", "..")
+BACKEND = os.path.join(REPOSITORY, "backend")
+
+PROVIDER_MODELS = {"ollama": "ollama_chat/stub", "openai": "openai/stub"}
+
+MEMORY_REDIS = """
+from fakeredis import TcpFakeServer
+TcpFakeServer(("127.0.0.1", {port}), server_type="redis").serve_forever()
+"""
+
+# Reported from the backend /metrics after the run, summed over their labels
+BACKEND_METRICS = [
+    "llm_shell_history_load_seconds",
+    "llm_shell_time_to_first_token_seconds",
+    "llm_shell_stream_errors",
+    "llm_shell_client_disconnects",
+    "llm_shell_rejected_requests",
+]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Processes:
+    """Child processes that are stopped together, their output goes to log files."""
+
+    def __init__(self):
+        self.logs = tempfile.TemporaryDirectory()
+        self.processes = {}
+
+    def start(self, name: str, command: list[str], cwd: str, env: dict = None):
+
+        log = open(os.path.join(self.logs.name, f"{name}.log"), "w")
+        self.processes[name] = subprocess.Popen(
+            command, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+
+    def wait_ready(self, name: str, ready, timeout: float = 30):
+        """Poll ready() until it is true, fail with the log if the process exits."""
+
+        deadline = time.monotonic() + timeout
+
+        while not ready():
+
+            if self.processes[name].poll() is not None or time.monotonic() > deadline:
+                with open(os.path.join(self.logs.name, f"{name}.log")) as log:
+                    raise RuntimeError(f"{name} did not start:\n{log.read()}")
+
+            time.sleep(0.1)
+
+    def stop(self):
+
+        for process in self.processes.values():
+            process.terminate()
+
+        for process in self.processes.values():
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+        self.logs.cleanup()
+
+
+def responds(url: str) -> bool:
+    try:
+        return httpx.get(url, timeout=1).status_code == 200
+    except httpx.HTTPError:
+        return False
+
+
+def accepts(port: int) -> bool:
+    try:
+        socket.create_connection(("127.0.0.1", port), timeout=1).close()
+        return True
+    except OSError:
+        return False
+
+
+def backend_metrics(text: str) -> dict:
+    """Sums and counts of the BACKEND_METRICS in a Prometheus exposition."""
+
+    from prometheus_client.parser import text_string_to_metric_families
+
+    values = {}
+
+    for family in text_string_to_metric_families(text):
+        if family.name not in BACKEND_METRICS:
+            continue
+        for sample in family.samples:
+            if sample.name.endswith(("_sum", "_count", "_total")):
+                values[sample.name] = values.get(sample.name, 0) + sample.value
+
+    return values
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--provider", default="ollama", choices=sorted(PROVIDER_MODELS))
+    parser.add_argument("--ttft-ms", type=float, default=200)
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--answer-tokens", type=int, default=200)
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--stream-failure-rate", type=float, default=0.0)
+    parser.add_argument("--redis", default="memory", help="Redis URL, or memory")
+    parser.add_argument("--backend-env", action="append", default=[], metavar="NAME=VALUE")
+    loadgen.add_arguments(parser)
+    parser.set_defaults(
+        model=None, output=os.path.join("benchmarks", "results", f"load-{int(time.time())}.json")
+    )
+    args = parser.parse_args()
+
+    args.model = args.model or PROVIDER_MODELS[args.provider]
+    load = loadgen.load_from_arguments(args)
+
+    provider = {
+        "ttft_ms": args.ttft_ms,
+        "tokens_per_second": args.tokens_per_second,
+        "answer_tokens": args.answer_tokens,
+        "prefill_tokens_per_second": args.prefill_tokens_per_second,
+        "failure_rate": args.failure_rate,
+        "stream_failure_rate": args.stream_failure_rate,
+    }
+    backend_env = dict(setting.split("=", 1) for setting in args.backend_env)
+
+    processes = Processes()
+
+    try:
+        provider_url = f"http://127.0.0.1:{free_port()}"
+        processes.start(
+            "provider",
+            [
+                sys.executable, "-m", "benchmarks.load.fake_llm",
+                "--port", provider_url.rsplit(":", 1)[1], "--seed", str(args.seed),
+                *[
+                    argument
+                    for name, value in provider.items()
+                    for argument in (f"--{name.replace('_', '-')}", str(value))
+                ],
+            ],
+            cwd=REPOSITORY,
+        )
+
+        redis_url = args.redis
+        if redis_url == "memory":
+            redis_port = free_port()
+            redis_url = f"redis://127.0.0.1:{redis_port}"
+            processes.start(
+                "redis", [sys.executable, "-c", MEMORY_REDIS.format(port=redis_port)], REPOSITORY
+            )
+            processes.wait_ready("redis", lambda: accepts(redis_port))
+
+        backend_url = f"http://127.0.0.1:{free_port()}"
+        processes.start(
+            "backend",
+            [
+                sys.executable, "-m", "uvicorn", "main:app",
+                "--host", "127.0.0.1", "--port", backend_url.rsplit(":", 1)[1],
+                "--log-level", "warning", "--no-access-log",
+            ],
+            cwd=BACKEND,
+            env={
+                **os.environ,
+                "REDIS_HOST": redis_url,
+                "OLLAMA_API_BASE_URL": provider_url,
+                "OPENAI_API_BASE": f"{provider_url}/v1",
+                "OPENAI_BASE_URL": f"{provider_url}/v1",
+                "OPENAI_API_KEY": "fake",
+                **backend_env,
+            },
+        )
+
+        processes.wait_ready("provider", lambda: responds(f"{provider_url}/stats"))
+        processes.wait_ready("backend", lambda: responds(f"{backend_url}/metrics"))
+
+        summary = asyncio.run(loadgen.run(backend_url, load, redis_url, args.keep_sessions))
+
+        provider["stats"] = httpx.get(f"{provider_url}/stats").json()
+        metrics = backend_metrics(httpx.get(f"{backend_url}/metrics").text)
+
+    finally:
+        processes.stop()
+
+    loadgen.print_summary(summary)
+
+    loadgen.save(
+        args.output,
+        load,
+        summary,
+        provider=provider,
+        backend={"redis": args.redis, "env": backend_env, "metrics": metrics},
+    )
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Compare the results of two load test runs.
+
+Prints the headline numbers of both JSON result files and the change from the first
+to the second.
+
+    python -m benchmarks.load.compare before.json after.json
+"""
+
+import argparse
+import json
+
+# (label, path in the results, scale for printing)
+ROWS = [
+    ("ttft p50 ms", ("ttft_seconds", "p50"), 1000),
+    ("ttft p95 ms", ("ttft_seconds", "p95"), 1000),
+    ("ttft p99 ms", ("ttft_seconds", "p99"), 1000),
+    ("latency p50 ms", ("latency_seconds", "p50"), 1000),
+    ("latency p95 ms", ("latency_seconds", "p95"), 1000),
+    ("latency p99 ms", ("latency_seconds", "p99"), 1000),
+    ("requests/s", ("throughput", "requests_per_second"), 1),
+    ("tokens/s", ("throughput", "tokens_per_second"), 1),
+    ("failed requests", ("requests", "failed"), 1),
+    ("redis KiB/session", ("redis", "bytes_per_session", "mean"), 1 / 1024),
+]
+
+
+def lookup(results: dict, path: tuple):
+
+    for key in path:
+        if not isinstance(results, dict) or results.get(key) is None:
+            return None
+        results = results[key]
+
+    return results
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args()
+
+    with open(args.before) as file:
+        before = json.load(file)
+    with open(args.after) as file:
+        after = json.load(file)
+
+    for name, results in (("before", before), ("after", after)):
+        load = results["load"]
+        print(
+            f"{name:<7} {results.get('git_commit') or '?':.12}  {load['sessions']} sessions x "
+            f"{load['turns']} turns of {load['model']}"
+        )
+
+    print(f"{'':<20} {'before':>12} {'after':>12} {'change':>9}")
+
+    for label, path, scale in ROWS:
+
+        old, new = lookup(before, path), lookup(after, path)
+
+        if old is None and new is None:
+            continue
+
+        values = [
+            f"{value * scale:12.1f}" if value is not None else f"{'-':>12}"
+            for value in (old, new)
+        ]
+        change = f"{(new - old) / old:+9.1%}" if old and new is not None else ""
+
+        print(f"{label:<20} {' '.join(values)} {change}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+"""
+Stand-in for an LLM provider that streams made-up answers at a configurable pace.
+
+Serves the Ollama API (`/api/chat` and `/api/generate` streamed as NDJSON, `/api/tags`,
+`/api/ps`, `/api/embeddings`) and the OpenAI chat completions API
+(`/v1/chat/completions` streamed as server-sent events, `/v1/models`). Every answer
+starts after --ttft-ms, plus the prompt tokens divided by --prefill-tokens-per-second
+when that is set, and streams --answer-tokens tokens at --tokens-per-second (0 streams
+them at once). --failure-rate of the requests fail with a 500 before streaming and
+--stream-failure-rate of the streams break off halfway through the answer. Counters are
+served as JSON on `/stats`.
+
+    python -m benchmarks.load.fake_llm --port 11434 --ttft-ms 200 --tokens-per-second 50
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+
+from aiohttp import web
+
+WORDS = (
+    "the", "request", "is", "streamed", "to", "a", "local", "model", "which", "answers",
+    "with", "tokens", "of", "plain", "text", "and", "code", "so", "that", "each", "chunk",
+    "arrives", "after", "previous", "one", "in", "order", "without", "any", "delay",
+)
+EMBEDDING_DIMENSIONS = 384
+
+
+class _BrokenOff(Exception):
+    """Raised to break off a stream that was chosen to fail."""
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _ndjson(line: dict) -> bytes:
+    return json.dumps(line).encode() + b"\n"
+
+
+class FakeLLM:
+    """
+    Generates the answers and serves them in the wire formats of Ollama and OpenAI.
+    Answers are random words drawn from a seeded generator, the prompt only matters
+    for its length.
+    """
+
+    def __init__(
+        self,
+        ttft: float = 0.2,
+        tokens_per_second: float = 50,
+        answer_tokens: int = 200,
+        prefill_tokens_per_second: float = 0,
+        failure_rate: float = 0.0,
+        stream_failure_rate: float = 0.0,
+        models: tuple = ("stub",),
+        seed: int = 0,
+    ):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.failure_rate = failure_rate
+        self.stream_failure_rate = stream_failure_rate
+        self.models = [model if ":" in model else f"{model}:latest" for model in models]
+        self.rng = random.Random(seed)
+
+        self.stats = {
+            "requests": 0,
+            "failed": 0,
+            "broken_off": 0,
+            "completed": 0,
+            "inflight": 0,
+            "max_inflight": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+        }
+
+    def app(self) -> web.Application:
+
+        app = web.Application()
+        app.add_routes(
+            [
+                web.post("/api/chat", self.ollama_chat),
+                web.post("/api/generate", self.ollama_generate),
+                web.get("/api/tags", self.ollama_models),
+                web.get("/api/ps", self.ollama_models),
+                web.post("/api/embeddings", self.ollama_embeddings),
+                web.post("/v1/chat/completions", self.openai_chat),
+                web.get("/v1/models", self.openai_models),
+                web.get("/stats", self.get_stats),
+            ]
+        )
+
+        return app
+
+    def _fails(self) -> bool:
+
+        self.stats["requests"] += 1
+
+        if self.rng.random() < self.failure_rate:
+            self.stats["failed"] += 1
+            return True
+
+        return False
+
+    async def _tokens(self, prompt: str):
+        """Yield the tokens of an answer to prompt, paced like a model would."""
+
+        prompt_tokens = len(prompt) // 4
+        self.stats["prompt_tokens"] += prompt_tokens
+
+        prefill = self.ttft
+        if self.prefill_tokens_per_second:
+            prefill += prompt_tokens / self.prefill_tokens_per_second
+        await asyncio.sleep(prefill)
+
+        broken_off_at = None
+        if self.rng.random() < self.stream_failure_rate:
+            broken_off_at = self.answer_tokens // 2
+
+        start = time.perf_counter()
+
+        for i in range(self.answer_tokens):
+
+            if i == broken_off_at:
+                raise _BrokenOff()
+
+            if self.tokens_per_second:
+                delay = start + i / self.tokens_per_second - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            self.stats["completion_tokens"] += 1
+            yield self.rng.choice(WORDS) + " "
+
+    async def _respond(
+        self, request: web.Request, prompt: str, stream: bool, content_type: str,
+        chunk, end, complete,
+    ):
+        """
+        Answer prompt. A stream sends chunk(token, i) for every token and end(answer)
+        after the last one, otherwise complete(answer) is sent as JSON at the end.
+        """
+
+        self.stats["inflight"] += 1
+        self.stats["max_inflight"] = max(self.stats["max_inflight"], self.stats["inflight"])
+
+        try:
+            if not stream:
+                answer = [token async for token in self._tokens(prompt)]
+                self.stats["completed"] += 1
+                return web.json_response(complete(answer))
+
+            response = web.StreamResponse(headers={"Content-Type": content_type})
+            await response.prepare(request)
+
+            answer = []
+            async for token in self._tokens(prompt):
+                await response.write(chunk(token, len(answer)))
+                answer.append(token)
+
+            await response.write(end(answer))
+            await response.write_eof()
+            self.stats["completed"] += 1
+
+            return response
+
+        except _BrokenOff:
+            # The connection is dropped, a stream is never terminated
+            self.stats["broken_off"] += 1
+            request.transport.close()
+            return web.Response(status=500)
+
+        finally:
+            self.stats["inflight"] -= 1
+
+    async def ollama_chat(self, request: web.Request):
+
+        payload = await request.json()
+
+        if self._fails():
+            return web.json_response({"error": "injected failure"}, status=500)
+
+        messages = payload.get("messages", [])
+        prompt = "".join(message.get("content") or "" for message in messages)
+        start = time.perf_counter()
+
+        def message(content: str) -> dict:
+            return {"message": {"role": "assistant", "content": content}}
+
+        return await self._respond(
+            request,
+            prompt,
+            payload.get("stream", True),
+            "application/x-ndjson",
+            chunk=lambda token, i: _ndjson(self._ollama_line(payload, **message(token))),
+            end=lambda answer: _ndjson(
+                self._ollama_done(payload, start, prompt, answer, **message(""))
+            ),
+            complete=lambda answer: self._ollama_done(
+                payload, start, prompt, answer, **message("".join(answer))
+            ),
+        )
+
+    async def ollama_generate(self, request: web.Request):
+
+        payload = await request.json()
+
+        if self._fails():
+            return web.json_response({"error": "injected failure"}, status=500)
+
+        prompt = payload.get("prompt", "")
+        start = time.perf_counter()
+
+        return await self._respond(
+            request,
+            prompt,
+            payload.get("stream", True),
+            "application/x-ndjson",
+            chunk=lambda token, i: _ndjson(self._ollama_line(payload, response=token)),
+            end=lambda answer: _ndjson(
+                self._ollama_done(payload, start, prompt, answer, response="")
+            ),
+            complete=lambda answer: self._ollama_done(
+                payload, start, prompt, answer, response="".join(answer)
+            ),
+        )
+
+    def _ollama_line(self, payload: dict, **fields) -> dict:
+        return {"model": payload.get("model"), "created_at": _now(), **fields, "done": False}
+
+    def _ollama_done(self, payload: dict, start: float, prompt: str, answer: list, **fields):
+
+        return {
+            **self._ollama_line(payload, **fields),
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int((time.perf_counter() - start) * 1e9),
+            "load_duration": 0,
+            "prompt_eval_count": len(prompt) // 4,
+            "eval_count": len(answer),
+        }
+
+    async def ollama_models(self, request: web.Request):
+
+        return web.json_response(
+            {
+                "models": [
+                    {
+                        "name": model,
+                        "model": model,
+                        "modified_at": _now(),
+                        "size": 0,
+                        "digest": hashlib.sha256(model.encode()).hexdigest(),
+                        "details": {"format": "gguf", "family": "fake"},
+                    }
+                    for model in self.models
+                ]
+            }
+        )
+
+    async def ollama_embeddings(self, request: web.Request):
+
+        payload = await request.json()
+
+        if self._fails():
+            return web.json_response({"error": "injected failure"}, status=500)
+
+        await asyncio.sleep(self.ttft)
+
+        # The same text always gets the same vector
+        rng = random.Random(hashlib.sha256(payload.get("prompt", "").encode()).digest())
+        embedding = [rng.gauss(0, 1) for _ in range(EMBEDDING_DIMENSIONS)]
+
+        return web.json_response({"embedding": embedding})
+
+    async def openai_chat(self, request: web.Request):
+
+        payload = await request.json()
+
+        if self._fails():
+            return web.json_response(
+                {"error": {"message": "injected failure", "type": "server_error", "code": None}},
+                status=500,
+            )
+
+        messages = payload.get("messages", [])
+        prompt = "".join(message.get("content") or "" for message in messages)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        def data(fields: dict) -> dict:
+            return {
+                "id": completion_id,
+                "created": created,
+                "model": payload.get("model"),
+                **fields,
+            }
+
+        def chunk(delta: dict, finish_reason=None) -> bytes:
+            choice = {"index": 0, "delta": delta, "finish_reason": finish_reason}
+            fields = data({"object": "chat.completion.chunk", "choices": [choice]})
+            return f"data: {json.dumps(fields)}\n\n".encode()
+
+        def token_chunk(token: str, i: int) -> bytes:
+            return chunk({"role": "assistant", "content": token} if i == 0 else {"content": token})
+
+        def complete(answer: list) -> dict:
+            usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(answer)}
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+            message = {"role": "assistant", "content": "".join(answer)}
+            return data(
+                {
+                    "object": "chat.completion",
+                    "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+                    "usage": usage,
+                }
+            )
+
+        return await self._respond(
+            request,
+            prompt,
+            payload.get("stream", False),
+            "text/event-stream",
+            chunk=token_chunk,
+            end=lambda answer: chunk({}, finish_reason="stop") + b"data: [DONE]\n\n",
+            complete=complete,
+        )
+
+    async def openai_models(self, request: web.Request):
+
+        return web.json_response(
+            {
+                "object": "list",
+                "data": [
+                    {"id": model.split(":")[0], "object": "model", "owned_by": "fake"}
+                    for model in self.models
+                ],
+            }
+        )
+
+    async def get_stats(self, request: web.Request):
+        return web.json_response(self.stats)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--ttft-ms", type=float, default=200)
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--answer-tokens", type=int, default=200)
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--stream-failure-rate", type=float, default=0.0)
+    parser.add_argument("--model", action="append", dest="models")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    fake = FakeLLM(
+        ttft=args.ttft_ms / 1000,
+        tokens_per_second=args.tokens_per_second,
+        answer_tokens=args.answer_tokens,
+        prefill_tokens_per_second=args.prefill_tokens_per_second,
+        failure_rate=args.failure_rate,
+        stream_failure_rate=args.stream_failure_rate,
+        models=tuple(args.models or ["stub"]),
+        seed=args.seed,
+    )
+
+    web.run_app(fake.app(), host=args.host, port=args.port, print=None, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
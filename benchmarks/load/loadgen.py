@@ -0,0 +1,411 @@
+"""
+Drive concurrent chat sessions against a running backend.
+
+Every session sends --turns questions to `/chat` one after the other, --think-time
+seconds apart, and is recorded so that its history grows with every turn. Sessions
+start spread over --ramp-up seconds. Reports the time to first token and the latency
+(overall and per turn, to show the cost of the growing history), the throughput and,
+with --redis, the Redis memory used per session. Sessions are named
+load-{run id}-{i} and deleted at the end unless --keep-sessions is given.
+
+    python -m benchmarks.load.loadgen --url http://localhost:8000 --sessions 16 --turns 8
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+
+import httpx
+
+SYSTEM_PROMPT = "You are a friendly assistant"
+QUESTION_WORDS = (
+    "how", "do", "I", "configure", "the", "cache", "for", "a", "large", "repository",
+    "with", "many", "files", "and", "what", "happens", "when", "it", "is", "full",
+)
+# Mirrors CHAT_HISTORY_KEY in backend/history.py, every session key ends in :{session}
+CHAT_HISTORY_KEY = "chat_history:{session}"
+
+
+@dataclass
+class Load:
+
+    sessions: int = 16
+    turns: int = 8
+    model: str = "ollama_chat/stub"
+    think_time: float = 0.5
+    ramp_up: float = 1.0
+    question_words: int = 40
+    temperature: float = 0.7
+    cache: str = "bypass"
+    max_context_tokens: int = None
+    timeout: float = 120
+    seed: int = 0
+
+
+@dataclass
+class Turn:
+
+    session: int
+    turn: int
+    status: int = None
+    ttft: float = None
+    latency: float = None
+    characters: int = 0
+    error: str = None
+    headers: dict = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 200 and self.error is None
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+
+    defaults = Load()
+
+    parser.add_argument("--sessions", type=int, default=defaults.sessions)
+    parser.add_argument("--turns", type=int, default=defaults.turns)
+    parser.add_argument("--model", default=defaults.model)
+    parser.add_argument("--think-time", type=float, default=defaults.think_time)
+    parser.add_argument("--ramp-up", type=float, default=defaults.ramp_up)
+    parser.add_argument("--question-words", type=int, default=defaults.question_words)
+    parser.add_argument("--temperature", type=float, default=defaults.temperature)
+    parser.add_argument("--cache", default=defaults.cache, choices=["bypass", "read", "write"])
+    parser.add_argument("--max-context-tokens", type=int, default=defaults.max_context_tokens)
+    parser.add_argument("--timeout", type=float, default=defaults.timeout)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--keep-sessions", action="store_true")
+    parser.add_argument("--output", help="JSON file for the results")
+
+
+def load_from_arguments(args: argparse.Namespace) -> Load:
+    return Load(**{name: getattr(args, name) for name in asdict(Load())})
+
+
+def percentile(values: list[float], q: float) -> float:
+    """The q-th percentile of sorted values, linearly interpolated."""
+
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(values: list[float]) -> dict:
+
+    if not values:
+        return None
+
+    values = sorted(values)
+
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": values[-1],
+    }
+
+
+def question(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(QUESTION_WORDS) for _ in range(words)) + "?"
+
+
+async def chat_turn(client: httpx.AsyncClient, load: Load, name: str, result: Turn, text: str):
+
+    start = time.perf_counter()
+
+    options = {"temperature": load.temperature, "cache": load.cache}
+    if load.max_context_tokens is not None:
+        options["max_context_tokens"] = load.max_context_tokens
+
+    try:
+        async with client.stream(
+            "POST",
+            "/chat",
+            json={
+                "session": name,
+                "system_prompt": SYSTEM_PROMPT,
+                "model": load.model,
+                "messages": [{"role": "user", "content": text}],
+                "options": options,
+            },
+        ) as response:
+
+            result.status = response.status_code
+            result.headers = {
+                header: response.headers[header]
+                for header in ("X-Cache", "X-Queue-Position")
+                if header in response.headers
+            }
+
+            if response.status_code != 200:
+                result.error = f"HTTP {response.status_code}"
+                await response.aread()
+            else:
+                async for chunk in response.aiter_text():
+                    if not chunk:
+                        continue
+                    if result.ttft is None:
+                        result.ttft = time.perf_counter() - start
+                    result.characters += len(chunk)
+
+    except httpx.HTTPError as error:
+        result.error = type(error).__name__
+
+    result.latency = time.perf_counter() - start
+
+
+async def run_session(
+    client: httpx.AsyncClient, load: Load, name: str, index: int, results: list[Turn]
+):
+
+    rng = random.Random(f"{load.seed}-{index}")
+
+    await asyncio.sleep(load.ramp_up * index / max(load.sessions, 1))
+
+    for turn in range(load.turns):
+
+        if turn:
+            await asyncio.sleep(load.think_time)
+
+        result = Turn(session=index, turn=turn)
+        await chat_turn(client, load, name, result, question(rng, load.question_words))
+        results.append(result)
+
+
+async def _has_memory_usage(redis) -> bool:
+
+    from redis.exceptions import ResponseError
+
+    try:
+        await redis.memory_usage("load:probe", samples=0)
+        return True
+    except ResponseError:
+        # fakeredis closes the connection after an unknown command
+        await redis.connection_pool.disconnect()
+        return False
+
+
+async def _payload_bytes(redis, key: str) -> int:
+    """Bytes of the key and its values, for servers without MEMORY USAGE."""
+
+    kind = await redis.type(key)
+
+    if kind == "string":
+        size = await redis.strlen(key)
+    elif kind == "list":
+        size = sum(len(item) for item in await redis.lrange(key, 0, -1))
+    elif kind == "hash":
+        size = sum(
+            len(name) + len(value) for name, value in (await redis.hgetall(key)).items()
+        )
+    else:
+        size = 0
+
+    return len(key) + size
+
+
+async def session_memory(redis_url: str, prefix: str) -> dict:
+    """Bytes and history messages of the sessions whose names start with prefix."""
+
+    import redis.asyncio as aioredis
+    from redis.exceptions import ResponseError
+
+    redis = aioredis.from_url(redis_url, decode_responses=True)
+
+    try:
+        memory_usage = await _has_memory_usage(redis)
+        sizes = Counter()
+
+        async for key in redis.scan_iter(match=f"*:{prefix}*"):
+            if memory_usage:
+                size = await redis.memory_usage(key, samples=0)
+            else:
+                size = await _payload_bytes(redis, key)
+            sizes[key.split(":", 1)[1]] += size
+
+        messages = [
+            await redis.llen(CHAT_HISTORY_KEY.format(session=session)) for session in sizes
+        ]
+
+        try:
+            used_memory = (await redis.info("memory"))["used_memory"]
+        except ResponseError:
+            used_memory = None
+
+    finally:
+        await redis.aclose()
+
+    return {
+        "sessions": len(sizes),
+        "source": "memory_usage" if memory_usage else "payload",
+        "bytes_per_session": summarize(list(sizes.values())),
+        "history_messages_per_session": summarize(messages),
+        "used_memory_bytes": used_memory,
+    }
+
+
+def report(load: Load, results: list[Turn], duration: float) -> dict:
+
+    ok = [result for result in results if result.ok]
+    characters = sum(result.characters for result in results)
+
+    return {
+        "requests": {
+            "total": len(results),
+            "ok": len(ok),
+            "failed": len(results) - len(ok),
+            "rejected": sum(1 for result in results if result.status == 429),
+            "errors": dict(Counter(result.error for result in results if result.error)),
+        },
+        "ttft_seconds": summarize([result.ttft for result in ok]),
+        "latency_seconds": summarize([result.latency for result in ok]),
+        "ttft_by_turn_seconds": [
+            summarize([result.ttft for result in ok if result.turn == turn])
+            for turn in range(load.turns)
+        ],
+        "throughput": {
+            "duration_seconds": duration,
+            "requests_per_second": len(ok) / duration,
+            # Four characters per token, like the estimates of the backend metrics
+            "tokens_per_second": characters / 4 / duration,
+        },
+        "cache": dict(Counter(result.headers.get("X-Cache") for result in ok)),
+    }
+
+
+async def run(
+    url: str, load: Load, redis_url: str = None, keep_sessions: bool = False
+) -> dict:
+
+    prefix = f"load-{uuid.uuid4().hex[:8]}-"
+    names = [f"{prefix}{i}" for i in range(load.sessions)]
+    results = []
+
+    async with httpx.AsyncClient(
+        base_url=url,
+        timeout=httpx.Timeout(load.timeout, connect=5),
+        limits=httpx.Limits(max_connections=load.sessions + 1),
+    ) as client:
+
+        start = time.perf_counter()
+        await asyncio.gather(
+            *[run_session(client, load, name, i, results) for i, name in enumerate(names)]
+        )
+        duration = time.perf_counter() - start
+
+        summary = report(load, results, duration)
+
+        if redis_url is not None:
+            # Histories are appended after their response, give the last ones a moment
+            await asyncio.sleep(0.5)
+            summary["redis"] = await session_memory(redis_url, prefix)
+
+        if not keep_sessions:
+            for name in names:
+                await client.post("/session/delete", json={"name": name})
+
+    return summary
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(__file__),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save(path: str, load: Load, summary: dict, **extra):
+    """Write the summary with the load and what else describes the run to path."""
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    with open(path, "w") as file:
+        json.dump(
+            {
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "git_commit": _git_commit(),
+                "python": sys.version.split()[0],
+                "load": asdict(load),
+                **extra,
+                **summary,
+            },
+            file,
+            indent=2,
+        )
+
+
+def print_summary(summary: dict):
+
+    requests = summary["requests"]
+    print(
+        f"requests {requests['total']}  ok {requests['ok']}  failed {requests['failed']}  "
+        f"rejected {requests['rejected']}"
+    )
+    for error, count in requests["errors"].items():
+        print(f"  {error}: {count}")
+
+    for name in ("ttft_seconds", "latency_seconds"):
+        stats = summary[name]
+        if stats:
+            print(
+                f"{name.split('_')[0]:<8} p50 {stats['p50'] * 1000:9.1f} ms  "
+                f"p95 {stats['p95'] * 1000:9.1f} ms  p99 {stats['p99'] * 1000:9.1f} ms"
+            )
+
+    for turn, stats in enumerate(summary["ttft_by_turn_seconds"]):
+        if stats:
+            print(f"  turn {turn:<3} ttft p50 {stats['p50'] * 1000:9.1f} ms")
+
+    throughput = summary["throughput"]
+    print(
+        f"{throughput['requests_per_second']:.2f} requests/s  "
+        f"{throughput['tokens_per_second']:.1f} tokens/s  "
+        f"in {throughput['duration_seconds']:.1f} s"
+    )
+
+    redis = summary.get("redis")
+    if redis and redis["bytes_per_session"]:
+        print(
+            f"redis {redis['bytes_per_session']['mean'] / 1024:.1f} KiB per session "
+            f"({redis['source']}), "
+            f"{redis['history_messages_per_session']['mean']:.0f} messages per session"
+        )
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--redis", help="Redis URL of the backend, to measure its memory")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    load = load_from_arguments(args)
+    summary = asyncio.run(run(args.url, load, args.redis, args.keep_sessions))
+
+    print_summary(summary)
+
+    if args.output:
+        save(args.output, load, summary, backend_url=args.url)
+
+
+if __name__ == "__main__":
+    main()
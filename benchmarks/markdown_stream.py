@@ -0,0 +1,194 @@
+"""
+Rendering cost of a streamed 20k token answer in the CLI.
+
+Replays a token stream into a terminal console writing to memory and compares printing
+raw chunks (the old behaviour), re-rendering the whole answer as markdown every frame,
+and the incremental MarkdownStream. Tokens are replayed at --rate tokens per second
+(0 replays as fast as possible); CPU time is what the rendering costs, frames and the
+slowest frame show whether the frame rate holds up as the answer grows. Without
+--stream a markdown answer with paragraphs, lists and code blocks is generated. The full
+re-render falls behind the stream quickly, so it only replays the first
+--baseline-chunks chunks.
+
+    python benchmarks/markdown_stream.py --tokens 20000 --rate 2000 --baseline-chunks 1500
+    python benchmarks/markdown_stream.py --stream recorded.jsonl
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import time
+
+from rich.console import Console
+from rich.live import Live
+from rich.markdown import Markdown
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "llm_shell"))
+
+from llm_shell.render import MAX_FPS, MarkdownStream  # noqa: E402
+
+CODE = '''def fetch(session, url, retries=3):
+    for attempt in range(retries):
+        try:
+            response = session.get(url, timeout=10)
+            response.raise_for_status()
+            return response.json()
+        except requests.RequestException as error:
+            log.warning("attempt %d failed: %s", attempt, error)
+    raise RuntimeError(f"giving up on {url}")
+'''
+
+PARAGRAPH = (
+    "Connection pooling keeps a **small number** of connections open to each host, so "
+    "that subsequent requests skip the handshake. This matters most for `chatty` "
+    "clients, which issue many small requests, and for TLS where the handshake is "
+    "expensive."
+)
+
+
+def generate_answer(tokens: int, seed: int = 0) -> list[str]:
+    """A markdown answer of about tokens tokens, split into chunks of 1 to 8 characters."""
+
+    rng = random.Random(seed)
+
+    sections = []
+    while sum(map(len, sections)) < tokens * 4:
+        i = len(sections)
+        sections.append(
+            f"## Step {i}\n\n{PARAGRAPH}\n\n"
+            + "".join(f"- item {i}.{j}: {PARAGRAPH[: rng.randint(20, 80)]}\n" for j in range(4))
+            + f"\n```python\n{CODE}```\n\n"
+        )
+
+    text = "".join(sections)
+
+    chunks = []
+    position = 0
+    while position < len(text):
+        size = rng.randint(1, 8)
+        chunks.append(text[position:position + size])
+        position += size
+
+    return chunks
+
+
+def terminal() -> Console:
+    return Console(file=io.StringIO(), force_terminal=True, width=100, color_system="truecolor")
+
+
+def replay(chunks: list[str], rate: float, render):
+    """Feed chunks to render at rate chunks per second, returns the CPU time spent."""
+
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+
+    for i, chunk in enumerate(chunks):
+        if rate:
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        render(chunk)
+
+    return time.process_time() - start_cpu
+
+
+class Frames:
+    """Counts frames and keeps the slowest one."""
+
+    def __init__(self):
+        self.count = 0
+        self.slowest = 0.0
+
+    def timed(self, func, *args, **kwargs):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        self.count += 1
+        self.slowest = max(self.slowest, time.perf_counter() - start)
+
+
+def bench_raw(chunks: list[str], rate: float) -> tuple[float, Frames]:
+
+    console = terminal()
+    frames = Frames()
+    accumulated = ""
+
+    def render(chunk):
+        nonlocal accumulated
+        frames.timed(console.print, chunk, end="")
+        accumulated += chunk
+
+    return replay(chunks, rate, render), frames
+
+
+def bench_full_rerender(chunks: list[str], rate: float) -> tuple[float, Frames]:
+
+    console = terminal()
+    frames = Frames()
+    parts = []
+    last_frame = 0.0
+
+    with Live(console=console, auto_refresh=False, vertical_overflow="visible") as live:
+
+        def render(chunk):
+            nonlocal last_frame
+            parts.append(chunk)
+            now = time.monotonic()
+            if now - last_frame >= 1 / MAX_FPS:
+                last_frame = now
+                frames.timed(live.update, Markdown("".join(parts)), refresh=True)
+
+        cpu = replay(chunks, rate, render)
+
+    return cpu, frames
+
+
+def bench_markdown_stream(chunks: list[str], rate: float) -> tuple[float, Frames]:
+
+    console = terminal()
+    frames = Frames()
+
+    with MarkdownStream(console) as stream:
+        cpu = replay(chunks, rate, lambda chunk: frames.timed(stream.feed, chunk))
+
+    frames.count = stream.frames
+
+    return cpu, frames
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--tokens", type=int, default=20000)
+    parser.add_argument("--rate", type=float, default=2000)
+    parser.add_argument("--baseline-chunks", type=int, default=1500)
+    parser.add_argument("--stream", help="JSON lines file with one streamed chunk per line")
+    args = parser.parse_args()
+
+    if args.stream:
+        with open(args.stream) as file:
+            chunks = [json.loads(line) for line in file if line.strip()]
+    else:
+        chunks = generate_answer(args.tokens)
+
+    print(f"{len(chunks)} chunks, {sum(map(len, chunks))} characters, rate {args.rate:g}/s")
+
+    baseline = chunks[: args.baseline_chunks]
+
+    for name, bench, replayed in (
+        ("raw print per chunk", bench_raw, chunks),
+        (f"full re-render ({len(baseline)})", bench_full_rerender, baseline),
+        (f"MarkdownStream ({len(baseline)})", bench_markdown_stream, baseline),
+        ("MarkdownStream", bench_markdown_stream, chunks),
+    ):
+        cpu, frames = bench(replayed, args.rate)
+        print(
+            f"{name:<25} cpu {cpu:8.2f} s  frames {frames.count:6d}  "
+            f"slowest call {frames.slowest * 1000:8.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
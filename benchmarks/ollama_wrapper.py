@@ -0,0 +1,142 @@
+"""
+Per-request overhead of the Ollama clients against a local stub server.
+
+Compares the old pattern (a blocking `requests.post` with a new connection per call)
+with the pooled AsyncOllamaWrapper and its sync facade, for small JSON requests and for
+short NDJSON streams.
+
+    python benchmarks/ollama_wrapper.py --requests 500 --concurrency 16
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from ollama import AsyncOllamaWrapper, OllamaWrapper  # noqa: E402
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    stream_lines = 8
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+
+        if payload.get("stream"):
+            body = b"".join(
+                json.dumps({"response": "token ", "done": False}).encode() + b"\n"
+                for _ in range(self.stream_lines)
+            ) + json.dumps({"done": True}).encode() + b"\n"
+            content_type = "application/x-ndjson"
+        else:
+            body = json.dumps({"modelfile": "FROM stub", "parameters": ""}).encode()
+            content_type = "application/json"
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_stub_server() -> str:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def bench_requests(base_url: str, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        response = requests.post(f"{base_url}/api/show", json={"name": "stub"})
+        response.raise_for_status()
+        response.json()
+    return time.perf_counter() - start
+
+
+def bench_sync_facade(base_url: str, n: int) -> float:
+    wrapper = OllamaWrapper(base_url)
+    start = time.perf_counter()
+    for _ in range(n):
+        wrapper.show_model_information("stub")
+    elapsed = time.perf_counter() - start
+    wrapper.close()
+    return elapsed
+
+
+async def bench_async(base_url: str, n: int, concurrency: int, stream: bool) -> float:
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with AsyncOllamaWrapper(base_url) as wrapper:
+
+        async def one():
+            async with semaphore:
+                if stream:
+                    async for _ in wrapper.generate_completion("stub", "prompt"):
+                        pass
+                else:
+                    await wrapper.show_model_information("stub")
+
+        start = time.perf_counter()
+        await asyncio.gather(*[one() for _ in range(n)])
+        return time.perf_counter() - start
+
+
+def bench_requests_stream(base_url: str, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        response = requests.post(
+            f"{base_url}/api/generate",
+            json={"model": "stub", "prompt": "prompt", "stream": True},
+            stream=True,
+        )
+        for line in response.iter_lines():
+            json.loads(line)
+    return time.perf_counter() - start
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    base_url = start_stub_server()
+    n = args.requests
+
+    results = {
+        "requests.post, new connection": bench_requests(base_url, n),
+        "OllamaWrapper (sync facade)": bench_sync_facade(base_url, n),
+        "AsyncOllamaWrapper, sequential": asyncio.run(bench_async(base_url, n, 1, False)),
+        f"AsyncOllamaWrapper, {args.concurrency} concurrent": asyncio.run(
+            bench_async(base_url, n, args.concurrency, False)
+        ),
+        "requests.post stream, new connection": bench_requests_stream(base_url, n),
+        f"AsyncOllamaWrapper stream, {args.concurrency} concurrent": asyncio.run(
+            bench_async(base_url, n, args.concurrency, True)
+        ),
+    }
+
+    for name, elapsed in results.items():
+        print(f"{name:<45} {elapsed * 1e6 / n:10.1f} us/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Main-content extraction for `@url` and `@search` pages over saved HTML fixtures.
+
+Compares the old whole-page `get_text` against the extraction in llm_shell.extract,
+reporting the estimated prompt tokens per page and the parse time of both.
+
+    python benchmarks/page_extract.py --repeat 20
+    python benchmarks/page_extract.py --show docs_page
+"""
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "llm_shell"))
+
+from llm_shell.extract import extract  # noqa: E402
+from llm_shell.tokens import estimate_tokens  # noqa: E402
+
+FIXTURES = Path(__file__).parent / "fixtures" / "pages"
+
+
+def old_parse(html: str) -> str:
+    """The text of the whole page, as parse_page_content did before extraction."""
+
+    soup = BeautifulSoup(html, "html.parser")
+    soup.find("title")
+    code_snippets = soup.find_all(["code", "pre"])
+    "\n\n\n".join([code.get_text(strip=True) for code in code_snippets])
+    return soup.get_text(separator=" ", strip=True)
+
+
+def new_parse(html: str) -> str:
+    result = extract(html)
+    return "\n\n".join(filter(None, (result["content"], result["codes"])))
+
+
+def timed(func, html: str, repeat: int) -> tuple[str, float]:
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        text = func(html)
+    elapsed = (time.perf_counter() - start) / repeat
+
+    return text, elapsed
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--show", help="Print the extracted text of this fixture")
+    args = parser.parse_args()
+
+    if args.show:
+        print(new_parse((FIXTURES / f"{args.show}.html").read_text()))
+        return
+
+    print(
+        f"{'page':<20} {'old tokens':>10} {'new tokens':>10} {'saved':>7} "
+        f"{'old ms':>8} {'new ms':>8}"
+    )
+
+    totals = [0, 0]
+
+    for path in sorted(FIXTURES.glob("*.html")):
+
+        html = path.read_text()
+
+        old_text, old_time = timed(old_parse, html, args.repeat)
+        new_text, new_time = timed(new_parse, html, args.repeat)
+
+        old_tokens, new_tokens = estimate_tokens(old_text), estimate_tokens(new_text)
+        totals[0] += old_tokens
+        totals[1] += new_tokens
+
+        print(
+            f"{path.stem:<20} {old_tokens:>10} {new_tokens:>10} "
+            f"{1 - new_tokens / old_tokens:>7.0%} "
+            f"{old_time * 1000:>8.2f} {new_time * 1000:>8.2f}"
+        )
+
+    print(
+        f"{'total':<20} {totals[0]:>10} {totals[1]:>10} {1 - totals[1] / totals[0]:>7.0%}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,61 @@
 import os
-import fire
 import re
-import requests
-from rich.console import Console
-from dataclasses import dataclass
-import yaml
-from dacite import from_dict
-from typing import Dict
-from llm_shell.context_store import ContextStore
+import codecs
+import pickle
+from pathlib import Path
+from dataclasses import dataclass, fields
+from typing import Dict, TYPE_CHECKING
+import time
 import tempfile
 import subprocess
 
+# Everything heavier is imported by the feature that needs it, a plain question
+# should not pay for yaml, aiohttp, bs4 or numpy
+if TYPE_CHECKING:
+    from llm_shell.context_store import ContextStore
+    from llm_shell.prefetch import Prefetcher
 
-def _trigger_terminal_input(template: str = None):
+CONFIG_CACHE_FOLDER = Path(os.path.expanduser("~")) / ".llm-shell/cache"
+
+
+EDITOR_POLL_INTERVAL = 0.5
+# A dropped answer is resumed this many times in a row without progress, backing off
+RESUME_ATTEMPTS = 5
+RESUME_BACKOFF = 0.5
+
+
+def _trigger_terminal_input(template: str = None, on_change=None):
+    """
+    Let the user write the input in an editor. When on_change is given it is called
+    with the text every time the file is saved, while the editor is still open.
+    """
 
     with tempfile.NamedTemporaryFile(delete=False, mode="w+", suffix=".txt") as tmpfile:
         tmpfile_path = tmpfile.name
         if template is not None:
             tmpfile.write("\n\n" + template)
 
+    if on_change is not None and template is not None:
+        on_change(template)
+
+    modified = os.stat(tmpfile_path).st_mtime_ns
+
     editor_command = ["nano", tmpfile_path]
-    subprocess.run(editor_command)
+    editor = subprocess.Popen(editor_command)
+
+    while on_change is not None:
+        try:
+            editor.wait(timeout=EDITOR_POLL_INTERVAL)
+            break
+        except subprocess.TimeoutExpired:
+            pass
+
+        if os.stat(tmpfile_path).st_mtime_ns != modified:
+            modified = os.stat(tmpfile_path).st_mtime_ns
+            with open(tmpfile_path, "r") as tmpfile:
+                on_change(tmpfile.read())
+
+    editor.wait()
 
     with open(tmpfile_path, "r") as tmpfile:
         user_content = tmpfile.read().strip()
@@ -43,6 +78,15 @@ class Config:
         session: str = None
         system_prompt: str = "You are a friendly AI assistant"
         model: str = None
+        max_context_tokens: int = None
+        compact_after: int = None
+        summary_model: str = None
+        cache: str = None
+        retrieval: bool = False
+        embedding_model: str = "ollama/nomic-embed-text"
+        retrieval_top_k: int = 20
+        retrieval_max_tokens: int = 4000
+        prefetch_answer_links: bool = False
 
     profiles: Dict[str, Profile] = None
 
@@ -53,21 +97,28 @@ def get_from_default(value, default):
     return value
 
 
+def _set_options(**options) -> dict:
+    """The options that are set, unset ones are left to the backend's defaults."""
+    return {name: value for name, value in options.items() if value is not None}
+
+
 class ChatCLI:
 
     def __init__(self, config: Config, debug: bool = False):
 
+        from rich.console import Console
+        import requests
+
         self.config = config
 
         self.console = Console()
 
         self.debug = debug
 
-        if (
-            self.config.session is not None
-            and self._existing_session(self.config.session) is False
-        ):
-            self.create_session()
+        self.last_answer = ""
+
+        # Keeps the connection to the backend alive between requests
+        self._http = requests.Session()
 
     def _post_request(
         self,
@@ -78,7 +129,7 @@ class ChatCLI:
     ):
         """Helper function for making POST requests, with an optional stream parameter."""
         url = f"{self.config.base_url}{endpoint}"
-        response = requests.post(url, json=data, stream=stream)
+        response = self._http.post(url, json=data, stream=stream)
 
         if log is False or self.debug is False:
             return response
@@ -90,19 +141,6 @@ class ChatCLI:
 
         return response
 
-    def _existing_session(
-        self,
-        name: str = None,
-    ):
-        response = self._post_request(
-            "/session/exist",
-            {
-                "name": get_from_default(name, self.config.session),
-            },
-        )
-
-        return bool(response.content)
-
     def create_session(
         self,
         name: str = None,
@@ -129,37 +167,122 @@ class ChatCLI:
         )
         return self
 
+    def _answer_chunks(self, response):
+        """
+        Yield the bytes of a streamed answer. When the connection drops, the answer is
+        resumed from the last byte received instead of being generated again.
+        """
+        import requests
+
+        stream_id = response.headers.get("X-Stream-Id")
+        received = 0
+        attempts = 0
+
+        while True:
+            try:
+                if response is not None:
+                    for chunk in response.iter_content(chunk_size=None):
+                        received += len(chunk)
+                        attempts = 0
+                        yield chunk
+                    return
+
+                response = self._http.get(
+                    f"{self.config.base_url}/chat/resume",
+                    params={"id": stream_id, "offset": received},
+                    stream=True,
+                )
+                if response.status_code != 200:
+                    # Expired or failed on the backend, trying again does not help
+                    self.console.log("[bold red]Failed to resume the answer[/]", response.text)
+                    return
+                continue
+
+            except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError):
+                if stream_id is None or attempts == RESUME_ATTEMPTS:
+                    raise
+                response = None
+
+            time.sleep(RESUME_BACKOFF * 2 ** attempts)
+            attempts += 1
+
+    def embed(self, texts: list[str]):
+        """Embed texts with the embedding model of the profile, one float32 row per text."""
+        import base64
+        import numpy as np
+
+        response = self._post_request(
+            "/embeddings",
+            {"model": self.config.embedding_model, "texts": texts},
+        )
+        response.raise_for_status()
+        result = response.json()
+
+        return np.frombuffer(
+            base64.b64decode(result["data"]), dtype=np.float32
+        ).reshape(result["shape"])
+
     def _chat_interactive(
         self,
         record: bool = None,
     ):
+        """
+        Chat until exit or quit. With prefetch_answer_links set in the profile, the links
+        of the last answer are fetched into the page cache while the next question is
+        typed, for follow-up questions about them.
+        """
 
-        while True:
+        from llm_shell.prefetch import Prefetcher, find_links
 
-            user_content = self.console.input("[bold yellow]You:[/]")
+        prefetcher = Prefetcher()
 
-            if user_content.lower() in ["exit", "quit"]:
-                self.console.log("[bold red]Exiting interactive chat mode.[/]")
-                return
+        try:
+            while True:
 
-            self.chat(
-                user_content=user_content,
-                ignore_user_content=True,
-                record=record,
-            )
+                user_content = self.console.input("[bold yellow]You:[/]")
+
+                if user_content.lower() in ["exit", "quit"]:
+                    self.console.log("[bold red]Exiting interactive chat mode.[/]")
+                    return
+
+                behaviour, user_content = _extract_patterns_behaviour(user_content)
 
-            self.console.print("\n")
+                self.chat(
+                    user_content=user_content,
+                    context_store=_context_store(behaviour, prefetcher),
+                    ignore_user_content=True,
+                    record=record,
+                )
+
+                if self.config.prefetch_answer_links:
+                    prefetcher.update(urls=find_links(self.last_answer))
+
+                self.console.print("\n")
+        finally:
+            prefetcher.close()
 
     def chat(
         self,
         user_content: str = None,
-        context_store: ContextStore = None,
+        context_store: "ContextStore" = None,
         ignore_user_content: bool = False,
         record: bool = None,
     ):
-        """Send a chat request with only user content, display as it streams, and rerender code blocks after."""
-
-        if context_store is not None:
+        """Send a chat request with only user content, and render the markdown of the answer as it streams."""
+
+        if context_store is not None and self.config.retrieval:
+            user_content = (
+                context_store.generate(
+                    query=user_content,
+                    embed=self.embed,
+                    top_k=self.config.retrieval_top_k,
+                    max_tokens=self.config.retrieval_max_tokens,
+                    embed_model=self.config.embedding_model,
+                )
+                + "\n\n"
+                + user_content
+            )
+        elif context_store is not None:
             user_content = context_store.generate() + "\n\n" + user_content
 
         if ignore_user_content is False:
@@ -168,12 +291,18 @@ class ChatCLI:
 
         data = {
             "session": self.config.session,
+            # The backend creates the session on the first chat, no separate round-trip
+            "system_prompt": self.config.system_prompt,
             "model": self.config.model,
             "messages": [{"role": "user", "content": user_content}],
-            "options": {
-                "seed": self.config.seed,
-                "temperature": self.config.temperature,
-            },
+            "options": _set_options(
+                seed=self.config.seed,
+                temperature=self.config.temperature,
+                max_context_tokens=self.config.max_context_tokens,
+                compact_after=self.config.compact_after,
+                summary_model=self.config.summary_model,
+                cache=self.config.cache,
+            ),
             "record": get_from_default(record, self.config.record),
         }
 
@@ -181,17 +310,139 @@ class ChatCLI:
 
         response = self._post_request("/chat", data, stream=True, log=False)
         if response.status_code == 200:
-            accumulated = ""
-            for line in response:
-                decoded_line = line.decode("utf-8")
-                self.console.print(decoded_line, end="")
-                accumulated += decoded_line
+            from llm_shell.render import MarkdownStream
+
+            # Chunks can end in the middle of a multi-byte character
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            accumulated = []
+
+            with MarkdownStream(self.console) as stream:
+                for chunk in self._answer_chunks(response):
+                    text = decoder.decode(chunk)
+                    stream.feed(text)
+                    accumulated.append(text)
+
+                text = decoder.decode(b"", final=True)
+                stream.feed(text)
+                accumulated.append(text)
+
+            self.last_answer = "".join(accumulated)
 
         else:
             self.console.log("[bold red]Failed to initiate chat[/]", response.text)
 
         return self
 
+    def batch(self, input_path: str, output_path: str, concurrency: int = None):
+        """
+        Run the prompts of input_path through /chat/batch and append the results to
+        output_path as they complete. Prompts whose id is in output_path already are
+        skipped, failed ones are reported and left for the next run.
+        """
+        import json
+        import requests
+        from rich.progress import Progress
+
+        done = _completed_batch_ids(output_path)
+
+        items = []
+        with open(input_path) as file:
+            for number, line in enumerate(file, start=1):
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                item_id = str(entry.get("id", number))
+                if item_id not in done:
+                    items.append(self._batch_item(item_id, entry))
+
+        if not items:
+            self.console.print(f"All {len(done)} prompts are done already")
+            return self
+
+        response = self._http.post(
+            f"{self.config.base_url}/chat/batch",
+            params={"concurrency": concurrency} if concurrency else None,
+            data="".join(json.dumps(item) + "\n" for item in items).encode("utf-8"),
+            headers={"Content-Type": "application/x-ndjson"},
+            stream=True,
+        )
+        if response.status_code != 200:
+            self.console.log("[bold red]Failed to start the batch[/]", response.text)
+            return self
+
+        completed = failed = 0
+
+        with open(output_path, "a") as output, Progress(console=self.console) as progress:
+            task = progress.add_task("Batch", total=len(items))
+
+            try:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+
+                    result = json.loads(line)
+                    if "error" in result:
+                        failed += 1
+                        self.console.log(f"[bold red]{result['id']} failed[/]", result["error"])
+                    else:
+                        # Every result is a checkpoint, an interrupted run resumes after it
+                        output.write(json.dumps(result) + "\n")
+                        output.flush()
+                        completed += 1
+
+                    progress.advance(task)
+
+            except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError):
+                self.console.log("[bold red]Lost the connection, run again to resume[/]")
+
+        self.console.print(
+            f"{completed} done, {failed} failed, {len(items) - completed - failed} left, "
+            f"{len(done)} done by earlier runs, results in {output_path}"
+        )
+
+        return self
+
+    def _batch_item(self, item_id: str, entry: dict) -> dict:
+        """A /chat/batch request for a line of a batch file, with the profile's defaults."""
+
+        messages = entry.get("messages") or [
+            {"role": "system", "content": self.config.system_prompt},
+            {"role": "user", "content": entry["prompt"]},
+        ]
+
+        return {
+            "id": item_id,
+            "model": entry.get("model", self.config.model),
+            "messages": messages,
+            "options": {
+                **_set_options(
+                    seed=self.config.seed,
+                    temperature=self.config.temperature,
+                    cache=self.config.cache,
+                ),
+                **entry.get("options", {}),
+            },
+        }
+
+
+def _completed_batch_ids(output_path: str) -> set[str]:
+    """
+    The ids of the results in output_path. A line torn by an interrupted run is
+    removed, so that the next results are appended after the last complete one.
+    """
+    import json
+
+    if not os.path.exists(output_path):
+        return set()
+
+    with open(output_path, "rb+") as file:
+        content = file.read()
+        complete = content.rfind(b"\n") + 1
+        if complete < len(content):
+            file.truncate(complete)
+
+    return {json.loads(line)["id"] for line in content[:complete].splitlines() if line.strip()}
+
 
 def _extract_patterns_behaviour(input_string: str):
 
@@ -222,6 +473,81 @@ def _extract_patterns_behaviour(input_string: str):
     return results, input_string.strip()
 
 
+def _context_store(
+    behaviour: dict, prefetcher: "Prefetcher" = None
+) -> "ContextStore | None":
+    """A temporary context store with the references of behaviour, None without any."""
+
+    if not any(behaviour[name] for name in ("files", "urls", "search", "directory")):
+        return None
+
+    from llm_shell.context_store import ContextStore
+
+    context_store = ContextStore(
+        name="temporary",
+        clear=True,
+    )
+
+    with context_store.transaction():
+        (
+            context_store.add_files(behaviour["files"])
+            .add_urls(behaviour["urls"])
+            .add_search(
+                behaviour["search"],
+                top_results=3,
+                search_links=prefetcher.search_links if prefetcher is not None else None,
+            )
+            .add_files_by_git(behaviour["directory"])
+        )
+
+    return context_store
+
+
+def load_config(config_path: str, profile: str = "default") -> Config.Profile:
+    """
+    The profile of the YAML config at config_path. Parsed configs are pickled in the
+    cache folder and reused as long as the file and the Config fields are unchanged.
+    """
+
+    config_path = os.path.abspath(os.path.expanduser(config_path))
+    stat = os.stat(config_path)
+
+    signature = (
+        stat.st_mtime_ns,
+        stat.st_size,
+        tuple(field.name for field in fields(Config.Profile)),
+    )
+
+    cache_file = CONFIG_CACHE_FOLDER / "config.pickle"
+
+    try:
+        with open(cache_file, "rb") as file:
+            cached = pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+        cached = {}
+
+    if config_path in cached and cached[config_path][0] == signature:
+        return cached[config_path][1].profiles[profile]
+
+    import yaml
+    from dacite import from_dict
+
+    with open(config_path, "r") as file:
+        config_data = yaml.safe_load(file)
+
+    config = from_dict(Config, config_data)
+    cached[config_path] = (signature, config)
+
+    os.makedirs(CONFIG_CACHE_FOLDER, exist_ok=True)
+    # Concurrent runs each write their own file, the last rename wins
+    temporary_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(temporary_file, "wb") as file:
+        pickle.dump(cached, file)
+    os.replace(temporary_file, cache_file)
+
+    return config.profiles[profile]
+
+
 def set_default_behaviour(
     default_behaviour: str,
     profile: str = "default",
@@ -237,12 +563,7 @@ def chat_interactive(
     clean: bool = False,
 ):
 
-    config_path = os.path.expanduser(config_path)
-
-    with open(config_path, "r") as file:
-        config_data = yaml.safe_load(file)
-
-    config = from_dict(Config, config_data).profiles[profile]
+    config = load_config(config_path, profile)
 
     chat_interface = ChatCLI(config=config)
 
@@ -260,61 +581,109 @@ def chat(
     profile: str = "default",
 ):
 
-    config_path = os.path.expanduser(config_path)
-
-    with open(config_path, "r") as file:
-        config_data = yaml.safe_load(file)
-
-    config = from_dict(Config, config_data).profiles[profile]
+    config = load_config(config_path, profile)
 
     chat_interface = ChatCLI(config=config)
 
     if i is True:
         chat_interface._chat_interactive()
+        return
+
+    prefetcher = None
+
+    def prefetch(text: str):
+        nonlocal prefetcher
+
+        behaviour, _ = _extract_patterns_behaviour(text)
+
+        if prefetcher is None and (behaviour["search"] or behaviour["urls"]):
+            from llm_shell.prefetch import Prefetcher
+
+            prefetcher = Prefetcher()
+
+        if prefetcher is not None:
+            prefetcher.update(searches=behaviour["search"], urls=behaviour["urls"])
 
-    q = (
-        q
-        if q is not None
-        else _trigger_terminal_input(
-            set_default_behaviour(
-                profile=profile,
-                default_behaviour=config.default_behaviour,
+    try:
+        q = (
+            q
+            if q is not None
+            else _trigger_terminal_input(
+                set_default_behaviour(
+                    profile=profile,
+                    default_behaviour=config.default_behaviour,
+                ),
+                on_change=prefetch,
             )
         )
-    )
 
-    behaviour, q = _extract_patterns_behaviour(q)
+        # References that were edited away are dropped, the rest gets to finish
+        prefetch(q)
+        if prefetcher is not None:
+            prefetcher.wait()
 
-    record = len(behaviour["record"]) > 0
-    clean = len(behaviour["clean"]) > 0
+        behaviour, q = _extract_patterns_behaviour(q)
 
-    if clean:
-        chat_interface.delete_session().create_session()
+        record = len(behaviour["record"]) > 0
+        clean = len(behaviour["clean"]) > 0
 
-    context_store = (
-        ContextStore(
-            name="temporary",
-            clear=True,
-        )
-        .add_files(behaviour["files"])
-        .add_urls(behaviour["urls"])
-        .add_search(
-            behaviour["search"],
-            top_results=3,
-        )
-        .add_files_by_git(behaviour["directory"])
-    )
+        if clean:
+            chat_interface.delete_session().create_session()
+
+        context_store = _context_store(behaviour, prefetcher)
+
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
 
     chat_interface.chat(
         user_content=q,
         record=record,
-        interactive=i,
         context_store=context_store,
     )
 
 
+def batch(
+    input_path: str,
+    output_path: str = None,
+    concurrency: int = None,
+    config_path: str = "~/.llm-shell/config.yaml",
+    profile: str = "default",
+):
+    """
+    Run every prompt of a JSON lines file in one request to the backend. A line has a
+    `prompt` or `messages`, and optionally an `id` (defaults to the line number),
+    `model` and `options`, the profile provides the rest. Results are appended to
+    output_path (input_path with .results.jsonl by default) as they complete, and a
+    run that was interrupted resumes where it left off when started again.
+    """
+
+    config = load_config(config_path, profile)
+
+    if output_path is None:
+        output_path = os.path.splitext(input_path)[0] + ".results.jsonl"
+
+    ChatCLI(config=config).batch(input_path, output_path, concurrency=concurrency)
+
+
+def cache_stats():
+    """Print the hit rate and size of the file content cache."""
+
+    from rich.console import Console
+    from llm_shell.file_cache import FileCache
+
+    stats = FileCache().stats()
+
+    console = Console()
+    for name, value in stats.items():
+        console.print(f"[bold]{name}[/]: {value}")
+
+
 def main():
-    fire.Fire()
+    # fire exposes the names visible here, the underscore keeps this one out of the CLI
+    from fire import Fire as _Fire
+
+    _Fire()
 
 
 if __name__ == "__main__":
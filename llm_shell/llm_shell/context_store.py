@@ -1,49 +1,99 @@
 import os
 import json
-import asyncio
+import itertools
 from pathlib import Path
-from dacite import from_dict
-from llm_shell.search import urls_fetch, run_search_links
+from llm_shell.file_cache import FileCache
+from llm_shell.http_cache import PageCache
+from llm_shell.ingest import ingest_files, MAX_FILE_BYTES
 from dataclasses import dataclass, asdict, field
+from contextlib import contextmanager
 import subprocess
-import os
-from pathlib import Path
 
 
-def git_ls_files(directory: str) -> list[str]:
+def git_ls_files_with_blobs(
+    directory: str,
+    include: list[str] = None,
+    exclude: list[str] = None,
+    max_file_size: int = None,
+) -> dict[str, str | None]:
     """
-    List all the files tracked by Git in the specified directory with their full paths.
-    This version correctly includes the specified directory in the path.
+    Map the files tracked by Git under directory to the blob hash of their content.
+
+    The listing is scoped to directory and filtered with include/exclude glob pathspecs
+    by git itself. Files modified in the work tree map to None as their blob hash does
+    not match the content on disk, files deleted from the work tree are left out. With
+    max_file_size, larger files are left out, sizes are read from the object database
+    for unmodified files.
     """
-    # Ensure the directory is an absolute path
+
     directory = Path(directory).resolve()
 
-    # Find the repository root
-    repo_root = subprocess.run(
-        ["git", "-C", str(directory), "rev-parse", "--show-toplevel"],
-        capture_output=True,
-        text=True,
-        check=True,
-    ).stdout.strip()
-    repo_root_path = Path(repo_root)
+    pathspecs = [f":(glob){pattern}" for pattern in include] if include else ["."]
+    pathspecs += [f":(exclude,glob){pattern}" for pattern in exclude or []]
+
+    def ls_files(*options) -> list[str]:
+        output = subprocess.run(
+            ["git", "-C", str(directory), "ls-files", "-z", *options, "--", *pathspecs],
+            capture_output=True,
+            check=True,
+        ).stdout
+        return [os.fsdecode(entry) for entry in output.split(b"\0") if entry]
+
+    blobs = {}
+    for entry in ls_files("--stage"):
+        info, path = entry.split("\t", 1)
+        mode, blob, stage = info.split(" ")
+        if mode == "160000":
+            # Submodule
+            continue
+        # Symlinks and unmerged paths have no blob matching the file content
+        blobs[path] = blob if mode != "120000" and stage == "0" else None
+
+    for path in ls_files("--modified"):
+        if path not in blobs:
+            continue
+        if os.path.isfile(directory / path):
+            blobs[path] = None
+        else:
+            del blobs[path]
 
-    # Get all files tracked by git in the repository
-    result = subprocess.run(
-        ["git", "-C", str(repo_root), "ls-files"],
+    if max_file_size is not None:
+        sizes = _git_blob_sizes(directory, {blob for blob in blobs.values() if blob})
+        blobs = {
+            path: blob
+            for path, blob in blobs.items()
+            if (
+                sizes[blob] if blob else os.path.getsize(directory / path)
+            ) <= max_file_size
+        }
+
+    return {str(directory / path): blob for path, blob in blobs.items()}
+
+
+def _git_blob_sizes(directory: Path, blobs: set[str]) -> dict[str, int]:
+
+    output = subprocess.run(
+        ["git", "-C", str(directory), "cat-file", "--batch-check=%(objectname) %(objectsize)"],
+        input="".join(f"{blob}\n" for blob in blobs),
         capture_output=True,
         text=True,
         check=True,
-    )
+    ).stdout
+
+    sizes = {}
+    for line in output.splitlines():
+        blob, size = line.split(" ")
+        sizes[blob] = int(size)
 
-    # Filter files to include only those in the specified directory (or its subdirectories)
-    files_in_directory = [
-        repo_root_path / path
-        for path in result.stdout.strip().split("\n")
-        if (repo_root_path / path).resolve().is_file()
-        and directory in (repo_root_path / path).resolve().parents
-    ]
+    return sizes
 
-    return [str(file) for file in files_in_directory]
+
+def git_ls_files(directory: str, **kwargs) -> list[str]:
+    """
+    List all the files tracked by Git in the specified directory with their full paths.
+    Takes the filters of git_ls_files_with_blobs.
+    """
+    return list(git_ls_files_with_blobs(directory, **kwargs))
 
 
 @dataclass
@@ -59,15 +109,33 @@ class ContextStore:
 
     CONTEXT_FOLDER = Path(os.path.expanduser("~")) / ".llm-shell/context"
 
+    # Characters of file content added to a prompt before further files are left out
+    MAX_CONTEXT_CHARS = 16 * 1024 * 1024
+
+    # Additions are appended to a journal, it is folded into the snapshot once it is
+    # larger than both the snapshot and this
+    MIN_JOURNAL_BYTES = 64 * 1024
+
     def __init__(
         self,
         name: str,
         clear: bool = False,
+        max_file_bytes: int = MAX_FILE_BYTES,
     ):
 
         self.name = name
+        self.max_file_bytes = max_file_bytes
+        self.max_context_chars = ContextStore.MAX_CONTEXT_CHARS
 
         self.context_file = ContextStore.CONTEXT_FOLDER / f"{self.name}.json"
+        self.journal_file = ContextStore.CONTEXT_FOLDER / f"{self.name}.journal"
+        self.index_folder = ContextStore.CONTEXT_FOLDER / f"{self.name}.index"
+        self._file_cache = None
+        self._page_cache = None
+        self._git_blobs = {}
+
+        self._pending = []
+        self._transaction_depth = 0
 
         try:
             os.makedirs(self.context_file.parent, exist_ok=True)
@@ -76,18 +144,58 @@ class ContextStore:
 
         self._load(clear=clear)
 
-    @staticmethod
-    def _write_decorator(func):
-        def inner(self, *args, **kwargs):
-            func(self, *args, **kwargs)
-            self._write()
-            return self
+    @contextmanager
+    def transaction(self):
+        """
+        Batch the additions made inside the block into a single write. When the block
+        raises, the additions are discarded and the store is reloaded from disk.
+        """
 
-        return inner
+        self._transaction_depth += 1
 
-    def generate(self):
+        try:
+            yield self
+        except BaseException:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self._pending = []
+                self._load()
+            raise
+
+        self._transaction_depth -= 1
+        if self._transaction_depth == 0:
+            self._flush()
+
+    def generate(
+        self,
+        query: str = None,
+        embed=None,
+        top_k: int = 20,
+        max_tokens: int = 4000,
+        embed_model: str = "default",
+    ):
+        """
+        Build the context for a question.
+
+        Without embed the full content of every file and URL is added. With embed, a
+        function mapping a list of texts to a float32 embedding matrix, the content is
+        chunked and indexed and only the top_k chunks most similar to query that fit
+        in max_tokens are added. embed_model names the embeddings in the file cache.
+        """
+
+        if embed is not None and query:
+            context = self._retrieve(
+                query,
+                embed=embed,
+                top_k=top_k,
+                max_tokens=max_tokens,
+                embed_model=embed_model,
+            )
+        else:
+            context = self._load_files() + self._load_urls()
 
-        context = self._load_files() + self._load_urls()
+        if self._file_cache is not None:
+            self._file_cache.flush()
 
         if context != "":
 
@@ -99,73 +207,148 @@ class ContextStore:
         else:
             return ""
 
-    def _load_files(self):
+    def _retrieve(
+        self, query: str, embed, top_k: int, max_tokens: int, embed_model: str
+    ):
 
-        template = "Filename:\n{name}\nFile content:\n{content}"
-
-        context = ""
-
-        for file_path in self.data.files:
-            try:
-                with open(file_path, "r") as file:
-                    content = file.read()
-                context = (
-                    context
-                    + template.format(
-                        name=file_path,
-                        content=content,
-                    )
-                    + "\n"
+        from llm_shell.retrieval import VectorIndex, CHUNK_TEMPLATE
+
+        def url_documents():
+            for result in self._url_documents():
+                text = self._url_text(result)
+                yield (
+                    f"{result['title']} ({result['url']})",
+                    text,
+                    FileCache.digest(text.encode("utf-8")),
                 )
 
-            except Exception as e:
-                print(e)
+        # Streamed into the index, a file's text is dropped once it is chunked
+        index = VectorIndex(self.index_folder).build(
+            itertools.chain(self._file_documents(), url_documents()),
+            embed=embed,
+            cache=self.file_cache,
+            embed_model=embed_model,
+        )
+
+        chunks = index.select(embed([query])[0], top_k=top_k, max_tokens=max_tokens)
+
+        return "".join(
+            CHUNK_TEMPLATE.format(source=chunk["source"], content=chunk["content"]) + "\n"
+            for chunk in chunks
+        )
+
+    @property
+    def file_cache(self) -> FileCache:
+        if self._file_cache is None:
+            self._file_cache = FileCache()
+        return self._file_cache
+
+    @property
+    def page_cache(self) -> PageCache:
+        if self._page_cache is None:
+            self._page_cache = PageCache()
+        return self._page_cache
+
+    def cache_stats(self) -> dict:
+        return self.file_cache.stats()
+
+    def _file_documents(self):
+        """
+        (path, content, digest) of every text file, unchanged files come from the file cache.
+        Files are read in parallel, binary files are skipped and large files truncated.
+        """
+
+        for result in ingest_files(
+            self.data.files,
+            max_file_bytes=self.max_file_bytes,
+            cache=self.file_cache,
+            blobs=self._git_blobs,
+        ):
+            if result.error is not None:
+                print(result.error)
+            elif not result.binary:
+                yield result.path, result.text, result.digest
 
-        return context
+    @staticmethod
+    def _url_text(result: dict) -> str:
+        return "\n\n".join(filter(None, (result["content"], result["codes"])))
 
-    def _load_urls(self):
+    def _url_documents(self):
 
-        template = "URL Title:\n{title}\nURL Link\n{link}\nURL content:\n{content}"
+        if not self.data.urls:
+            return []
 
-        context = ""
+        # aiohttp and bs4 are only imported when there are URLs to fetch
+        import asyncio
+        from llm_shell.search import urls_fetch
 
-        url_contents = asyncio.run(urls_fetch(self.data.urls))
+        return asyncio.run(urls_fetch(self.data.urls, cache=self.page_cache))
 
-        for result in url_contents:
+    def _load_files(self):
 
-            context = (
-                context
-                + template.format(
-                    title=result["title"],
-                    link=result["url"],
-                    content=result["content"],
-                )
-                + "\n"
-            )
+        template = "Filename:\n{name}\nFile content:\n{content}\n"
 
-        return context
+        parts = []
+        size = 0
+
+        for file_path, content, _ in self._file_documents():
+
+            if size >= self.max_context_chars:
+                parts.append("[... remaining files omitted ...]\n")
+                break
+
+            part = template.format(name=file_path, content=content)
+            size += len(part)
+            parts.append(part)
+
+        return "".join(parts)
+
+    def _load_urls(self):
+
+        template = "URL Title:\n{title}\nURL Link\n{link}\nURL content:\n{content}\n"
+        codes_template = "URL code:\n{codes}\n"
+
+        return "".join(
+            template.format(
+                title=result["title"],
+                link=result["url"],
+                content=result["content"],
+            )
+            + (codes_template.format(codes=result["codes"]) if result["codes"] else "")
+            for result in self._url_documents()
+        )
 
-    @_write_decorator
     def add_files(self, file_paths: str | list):
         if isinstance(file_paths, str):
             file_paths = [file_paths]
-        self.data.files.extend(file_paths)
+        self._add("files", file_paths)
         return self
 
-    @_write_decorator
     def add_urls(self, urls: str | list[str]):
         if isinstance(urls, str):
             urls = [urls]
-        self.data.urls.extend(urls)
+        self._add("urls", urls)
         return self
 
-    def add_search(self, query: str | list[str], top_results: int = None):
+    def add_search(
+        self, query: str | list[str], top_results: int = None, search_links=None
+    ):
+        """
+        Add the links found for the queries. search_links may provide the links of a
+        query that was already searched, when it returns None the search is run here.
+        """
         if isinstance(query, str):
             query = [query]
 
-        for q in query:
-            results = asyncio.run(run_search_links(query=q))
-            self.add_urls(results[0:top_results] if top_results else results)
+        with self.transaction():
+            for q in query:
+                results = search_links(q) if search_links is not None else None
+                if results is None:
+                    import asyncio
+                    from llm_shell.search import run_search_links
+
+                    results = asyncio.run(run_search_links(query=q))
+                self.add_urls(results[0:top_results] if top_results else results)
 
         return self
 
@@ -180,32 +363,139 @@ class ContextStore:
         self.add_files(files)
         return self
 
-    def add_files_by_git(self, directory: str | list[str]):
+    def add_files_by_git(
+        self,
+        directory: str | list[str],
+        include: list[str] = None,
+        exclude: list[str] = None,
+        max_file_size: int = None,
+    ):
 
         if isinstance(directory, str):
             directory = [directory]
-        for d in directory:
-            self.add_files(git_ls_files(d))
+        with self.transaction():
+            for d in directory:
+                files = git_ls_files_with_blobs(
+                    d, include=include, exclude=exclude, max_file_size=max_file_size
+                )
+                # Blob hashes of unmodified files key the file cache without hashing them
+                self._git_blobs.update((path, blob) for path, blob in files.items() if blob)
+                self.add_files(list(files))
         return self
 
+    def _add(self, name: str, items: list[str]):
+        """Append the items that are not in the store yet, in order."""
+
+        members = self._members[name]
+
+        new = [item for item in dict.fromkeys(items) if item not in members]
+        if not new:
+            return
+
+        getattr(self.data, name).extend(new)
+        members.update(new)
+
+        self._pending.append({name: new})
+
+        if self._transaction_depth == 0:
+            self._flush()
+
+    def _flush(self):
+        """Append the pending additions to the journal, folding it in when it got large."""
+
+        if not self._pending:
+            return
+
+        entries = "".join(
+            json.dumps(entry, separators=(",", ":")) + "\n" for entry in self._pending
+        )
+        self._pending = []
+
+        with open(self.journal_file, "a") as file:
+            file.write(entries)
+
+        self._journal_bytes += len(entries)
+
+        # Rewriting the snapshot costs about its size, doing it only once the journal
+        # is as large keeps the cost per addition proportional to the addition
+        if self._journal_bytes > max(self._snapshot_bytes, ContextStore.MIN_JOURNAL_BYTES):
+            self._write()
+
     def _write(self):
+        """Write the whole store as a compact snapshot and empty the journal."""
+
+        snapshot = json.dumps(asdict(self.data), separators=(",", ":"))
+
+        temporary_file = self.context_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(temporary_file, "w") as file:
+            file.write(snapshot)
+        os.replace(temporary_file, self.context_file)
+
+        # Entries left behind by a crash before this are already in the snapshot, and
+        # replaying them again adds nothing
+        if os.path.isfile(self.journal_file):
+            os.remove(self.journal_file)
 
-        with open(self.context_file, "w") as file:
-            json.dump(asdict(self.data), file, indent=4)
+        self._snapshot_bytes = len(snapshot)
+        self._journal_bytes = 0
 
     def _load(self, clear: bool = False):
 
+        self._snapshot_bytes = 0
+        self._journal_bytes = 0
+
         if clear is False and os.path.isfile(self.context_file):
 
             with open(self.context_file, "r") as file:
                 data = json.load(file)
 
+            from dacite import from_dict
+
             self.data = from_dict(ContextStoreData, data)
+            self._snapshot_bytes = os.path.getsize(self.context_file)
 
         else:
 
             self.data = ContextStoreData()
+            self._members = {"files": set(), "urls": set()}
 
             self._write()
 
             return
+
+        # Stores written before the journal may hold duplicates
+        self.data.files = list(dict.fromkeys(self.data.files))
+        self.data.urls = list(dict.fromkeys(self.data.urls))
+        self._members = {"files": set(self.data.files), "urls": set(self.data.urls)}
+
+        if os.path.isfile(self.journal_file):
+            self._replay_journal()
+
+    def _replay_journal(self):
+
+        torn = False
+
+        # A torn multi-byte character shows up as a replacement in the torn line
+        with open(self.journal_file, "r", errors="replace") as file:
+            for line in file:
+                try:
+                    if not line.endswith("\n"):
+                        raise ValueError("incomplete line")
+                    entry = json.loads(line)
+                except ValueError:
+                    # A write cut short by a crash, nothing after it was completed
+                    torn = True
+                    break
+
+                self._journal_bytes += len(line)
+
+                for name, items in entry.items():
+                    members = self._members[name]
+                    new = [item for item in items if item not in members]
+                    getattr(self.data, name).extend(new)
+                    members.update(new)
+
+        # Later entries would be appended after the torn bytes and be lost on every
+        # load, the store is folded into a fresh snapshot instead
+        if torn:
+            self._write()
@@ -0,0 +1,203 @@
+import re
+from bs4 import BeautifulSoup, Tag
+from llm_shell.tokens import estimate_tokens
+
+
+# Bumped when the extraction changes, cached pages of older versions are parsed again
+EXTRACT_VERSION = 2
+
+BOILERPLATE_TAGS = [
+    "script", "style", "noscript", "template", "iframe", "svg", "canvas",
+    "nav", "header", "footer", "aside", "form", "button", "select", "dialog",
+]
+# Words of class names and ids that mark boilerplate, matched as whole words (or
+# their plural) so that e.g. "unrelated" or "shared" are not dropped
+BOILERPLATE_WORDS = {
+    "cookie", "consent", "banner", "navbar", "menu", "breadcrumb", "footer", "sidebar",
+    "share", "social", "subscribe", "newsletter", "advert", "advertisement", "promo",
+    "related", "popup", "modal", "comment",
+}
+# Syntax highlighters mark up code with such names (hljs-comment, token comment)
+CODE_TAGS = ["pre", "code"]
+# Never dropped by their class or id, nor are elements containing them
+CONTENT_TAGS = ["html", "body", "main", "article"]
+
+BLOCK_TAGS = {
+    "p", "pre", "li", "blockquote", "td", "dd", "dt", "figcaption", "div",
+    "h1", "h2", "h3", "h4", "h5", "h6",
+}
+HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+# List items and table cells are kept however short they are
+SHORT_BLOCK_TAGS = {"li", "td", "dt", "dd"}
+
+# Blocks with a larger share of their text in links are navigation, not content
+MAX_LINK_DENSITY = 0.5
+MIN_BLOCK_CHARS = 25
+ANCESTOR_LEVELS = 3
+
+
+def _text(element: Tag) -> str:
+    if element.name == "pre":
+        return element.get_text().strip("\n")
+    return element.get_text(" ", strip=True)
+
+
+def _link_density(element: Tag, text: str) -> float:
+    if not text:
+        return 1.0
+    links = sum(len(link.get_text(" ", strip=True)) for link in element.find_all("a"))
+    return links / len(text)
+
+
+def _is_boilerplate(element: Tag) -> bool:
+
+    if element.name in CONTENT_TAGS or element.attrs is None:
+        return False
+
+    if element.name in CODE_TAGS or element.find_parent(CODE_TAGS) is not None:
+        return False
+
+    names = " ".join(element.get("class") or []) + " " + (element.get("id") or "")
+    words = re.split(r"[^a-z0-9]+", names.lower())
+
+    if not any(
+        word in BOILERPLATE_WORDS or (word.endswith("s") and word[:-1] in BOILERPLATE_WORDS)
+        for word in words
+    ):
+        return False
+
+    # Layout wrappers named after a sidebar can still hold the article
+    return element.find(CONTENT_TAGS) is None
+
+
+def _strip_boilerplate(soup: BeautifulSoup):
+
+    for element in soup.find_all(BOILERPLATE_TAGS):
+        element.decompose()
+
+    for element in soup.find_all(_is_boilerplate):
+        # Children of an element removed earlier in this loop are already gone
+        if element.decomposed:
+            continue
+        element.decompose()
+
+
+def _leaf_blocks(root: Tag) -> list[Tag]:
+    """Block elements below root that do not contain other blocks, in document order."""
+
+    return [
+        element
+        for element in root.find_all(BLOCK_TAGS)
+        if element.name == "pre"
+        or (
+            element.find(BLOCK_TAGS) is None
+            and element.find_parent("pre") is None
+        )
+    ]
+
+
+def _main_container(soup: BeautifulSoup) -> Tag:
+    """
+    The element holding the main content. Every text block scores by its length and
+    punctuation, discounted by its link density, and adds its score divided by the
+    distance to each of its ANCESTOR_LEVELS closest ancestors. The best scoring element
+    wins, so a container of many similar posts beats any single post.
+    """
+
+    scores = {}
+    elements = {}
+
+    for block in _leaf_blocks(soup):
+
+        text = _text(block)
+        if len(text) < MIN_BLOCK_CHARS:
+            continue
+
+        score = (1 + text.count(",") + min(len(text) / 100, 3)) * (
+            1 - _link_density(block, text)
+        )
+
+        for level, ancestor in enumerate(block.parents, start=1):
+            if level > ANCESTOR_LEVELS or ancestor.name == "[document]":
+                break
+            elements[id(ancestor)] = ancestor
+            scores[id(ancestor)] = scores.get(id(ancestor), 0) + score / level
+
+    if not scores:
+        return soup.body or soup
+
+    return elements[max(scores, key=scores.get)]
+
+
+def _code_blocks(root: Tag) -> list[str]:
+    """Preformatted blocks and multiline code outside of them."""
+
+    return [
+        _text(element)
+        for element in root.find_all(["pre", "code"])
+        if element.name == "pre"
+        or (element.find_parent("pre") is None and "\n" in element.get_text().strip())
+    ]
+
+
+def extract(html: str) -> dict:
+    """
+    Title, main content and code blocks of an HTML page.
+
+    Boilerplate elements (navigation, headers, footers, cookie banners, ...) are removed,
+    the main container is located by text and link density, and its blocks are kept in
+    order without repeated text. Code blocks outside the main container end up in
+    codes. raw_tokens and tokens estimate the size of the whole page text and of the
+    extracted content.
+    """
+
+    soup = BeautifulSoup(html, "html.parser")
+
+    title = soup.find("title")
+    title = title.get_text(strip=True) if title else "No title found"
+
+    raw_tokens = estimate_tokens(soup.get_text(separator=" ", strip=True))
+
+    _strip_boilerplate(soup)
+
+    container = _main_container(soup)
+
+    seen = set()
+
+    def is_new(text: str) -> bool:
+        key = " ".join(text.split()).lower()
+        if not key or key in seen:
+            return False
+        seen.add(key)
+        return True
+
+    parts = []
+    for block in _leaf_blocks(container):
+
+        text = _text(block)
+
+        if block.name == "pre":
+            keep = True
+        elif block.name in HEADING_TAGS or block.name in SHORT_BLOCK_TAGS:
+            keep = _link_density(block, text) < MAX_LINK_DENSITY
+        else:
+            keep = len(text) >= MIN_BLOCK_CHARS and _link_density(block, text) < MAX_LINK_DENSITY
+
+        if keep and is_new(text):
+            parts.append(text)
+
+    if not parts:
+        # Nothing looked like content, fall back to the text left after stripping
+        parts = [soup.get_text(separator=" ", strip=True)]
+
+    content = "\n\n".join(parts)
+    codes = [code for code in _code_blocks(soup) if is_new(code)]
+
+    return {
+        "title": title,
+        "content": content,
+        "codes": "\n\n\n".join(codes),
+        "raw_tokens": raw_tokens,
+        "tokens": estimate_tokens(content) + (estimate_tokens("".join(codes)) if codes else 0),
+        "version": EXTRACT_VERSION,
+    }
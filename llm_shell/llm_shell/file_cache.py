@@ -0,0 +1,248 @@
+import os
+import time
+import hashlib
+import sqlite3
+from pathlib import Path
+
+
+class FileCache:
+    """
+    Persistent cache of file contents and artifacts derived from them.
+
+    Files are looked up by their Git blob hash when they are unmodified in a Git work
+    tree, otherwise by (path, mtime, size). When those changed the file is re-read and
+    hashed, and the content is still a hit if a file with the same digest was seen
+    before (e.g. after a checkout or a touch). Derived artifacts such as chunks and
+    embeddings are stored per content digest. Least recently used entries are evicted
+    once the cached data passes max_bytes.
+    """
+
+    CACHE_FOLDER = Path(os.path.expanduser("~")) / ".llm-shell/cache"
+
+    def __init__(self, path: Path = None, max_bytes: int = 512 * 1024 * 1024):
+
+        self.path = Path(path) if path is not None else FileCache.CACHE_FOLDER / "files.sqlite"
+        self.max_bytes = max_bytes
+
+        os.makedirs(self.path.parent, exist_ok=True)
+
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, digest TEXT
+            );
+            CREATE TABLE IF NOT EXISTS contents (
+                digest TEXT PRIMARY KEY, text TEXT, bytes INTEGER, last_access REAL
+            );
+            CREATE TABLE IF NOT EXISTS artifacts (
+                digest TEXT, name TEXT, value BLOB, bytes INTEGER, last_access REAL,
+                PRIMARY KEY (digest, name)
+            );
+            CREATE TABLE IF NOT EXISTS blobs (blob TEXT PRIMARY KEY, digest TEXT);
+            CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER);
+            """
+        )
+
+        self._stats = {"hits": 0, "hash_hits": 0, "misses": 0}
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def flush(self):
+        """Persist the counters, evict down to max_bytes and commit."""
+
+        self.db.executemany(
+            "INSERT INTO stats (name, value) VALUES (?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+            self._stats.items(),
+        )
+        self._stats = dict.fromkeys(self._stats, 0)
+
+        self._evict()
+
+        self.db.commit()
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def lookup(self, path: str, stat: os.stat_result = None) -> tuple[str, str] | None:
+        """(digest, text) of path if it is unchanged since it was cached, None otherwise."""
+
+        stat = stat if stat is not None else os.stat(path)
+
+        row = self.db.execute(
+            "SELECT contents.digest, contents.text FROM files "
+            "JOIN contents ON contents.digest = files.digest "
+            "WHERE files.path = ? AND files.mtime_ns = ? AND files.size = ?",
+            (path, stat.st_mtime_ns, stat.st_size),
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        self._stats["hits"] += 1
+        self._touch("contents", row[0])
+
+        return row
+
+    def lookup_blob(self, blob: str) -> tuple[str, str] | None:
+        """(digest, text) of the content with the Git blob hash blob, if cached."""
+
+        row = self.db.execute(
+            "SELECT contents.digest, contents.text FROM blobs "
+            "JOIN contents ON contents.digest = blobs.digest WHERE blobs.blob = ?",
+            (blob,),
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        self._stats["hits"] += 1
+        self._touch("contents", row[0])
+
+        return row
+
+    def store(
+        self,
+        path: str,
+        data: bytes,
+        text: str,
+        stat: os.stat_result = None,
+        blob: str = None,
+    ) -> str:
+        """Record the content read from path, returns its digest."""
+
+        stat = stat if stat is not None else os.stat(path)
+        digest = self.digest(data)
+
+        known = self.db.execute(
+            "SELECT 1 FROM contents WHERE digest = ?", (digest,)
+        ).fetchone()
+
+        if known:
+            self._stats["hash_hits"] += 1
+            self._touch("contents", digest)
+        else:
+            self._stats["misses"] += 1
+            self.db.execute(
+                "INSERT INTO contents (digest, text, bytes, last_access) VALUES (?, ?, ?, ?)",
+                (digest, text, len(text.encode("utf-8")), time.time()),
+            )
+
+        self.db.execute(
+            "INSERT OR REPLACE INTO files (path, mtime_ns, size, digest) VALUES (?, ?, ?, ?)",
+            (path, stat.st_mtime_ns, stat.st_size, digest),
+        )
+
+        if blob is not None:
+            self.db.execute(
+                "INSERT OR REPLACE INTO blobs (blob, digest) VALUES (?, ?)", (blob, digest)
+            )
+
+        return digest
+
+    def read_text(self, path: str) -> tuple[str, str]:
+        """(digest, text) of path, only read from disk if it changed since it was cached."""
+
+        stat = os.stat(path)
+
+        cached = self.lookup(path, stat)
+        if cached is not None:
+            return cached
+
+        with open(path, "rb") as file:
+            data = file.read()
+
+        text = data.decode("utf-8", errors="replace")
+
+        return self.store(path, data, text, stat), text
+
+    def get_artifact(self, digest: str, name: str) -> bytes | None:
+
+        row = self.db.execute(
+            "SELECT value FROM artifacts WHERE digest = ? AND name = ?", (digest, name)
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        self.db.execute(
+            "UPDATE artifacts SET last_access = ? WHERE digest = ? AND name = ?",
+            (time.time(), digest, name),
+        )
+
+        return row[0]
+
+    def set_artifact(self, digest: str, name: str, value: bytes):
+
+        self.db.execute(
+            "INSERT OR REPLACE INTO artifacts (digest, name, value, bytes, last_access) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (digest, name, value, len(value), time.time()),
+        )
+
+    def _touch(self, table: str, digest: str):
+        self.db.execute(
+            f"UPDATE {table} SET last_access = ? WHERE digest = ?", (time.time(), digest)
+        )
+
+    def size(self) -> int:
+        return sum(
+            self.db.execute(f"SELECT COALESCE(SUM(bytes), 0) FROM {table}").fetchone()[0]
+            for table in ("contents", "artifacts")
+        )
+
+    def _evict(self):
+
+        excess = self.size() - self.max_bytes
+
+        if excess <= 0:
+            return
+
+        rows = self.db.execute(
+            "SELECT 'contents', digest, NULL, bytes, last_access FROM contents "
+            "UNION ALL SELECT 'artifacts', digest, name, bytes, last_access FROM artifacts "
+            "ORDER BY last_access"
+        )
+
+        contents, artifacts = [], []
+        for table, digest, name, size, _ in rows:
+            if excess <= 0:
+                break
+            excess -= size
+            if table == "contents":
+                contents.append((digest,))
+            else:
+                artifacts.append((digest, name))
+
+        self.db.executemany("DELETE FROM contents WHERE digest = ?", contents)
+        self.db.executemany("DELETE FROM files WHERE digest = ?", contents)
+        self.db.executemany("DELETE FROM blobs WHERE digest = ?", contents)
+        self.db.executemany(
+            "DELETE FROM artifacts WHERE digest = ? AND name = ?", artifacts
+        )
+
+    def stats(self) -> dict:
+
+        totals = dict(self.db.execute("SELECT name, value FROM stats").fetchall())
+        for name, value in self._stats.items():
+            totals[name] = totals.get(name, 0) + value
+
+        lookups = sum(totals.get(name, 0) for name in ("hits", "hash_hits", "misses"))
+
+        return {
+            **totals,
+            "hit_rate": (totals.get("hits", 0) + totals.get("hash_hits", 0)) / lookups
+            if lookups
+            else 0.0,
+            "files": self.db.execute("SELECT COUNT(*) FROM files").fetchone()[0],
+            "contents": self.db.execute("SELECT COUNT(*) FROM contents").fetchone()[0],
+            "artifacts": self.db.execute("SELECT COUNT(*) FROM artifacts").fetchone()[0],
+            "bytes": self.size(),
+            "max_bytes": self.max_bytes,
+        }
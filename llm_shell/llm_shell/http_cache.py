@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import sqlite3
+from pathlib import Path
+from dataclasses import dataclass
+
+
+@dataclass
+class CachedPage:
+
+    url: str
+    etag: str
+    last_modified: str
+    fetched_at: float
+    html: str
+    parsed: dict
+
+    def is_fresh(self, ttl: float) -> bool:
+        return time.time() - self.fetched_at < ttl
+
+    def conditional_headers(self) -> dict:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class PageCache:
+    """
+    On-disk cache of fetched pages, both the raw HTML and the parsed result.
+
+    Pages younger than ttl seconds are served without touching the network. Older pages
+    are revalidated with If-None-Match/If-Modified-Since, and a 304 answer reuses the
+    stored parse. Least recently used pages are evicted once the stored HTML and parses
+    pass max_bytes.
+    """
+
+    CACHE_FOLDER = Path(os.path.expanduser("~")) / ".llm-shell/cache"
+
+    def __init__(
+        self,
+        path: Path = None,
+        ttl: float = 24 * 3600,
+        max_bytes: int = 256 * 1024 * 1024,
+    ):
+
+        self.path = Path(path) if path is not None else PageCache.CACHE_FOLDER / "pages.sqlite"
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        os.makedirs(self.path.parent, exist_ok=True)
+
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, fetched_at REAL,
+                html TEXT, parsed TEXT, bytes INTEGER, last_access REAL
+            )
+            """
+        )
+
+    def close(self):
+        self.db.close()
+
+    def get(self, url: str) -> CachedPage | None:
+
+        row = self.db.execute(
+            "SELECT url, etag, last_modified, fetched_at, html, parsed FROM pages WHERE url = ?",
+            (url,),
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        self.db.execute("UPDATE pages SET last_access = ? WHERE url = ?", (time.time(), url))
+        self.db.commit()
+
+        return CachedPage(*row[:5], parsed=json.loads(row[5]))
+
+    def put(self, url: str, html: str, parsed: dict, etag: str = None, last_modified: str = None):
+
+        parsed = json.dumps(parsed)
+        now = time.time()
+
+        self.db.execute(
+            "INSERT OR REPLACE INTO pages "
+            "(url, etag, last_modified, fetched_at, html, parsed, bytes, last_access) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (url, etag, last_modified, now, html, parsed, len(html) + len(parsed), now),
+        )
+        self._evict()
+        self.db.commit()
+
+    def revalidated(self, url: str, etag: str = None, last_modified: str = None):
+        """Mark a cached page as fresh again after a 304 answer."""
+
+        self.db.execute(
+            "UPDATE pages SET fetched_at = ?, etag = COALESCE(?, etag), "
+            "last_modified = COALESCE(?, last_modified) WHERE url = ?",
+            (time.time(), etag, last_modified, url),
+        )
+        self.db.commit()
+
+    def _evict(self):
+
+        excess = (
+            self.db.execute("SELECT COALESCE(SUM(bytes), 0) FROM pages").fetchone()[0]
+            - self.max_bytes
+        )
+
+        if excess <= 0:
+            return
+
+        evicted = []
+        for url, size in self.db.execute("SELECT url, bytes FROM pages ORDER BY last_access"):
+            if excess <= 0:
+                break
+            excess -= size
+            evicted.append((url,))
+
+        self.db.executemany("DELETE FROM pages WHERE url = ?", evicted)
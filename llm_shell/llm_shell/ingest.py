@@ -0,0 +1,137 @@
+import os
+import mmap
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+
+MAX_FILE_BYTES = 256 * 1024
+# Files from this size on are mapped instead of read, only the pages used are loaded
+MMAP_MIN_BYTES = 1024 * 1024
+BINARY_SNIFF_BYTES = 8192
+
+TRUNCATION_MARKER = "\n[... truncated {omitted} bytes ...]\n"
+
+
+@dataclass
+class IngestedFile:
+
+    path: str
+    text: str = None
+    digest: str = None
+    # Bytes read from disk, the content hashed by the cache
+    data: bytes = None
+    stat: os.stat_result = None
+    binary: bool = False
+    error: Exception = None
+
+
+def is_binary(sample: bytes) -> bool:
+    return b"\0" in sample
+
+
+def read_file(path: str, max_bytes: int = MAX_FILE_BYTES) -> IngestedFile:
+    """Read at most max_bytes of path as text, binary files are detected and not decoded."""
+
+    try:
+        stat = os.stat(path)
+
+        with open(path, "rb") as file:
+            if stat.st_size >= MMAP_MIN_BYTES:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    sample = mapped[:BINARY_SNIFF_BYTES]
+                    data = None if is_binary(sample) else mapped[:max_bytes]
+            else:
+                data = file.read(max_bytes)
+                sample = data[:BINARY_SNIFF_BYTES]
+                if is_binary(sample):
+                    data = None
+
+    except OSError as error:
+        return IngestedFile(path=path, error=error)
+
+    if data is None:
+        return IngestedFile(path=path, stat=stat, binary=True)
+
+    text = data.decode("utf-8", errors="replace")
+
+    if stat.st_size > len(data):
+        text += TRUNCATION_MARKER.format(omitted=stat.st_size - len(data))
+        # The marker depends on the full size, so it is part of what gets cached
+        data = text.encode("utf-8")
+
+    return IngestedFile(path=path, text=text, data=data, stat=stat)
+
+
+def ingest_files(
+    paths: list[str],
+    max_file_bytes: int = MAX_FILE_BYTES,
+    max_workers: int = 8,
+    cache=None,
+    blobs: dict[str, str] = None,
+):
+    """
+    Yield an IngestedFile per path, in order, reading files on a thread pool.
+
+    At most 2 * max_workers files are read ahead of the consumer, so memory use is
+    bounded by the per-file cap no matter how many paths there are. Files that are
+    unchanged in the FileCache are not read at all, and files with a known Git blob hash
+    in blobs are found in the cache without even a stat. The cache is only touched
+    from the calling thread.
+    """
+
+    blobs = blobs or {}
+
+    window = 2 * max_workers
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        pending = deque()
+        paths = iter(paths)
+
+        def submit_next() -> bool:
+            path = next(paths, None)
+            if path is None:
+                return False
+
+            if cache is not None:
+                try:
+                    cached = None
+                    if blobs.get(path):
+                        cached = cache.lookup_blob(blobs[path])
+                    if cached is None:
+                        cached = cache.lookup(path)
+                except OSError as error:
+                    pending.append(IngestedFile(path=path, error=error))
+                    return True
+                if cached is not None:
+                    digest, text = cached
+                    pending.append(IngestedFile(path=path, text=text, digest=digest))
+                    return True
+
+            pending.append(executor.submit(read_file, path, max_file_bytes))
+            return True
+
+        while len(pending) < window and submit_next():
+            pass
+
+        while pending:
+
+            item = pending.popleft()
+            submit_next()
+
+            result = item if isinstance(item, IngestedFile) else item.result()
+
+            if cache is not None and result.data is not None:
+                result.digest = cache.store(
+                    result.path,
+                    result.data,
+                    result.text,
+                    result.stat,
+                    blob=blobs.get(result.path),
+                )
+
+            # Do not keep the raw bytes alive beyond this point
+            result.data = None
+
+            yield result
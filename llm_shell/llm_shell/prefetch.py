@@ -0,0 +1,123 @@
+import re
+import asyncio
+import threading
+import concurrent.futures
+from llm_shell.http_cache import PageCache
+from llm_shell.search import Search, URLFetcher, client_session, FETCH_DEADLINE
+
+
+LINK_PATTERN = re.compile(r"https?://[^\s<>()\[\]\"'`]+")
+# Links of an answer that are prefetched for a follow-up question
+MAX_FOLLOW_UP_LINKS = 5
+
+
+def find_links(text: str, limit: int = MAX_FOLLOW_UP_LINKS) -> list[str]:
+    """The first limit distinct http(s) links in text."""
+
+    links = []
+    for match in LINK_PATTERN.finditer(text):
+        link = match.group(0).rstrip(".,;:!?")
+        if link not in links:
+            links.append(link)
+        if len(links) == limit:
+            break
+
+    return links
+
+
+class Prefetcher:
+    """
+    Resolves `@search` and `@url` references in the background, before the question
+    is submitted.
+
+    Searches and page fetches run on an event loop in a daemon thread and fill the
+    PageCache, so building the context afterwards reads the pages from disk. Every call
+    to update replaces the set of references: new ones are started and the ones that
+    are no longer referenced are cancelled.
+    """
+
+    def __init__(self, top_results: int = 3):
+
+        self.top_results = top_results
+
+        self._tasks = {}
+        # Only used from the loop thread, sqlite connections are bound to their thread
+        self._page_cache = None
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def update(self, searches: list[str] = (), urls: list[str] = ()):
+
+        wanted = {("search", query) for query in searches} | {("url", url) for url in urls}
+
+        for key in list(self._tasks):
+            if key not in wanted:
+                self._tasks.pop(key).cancel()
+
+        for kind, argument in wanted - self._tasks.keys():
+            resolve = self._search(argument) if kind == "search" else self._url(argument)
+            self._tasks[(kind, argument)] = asyncio.run_coroutine_threadsafe(
+                resolve, self._loop
+            )
+
+    def search_links(self, query: str, timeout: float = None) -> list[str] | None:
+        """The links found for query by a prefetched search, None if it was not prefetched."""
+
+        task = self._tasks.get(("search", query))
+
+        if task is None:
+            return None
+
+        try:
+            return task.result(timeout=timeout)
+        except Exception:
+            return None
+
+    def wait(self, timeout: float = FETCH_DEADLINE):
+        """Wait for the running prefetches, so their pages are cached."""
+        concurrent.futures.wait(list(self._tasks.values()), timeout=timeout)
+
+    def close(self):
+        """Cancel what is still running and stop the loop."""
+
+        self._tasks.clear()
+
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result()
+
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    async def _shutdown(self):
+
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        if self._page_cache is not None:
+            self._page_cache.close()
+
+    def _fetcher(self, session) -> URLFetcher:
+
+        if self._page_cache is None:
+            self._page_cache = PageCache()
+
+        return URLFetcher(session, cache=self._page_cache)
+
+    async def _search(self, query: str) -> list[str]:
+
+        async with client_session() as session:
+            fetcher = self._fetcher(session)
+            links = await Search(query, fetcher=fetcher).get_results(links_only=True)
+            links = links[: self.top_results] if self.top_results else links
+            await fetcher.parse_pages(links)
+
+        return links
+
+    async def _url(self, url: str):
+
+        async with client_session() as session:
+            await self._fetcher(session).parse_pages([url])
@@ -0,0 +1,157 @@
+import re
+import time
+from functools import lru_cache
+from rich.console import Console, Group
+from rich.live import Live
+from rich.markdown import Markdown
+from rich.syntax import Syntax
+
+
+FENCE_PATTERN = re.compile(r"^\s*(```|~~~)\s*([\w+-]*)")
+# Longer code blocks and lists are committed in pieces, so a frame does not re-render
+# more than this. Tables and paragraphs can not be cut and stay live until they end.
+MAX_LIVE_LINES = 40
+MAX_FPS = 12
+# A top-level list item, a list can be cut before it without changing its rendering
+LIST_ITEM_PATTERN = re.compile(r"^(?:[-*+]|\d{1,9}[.)])\s")
+
+
+@lru_cache(maxsize=None)
+def _lexer(language: str):
+    """Pygments lexer for language, looked up once, plain text when it is unknown."""
+
+    from pygments.lexers import get_lexer_by_name
+    from pygments.util import ClassNotFound
+
+    try:
+        return get_lexer_by_name(language)
+    except ClassNotFound:
+        return "text"
+
+
+class MarkdownStream:
+    """
+    Render streamed markdown incrementally.
+
+    The text is split into blocks as it arrives: paragraphs and lists end at a blank
+    line, code blocks at their closing fence. A finished block is rendered once and
+    printed above a Live region, which only shows the block still in progress and is
+    refreshed at most max_fps times per second. Code blocks are syntax highlighted.
+    Code blocks and lists are committed in pieces of about MAX_LIVE_LINES lines, cut
+    between lines of code or before a list item, so the cost of a frame does not grow
+    with the length of the answer.
+    """
+
+    def __init__(self, console: Console, max_fps: float = MAX_FPS, theme: str = "monokai"):
+
+        self.console = console
+        self.theme = theme
+        self.frame_interval = 1 / max_fps
+        self.frames = 0
+
+        self._lines = []
+        self._partial = ""
+        self._fence = None
+        self._language = ""
+        # Blank lines between blocks are printed once, however many were streamed
+        self._separated = True
+        self._last_frame = 0.0
+        self._live = Live(
+            console=console, auto_refresh=False, transient=True, vertical_overflow="visible"
+        )
+
+    def __enter__(self):
+        self._live.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def feed(self, text: str):
+
+        lines = (self._partial + text).split("\n")
+        self._partial = lines.pop()
+
+        for line in lines:
+            self._add_line(line)
+
+        now = time.monotonic()
+        if now - self._last_frame >= self.frame_interval:
+            self._last_frame = now
+            self._refresh()
+
+    def close(self):
+
+        if self._partial:
+            self._add_line(self._partial)
+            self._partial = ""
+
+        self._commit()
+
+        self._live.update("")
+        self._live.stop()
+
+    def _add_line(self, line: str):
+
+        fence = FENCE_PATTERN.match(line)
+
+        if self._fence is None and fence:
+            # A code block starts, the text before it is done
+            self._commit()
+            self._fence = fence.group(1)
+            self._language = fence.group(2) or "text"
+            return
+
+        if self._fence is not None and line.strip() == self._fence:
+            self._commit()
+            self._fence = None
+            return
+
+        if self._fence is None and not line.strip():
+            self._commit()
+            if not self._separated:
+                self._live.console.print()
+                self._separated = True
+            return
+
+        if len(self._lines) >= MAX_LIVE_LINES and self._can_cut_before(line):
+            self._commit()
+
+        self._lines.append(line)
+
+    def _can_cut_before(self, line: str) -> bool:
+
+        if self._fence is not None:
+            return True
+
+        return bool(LIST_ITEM_PATTERN.match(self._lines[0]) and LIST_ITEM_PATTERN.match(line))
+
+    def _render(self, lines: list[str]):
+
+        if self._fence is not None:
+            return Syntax(
+                "\n".join(lines), _lexer(self._language), theme=self.theme, word_wrap=True
+            )
+
+        return Markdown("\n".join(lines))
+
+    def _commit(self):
+        """Print the lines of the current block for good and start an empty one."""
+
+        if not self._lines:
+            return
+
+        renderable = self._render(self._lines)
+        self._lines = []
+        self._separated = False
+
+        # Printing redraws the Live region below, it must not show the block again
+        self._live.update(self._render([self._partial]) if self._partial else Group())
+        self._live.console.print(renderable)
+
+    def _refresh(self):
+
+        lines = self._lines + [self._partial] if self._partial else self._lines
+
+        self._live.update(self._render(lines) if lines else Group(), refresh=True)
+        self.frames += 1
@@ -0,0 +1,306 @@
+import os
+import json
+import hashlib
+from pathlib import Path
+from typing import Iterable
+import numpy as np
+from llm_shell.tokens import estimate_tokens
+
+
+# Stores with at least this many chunks are searched with the approximate index
+APPROXIMATE_INDEX_MIN_SIZE = 20000
+
+CHUNK_TEMPLATE = "Source:\n{source}\nContent:\n{content}"
+
+
+def chunk_text(text: str, max_chars: int = 2000, overlap: int = 200) -> list[str]:
+    """Split text into chunks of at most max_chars, cut at line boundaries where possible."""
+
+    chunks = []
+    start = 0
+
+    while start < len(text):
+
+        end = min(start + max_chars, len(text))
+
+        if end < len(text):
+            newline = text.rfind("\n", start + max_chars // 2, end)
+            if newline != -1:
+                end = newline + 1
+
+        chunks.append(text[start:end])
+
+        if end == len(text):
+            break
+
+        start = max(end - overlap, start + 1)
+
+    return chunks
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, len(scores))
+    if k == 0:
+        return np.zeros(0, dtype=np.int64)
+    ids = np.argpartition(-scores, k - 1)[:k]
+    return ids[np.argsort(-scores[ids])]
+
+
+class FlatIndex:
+    """Exact cosine similarity search over all vectors."""
+
+    def __init__(self, vectors: np.ndarray):
+        self.vectors = vectors
+
+    def search(self, query: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        scores = self.vectors @ _normalize(query)
+        ids = _top_k(scores, k)
+        return ids, scores[ids]
+
+
+class IVFIndex:
+    """
+    Approximate cosine similarity search with an inverted file index.
+
+    The vectors are clustered with k-means and a query only scans the vectors of the
+    nprobe clusters whose centroids are closest to it.
+    """
+
+    def __init__(
+        self,
+        vectors: np.ndarray,
+        centroids: np.ndarray,
+        assignments: np.ndarray,
+        nprobe: int = 8,
+    ):
+        self.vectors = vectors
+        self.centroids = centroids
+        self.nprobe = nprobe
+
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(len(centroids) + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(centroids))]
+
+    @staticmethod
+    def train(
+        vectors: np.ndarray, nlist: int = None, iterations: int = 10, seed: int = 0
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Spherical k-means, returns the centroids and the cluster of every vector."""
+
+        nlist = nlist or max(1, int(np.sqrt(len(vectors))))
+        rng = np.random.default_rng(seed)
+
+        centroids = vectors[rng.choice(len(vectors), size=nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+            for i in range(nlist):
+                members = vectors[assignments == i]
+                if len(members):
+                    centroids[i] = members.mean(axis=0)
+            centroids = _normalize(centroids)
+
+        return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+    def search(self, query: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+
+        query = _normalize(query)
+
+        probes = _top_k(self.centroids @ query, self.nprobe)
+        candidates = np.concatenate([self.lists[i] for i in probes])
+
+        scores = self.vectors[candidates] @ query
+        best = _top_k(scores, k)
+
+        return candidates[best], scores[best]
+
+
+class VectorIndex:
+    """
+    Chunks of a context store and their embeddings, persisted in a folder.
+
+    `chunks.json` holds the chunk texts and sources, `vectors.npy` the normalized
+    float32 embeddings (memory mapped on load) and `ivf.npz` the clustering of the
+    approximate index for large stores. Embeddings are reused by chunk digest, which
+    covers the embedding model, so only new or changed content is embedded when the
+    index is rebuilt.
+    """
+
+    def __init__(self, folder: Path):
+        self.folder = Path(folder)
+        self.chunks = []
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.index = None
+        self._assignments = None
+
+        self._load()
+
+    def _load(self):
+
+        chunks_file = self.folder / "chunks.json"
+
+        if not chunks_file.is_file():
+            return
+
+        with open(chunks_file, "r") as file:
+            self.chunks = json.load(file)
+
+        self.vectors = np.load(self.folder / "vectors.npy", mmap_mode="r")
+
+        ivf_file = self.folder / "ivf.npz"
+        if len(self.chunks) >= APPROXIMATE_INDEX_MIN_SIZE and ivf_file.is_file():
+            ivf = np.load(ivf_file)
+            self._assignments = ivf["assignments"]
+            self.index = IVFIndex(self.vectors, ivf["centroids"], self._assignments)
+        else:
+            self.index = FlatIndex(self.vectors)
+
+    def _save(self):
+
+        os.makedirs(self.folder, exist_ok=True)
+
+        # Files are replaced rather than rewritten, readers may still map the old ones
+        with open(self.folder / "vectors.npy.tmp", "wb") as file:
+            np.save(file, self.vectors)
+        os.replace(self.folder / "vectors.npy.tmp", self.folder / "vectors.npy")
+
+        if isinstance(self.index, IVFIndex):
+            with open(self.folder / "ivf.npz.tmp", "wb") as file:
+                np.savez(
+                    file,
+                    centroids=self.index.centroids,
+                    assignments=self._assignments,
+                )
+            os.replace(self.folder / "ivf.npz.tmp", self.folder / "ivf.npz")
+
+        with open(self.folder / "chunks.json.tmp", "w") as file:
+            json.dump(self.chunks, file)
+        os.replace(self.folder / "chunks.json.tmp", self.folder / "chunks.json")
+
+    def build(
+        self,
+        documents: Iterable[tuple[str, str, str]],
+        embed,
+        cache=None,
+        embed_model: str = "default",
+    ):
+        """
+        (Re)build the index for documents, (source, text, digest) tuples that are
+        iterated once, so they can be produced while the index is built.
+
+        embed maps a list of texts to a float32 matrix with one row per text. With a
+        FileCache the chunks and embeddings of every document are also stored as
+        artifacts of its content digest, so they are shared between context stores.
+        """
+
+        known = {
+            chunk["digest"]: self.vectors[i] for i, chunk in enumerate(self.chunks)
+        }
+
+        chunks = []
+        uncached = []
+        embeddings_artifact = f"embeddings:{embed_model}"
+
+        for source, text, digest in documents:
+
+            use_cache = cache is not None and digest is not None
+
+            contents = None
+            if use_cache:
+                cached_chunks = cache.get_artifact(digest, "chunks")
+                if cached_chunks is not None:
+                    contents = json.loads(cached_chunks)
+
+            if contents is None:
+                contents = chunk_text(text)
+                if use_cache:
+                    cache.set_artifact(digest, "chunks", json.dumps(contents).encode("utf-8"))
+
+            if not contents:
+                continue
+
+            # The model is part of the digest, vectors of another model never match
+            chunk_digests = [
+                hashlib.sha256(
+                    (embed_model + "\0" + source + "\0" + content).encode("utf-8")
+                ).hexdigest()
+                for content in contents
+            ]
+
+            cached_vectors = cache.get_artifact(digest, embeddings_artifact) if use_cache else None
+            if cached_vectors is not None:
+                vectors = np.frombuffer(cached_vectors, dtype=np.float32)
+                known.update(zip(chunk_digests, vectors.reshape(len(contents), -1)))
+            elif use_cache:
+                uncached.append((digest, chunk_digests))
+
+            chunks.extend(
+                {"source": source, "content": content, "digest": chunk_digest}
+                for content, chunk_digest in zip(contents, chunk_digests)
+            )
+
+        digests = [chunk["digest"] for chunk in chunks]
+
+        missing = {
+            chunk["digest"]: chunk["content"]
+            for chunk in chunks
+            if chunk["digest"] not in known
+        }
+        if missing:
+            embedded = np.asarray(embed(list(missing.values())), dtype=np.float32)
+            known.update(zip(missing, _normalize(embedded)))
+
+        for digest, chunk_digests in uncached:
+            cache.set_artifact(
+                digest,
+                embeddings_artifact,
+                np.stack([known[chunk_digest] for chunk_digest in chunk_digests])
+                .astype(np.float32)
+                .tobytes(),
+            )
+
+        if digests == [chunk["digest"] for chunk in self.chunks]:
+            return self
+
+        self.chunks = chunks
+        self.vectors = (
+            np.stack([known[digest] for digest in digests]).astype(np.float32)
+            if chunks
+            else np.zeros((0, 0), dtype=np.float32)
+        )
+
+        if len(chunks) >= APPROXIMATE_INDEX_MIN_SIZE:
+            centroids, self._assignments = IVFIndex.train(self.vectors)
+            self.index = IVFIndex(self.vectors, centroids, self._assignments)
+        else:
+            self.index = FlatIndex(self.vectors)
+
+        self._save()
+
+        return self
+
+    def select(self, query_vector: np.ndarray, top_k: int, max_tokens: int) -> list[dict]:
+        """The top_k chunks most similar to the query that fit in max_tokens, best first."""
+
+        if not self.chunks:
+            return []
+
+        ids, _ = self.index.search(np.asarray(query_vector, dtype=np.float32), top_k)
+
+        selected = []
+        budget = max_tokens
+
+        for i in ids:
+            chunk = self.chunks[i]
+            tokens = estimate_tokens(chunk["content"])
+            if tokens > budget:
+                continue
+            budget -= tokens
+            selected.append(chunk)
+
+        return selected
@@ -1,58 +1,180 @@
 import aiohttp
 import asyncio
+from contextlib import asynccontextmanager
 from bs4 import BeautifulSoup
+from urllib.parse import urlsplit
+from llm_shell.http_cache import PageCache
+from llm_shell.extract import extract, EXTRACT_VERSION
+
+
+def parse_html(url: str, html: str) -> dict:
+    return {"url": url, **extract(html)}
+
+
+# Per request, the body of a slow page is abandoned once total has passed
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=10, sock_connect=5)
+# Budget for fetching a batch of pages, the pages finished by then are returned
+FETCH_DEADLINE = 20
+MAX_PAGE_BYTES = 2 * 1024 * 1024
+MAX_CONNECTIONS = 16
+MAX_CONNECTIONS_PER_HOST = 4
+
+READ_CHUNK_BYTES = 64 * 1024
+
+
+def client_session(**kwargs) -> aiohttp.ClientSession:
+    return aiohttp.ClientSession(timeout=REQUEST_TIMEOUT, **kwargs)
 
 
 class URLFetcher:
     """
     A class for fetching content from URLs.
+
+    At most max_connections requests run at once, and at most max_connections_per_host
+    against a single host. Bodies are read until max_bytes and the rest is dropped.
+    Parsing runs on a thread so it does not block other downloads. Parsed pages are
+    kept in an optional PageCache and revalidated once stale.
     """
 
-    def __init__(self, session: aiohttp.ClientSession):
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        cache: PageCache = None,
+        max_bytes: int = MAX_PAGE_BYTES,
+        max_connections: int = MAX_CONNECTIONS,
+        max_connections_per_host: int = MAX_CONNECTIONS_PER_HOST,
+    ):
         self.session = session
+        self.cache = cache
+        self.max_bytes = max_bytes
+        self.max_connections_per_host = max_connections_per_host
+
+        self._connections = asyncio.Semaphore(max_connections)
+        self._host_connections = {}
+
+    @asynccontextmanager
+    async def _slot(self, url: str):
+
+        host = urlsplit(url).netloc
+        if host not in self._host_connections:
+            self._host_connections[host] = asyncio.Semaphore(self.max_connections_per_host)
+
+        async with self._host_connections[host], self._connections:
+            yield
+
+    async def _read_text(self, response: aiohttp.ClientResponse) -> str:
+        """The body of response as text, cut off after max_bytes."""
+
+        data = bytearray()
+
+        async for chunk in response.content.iter_chunked(READ_CHUNK_BYTES):
+            data += chunk
+            if len(data) >= self.max_bytes:
+                del data[self.max_bytes:]
+                break
+
+        return data.decode(response.charset or "utf-8", errors="replace")
 
     async def fetch_page(self, url, method="GET", data=None, headers=None):
-        if method.upper() == "POST":
-            async with self.session.post(url, data=data, headers=headers) as response:
-                return await response.text()
-        else:
-            async with self.session.get(url) as response:
-                return await response.text()
+        async with self._slot(url):
+            async with self.session.request(
+                method.upper(), url, data=data, headers=headers
+            ) as response:
+                return await self._read_text(response)
 
     async def parse_page_content(self, url):
 
-        html = ""
-        try:
-            html = await self.fetch_page(url)
-        except UnicodeDecodeError as e:
-            # Handle the error: log it, use a fallback encoding, etc.
-            pass
+        cached = self.cache.get(url) if self.cache is not None else None
 
-        soup = BeautifulSoup(html, "html.parser")
-        title = (
-            soup.find("title").get_text(strip=True)
-            if soup.find("title")
-            else "No title found"
+        if cached is not None and cached.is_fresh(self.cache.ttl):
+            return await self._cached_parse(cached)
+
+        async with self._slot(url):
+            async with self.session.get(
+                url, headers=cached.conditional_headers() if cached else None
+            ) as response:
+
+                if response.status == 304 and cached is not None:
+                    self.cache.revalidated(
+                        url,
+                        etag=response.headers.get("ETag"),
+                        last_modified=response.headers.get("Last-Modified"),
+                    )
+                    return await self._cached_parse(cached)
+
+                html = await self._read_text(response)
+
+        parsed = await self._parse(url, html)
+
+        if (
+            self.cache is not None
+            and response.status == 200
+            and "no-store" not in response.headers.get("Cache-Control", "")
+        ):
+            self.cache.put(
+                url,
+                html,
+                parsed,
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+            )
+
+        return parsed
+
+    async def _parse(self, url: str, html: str) -> dict:
+        return await asyncio.get_running_loop().run_in_executor(None, parse_html, url, html)
+
+    async def _cached_parse(self, cached) -> dict:
+        """The stored parse of a cached page, redone from its HTML if it is outdated."""
+
+        if cached.parsed.get("version") == EXTRACT_VERSION:
+            return cached.parsed
+
+        parsed = await self._parse(cached.url, cached.html)
+        self.cache.put(
+            cached.url, cached.html, parsed, etag=cached.etag, last_modified=cached.last_modified
         )
-        content_text = soup.get_text(separator=" ", strip=True)
-        code_snippets = soup.find_all(["code", "pre"])
-        codes = "\n\n\n".join([code.get_text(strip=True) for code in code_snippets])
-        return {"title": title, "url": url, "content": content_text, "codes": codes}
 
+        return parsed
 
-async def url_fetch(url):
-    async with aiohttp.ClientSession() as session:
-        fetcher = URLFetcher(session)
-        results = await fetcher.parse_page_content.get_results(url)
+    async def parse_pages(self, urls: list[str], deadline: float = FETCH_DEADLINE) -> list[dict]:
+        """
+        Parsed content of the urls that were fetched within deadline seconds, in the
+        order of urls. Pages that failed or were not done in time are left out.
+        """
+
+        tasks = [asyncio.ensure_future(self.parse_page_content(url)) for url in urls]
+
+        if not tasks:
+            return []
+
+        try:
+            _, pending = await asyncio.wait(tasks, timeout=deadline)
+        finally:
+            # Also when the caller is cancelled, no fetch outlives it
+            pending = [task for task in tasks if not task.done()]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        return [
+            task.result()
+            for task in tasks
+            if task not in pending and not task.cancelled() and task.exception() is None
+        ]
+
+
+async def url_fetch(url, cache: PageCache = None):
+    async with client_session() as session:
+        fetcher = URLFetcher(session, cache=cache)
+        results = await fetcher.parse_page_content(url)
         return results
 
 
-async def urls_fetch(urls):
-    async with aiohttp.ClientSession() as session:
-        fetcher = URLFetcher(session)
-        tasks = [fetcher.parse_page_content(link) for link in urls]
-        url_content = await asyncio.gather(*tasks)
-        return url_content
+async def urls_fetch(urls, cache: PageCache = None, deadline: float = FETCH_DEADLINE):
+    async with client_session() as session:
+        fetcher = URLFetcher(session, cache=cache)
+        return await fetcher.parse_pages(urls, deadline=deadline)
 
 
 class Search:
@@ -61,9 +183,15 @@ class Search:
     """
 
     def __init__(
-        self, query, time_range: str = "", region: str = "", fetcher: URLFetcher = None
+        self,
+        query,
+        time_range: str = "",
+        region: str = "",
+        fetcher: URLFetcher = None,
+        deadline: float = FETCH_DEADLINE,
     ):
         self.query = query
+        self.deadline = deadline
         self.time_range = time_range
         self.region = region
         self.fetcher = fetcher
@@ -88,21 +216,20 @@ class Search:
         if links_only:
             return links
 
-        # Fetch and parse each page linked in the search results
-        tasks = [self.fetcher.parse_page_content(link) for link in links]
-        return await asyncio.gather(*tasks)
+        # Fetch and parse the pages linked in the search results, within the deadline
+        return await self.fetcher.parse_pages(links, deadline=self.deadline)
 
 
-async def run_search(query, time_range="", region=""):
-    async with aiohttp.ClientSession() as session:
-        fetcher = URLFetcher(session)
+async def run_search(query, time_range="", region="", cache: PageCache = None):
+    async with client_session() as session:
+        fetcher = URLFetcher(session, cache=cache)
         search = Search(query, time_range, region, fetcher)
         results = await search.get_results()
         return results
 
 
 async def run_search_links(query, time_range="", region=""):
-    async with aiohttp.ClientSession() as session:
+    async with client_session() as session:
         fetcher = URLFetcher(session)
         search = Search(query, time_range, region, fetcher)
         links = await search.get_results(links_only=True)
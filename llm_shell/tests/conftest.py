@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The tests run against the package in this folder, installed or not
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
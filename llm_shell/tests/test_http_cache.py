@@ -0,0 +1,116 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from llm_shell.http_cache import PageCache
+from llm_shell.search import URLFetcher, client_session
+
+ETAG = '"v1"'
+LAST_MODIFIED = "Wed, 01 May 2024 10:00:00 GMT"
+PAGE = (
+    "<html><head><title>Backoff</title></head><body><main>"
+    "<p>Retries are spaced out with exponential backoff and full jitter, so that clients "
+    "which failed together do not all come back at the same moment.</p>"
+    "</main></body></html>"
+)
+
+
+def stub_site(cache_control: str = None):
+    """A site serving PAGE with validators, the requests it got are kept in requests."""
+
+    requests = []
+
+    async def page(request):
+        requests.append(dict(request.headers))
+
+        if request.headers.get("If-None-Match") == ETAG:
+            return web.Response(status=304, headers={"ETag": ETAG})
+
+        headers = {"ETag": ETAG, "Last-Modified": LAST_MODIFIED}
+        if cache_control:
+            headers["Cache-Control"] = cache_control
+
+        return web.Response(text=PAGE, content_type="text/html", headers=headers)
+
+    app = web.Application()
+    app.router.add_get("/page", page)
+
+    return app, requests
+
+
+async def fetch_twice(app: web.Application, cache: PageCache) -> tuple[dict, dict]:
+
+    server = TestServer(app, host="127.0.0.1")
+    await server.start_server()
+    url = str(server.make_url("/page"))
+
+    try:
+        async with client_session() as session:
+            fetcher = URLFetcher(session, cache=cache)
+            return await fetcher.parse_page_content(url), await fetcher.parse_page_content(url)
+    finally:
+        await server.close()
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_fresh_hit_makes_no_request(tmp_path):
+
+    app, requests = stub_site()
+    cache = PageCache(tmp_path / "pages.sqlite")
+
+    first, second = run(fetch_twice(app, cache))
+
+    assert len(requests) == 1
+    assert second == first
+    assert "Backoff" in first["title"]
+
+
+def test_stale_entry_is_revalidated(tmp_path):
+
+    app, requests = stub_site()
+    # Every entry is stale right away
+    cache = PageCache(tmp_path / "pages.sqlite", ttl=0)
+
+    first, second = run(fetch_twice(app, cache))
+
+    assert len(requests) == 2
+    assert "If-None-Match" not in requests[0]
+    assert requests[1]["If-None-Match"] == ETAG
+    assert requests[1]["If-Modified-Since"] == LAST_MODIFIED
+    # The 304 has no body, the stored parse is returned
+    assert second == first
+
+
+def test_no_store_is_not_cached(tmp_path):
+
+    app, requests = stub_site(cache_control="private, no-store")
+    cache = PageCache(tmp_path / "pages.sqlite")
+
+    first, second = run(fetch_twice(app, cache))
+
+    assert len(requests) == 2
+    assert "If-None-Match" not in requests[1]
+    assert cache.get(first["url"]) is None
+    assert second == first
+
+
+def test_least_recently_used_page_is_evicted(tmp_path):
+
+    parsed = {"version": 1}
+    html = "x" * 1000
+    # Room for two pages, not three
+    cache = PageCache(tmp_path / "pages.sqlite", max_bytes=2 * (len(html) + 20))
+
+    cache.put("https://a.example", html, parsed)
+    cache.put("https://b.example", html, parsed)
+    # a is used again, so b is now the least recently used
+    assert cache.get("https://a.example") is not None
+    cache.put("https://c.example", html, parsed)
+
+    assert cache.get("https://a.example") is not None
+    assert cache.get("https://b.example") is None
+    assert cache.get("https://c.example") is not None